@@ -0,0 +1,387 @@
+"""
+Admission control and fair scheduling of training runs.
+
+Every training request (/api/train, /api/train-stream, /api/jobs,
+/api/train-multi-stream) is costed before it runs, from a sample of its rows
+(a multi-target request costs one run per target):
+
+  shape         rows, features after encoding (numeric columns + one dummy per
+                category, mostly-unique columns extrapolated to all rows), classes
+  cpuSeconds    sum over the models of estimate_model_cost() x the ms per cost
+                unit observed in recent runs (timeouts.time_history), times a
+                run-level factor calibrated from the wall time of finished runs
+  peakMb        raw frame + encoded matrices + the working memory of the models
+                that run at once (memory factors observed in recent runs, see
+                memory.memory_history, x training matrix size)
+
+The instance has a memory capacity (ML_ADMISSION_MEMORY_MB; default the memory
+ceiling of memory.py, else 4096MB) and ML_ADMISSION_SLOTS concurrent runs.
+plan() decides when a request arrives:
+
+  admit       fits next to the runs in flight: starts at once
+  queue       fits the capacity, not next to the runs in flight: waits for
+              acquire() (SSE clients get 'queued' events); /api/train does
+              not wait and answers 503 (see acquire(wait=False))
+  downsample  over the capacity on its own: trains on a stratified row sample
+              sized to fit (ML_ADMISSION_DOWNSAMPLE=0 rejects instead)
+  reject      does not fit even at ML_ADMISSION_MIN_ROWS rows, or the wait
+              queue is full (AdmissionRejected)
+
+Fair share: when a run finishes, the next waiting request is the one whose
+client has the fewest runs in flight, then the fewest CPU-seconds used
+recently (decaying with a half-life of ML_ADMISSION_HALF_LIFE seconds), then
+the oldest. One client sending many heavy requests therefore waits behind
+everyone else's requests instead of starving them.
+"""
+import itertools
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from encoding import auto_mode, categorical_columns
+from instrumentation import record_stage
+from memory import current_rss_mb, memory_ceiling_mb, memory_history
+from model_factory import MODEL_BUILDERS
+from out_of_core import OOC_SAMPLE_ROWS, OOC_TEST_ROWS, ChunkedDataset
+from parallel import PARALLEL_WORKERS, WORKER_BASE_MB, estimate_model_cost
+from racing import stratified_sample
+from timeouts import time_history
+
+ADMISSION_ENABLED = os.environ.get("ML_ADMISSION", "1") == "1"
+ADMISSION_MEMORY_MB = int(os.environ.get("ML_ADMISSION_MEMORY_MB", "0"))
+ADMISSION_SLOTS = int(os.environ.get("ML_ADMISSION_SLOTS", "2"))
+ADMISSION_MAX_WAITING = int(os.environ.get("ML_ADMISSION_MAX_WAITING", "16"))
+ADMISSION_QUEUE_TIMEOUT = float(os.environ.get("ML_ADMISSION_QUEUE_TIMEOUT", "600"))
+ADMISSION_DOWNSAMPLE = os.environ.get("ML_ADMISSION_DOWNSAMPLE", "1") == "1"
+ADMISSION_MIN_ROWS = int(os.environ.get("ML_ADMISSION_MIN_ROWS", "1000"))
+ADMISSION_HALF_LIFE = float(os.environ.get("ML_ADMISSION_HALF_LIFE", "600"))
+
+# Capacity when neither ML_ADMISSION_MEMORY_MB nor a memory ceiling is set
+DEFAULT_CAPACITY_MB = 4096
+
+# Rows sampled from a request to estimate cardinalities and classes
+ESTIMATE_SAMPLE_ROWS = 2000
+
+# A downsampled request is sized to this share of the capacity (estimate error margin)
+DOWNSAMPLE_HEADROOM = 0.9
+
+# Bounds and smoothing of the run-level CPU calibration factor
+CALIBRATION_BOUNDS = (0.25, 4.0)
+CALIBRATION_WEIGHT = 0.3
+
+# How often a waiting request re-checks cancellation and its queue position (seconds)
+WAIT_POLL_SECONDS = 1.0
+
+MB = 1024 * 1024
+
+
+class AdmissionRejected(Exception):
+    """Raised when a training request cannot be admitted; status is the HTTP status to answer with."""
+
+    def __init__(self, message, status=503, estimate=None):
+        super().__init__(message)
+        self.status = status
+        self.estimate = estimate
+
+
+def _sample_frame(data):
+    """Up to ESTIMATE_SAMPLE_ROWS evenly spaced rows of a request's dataset, and its row count."""
+    if isinstance(data, ChunkedDataset):
+        chunks = data.chunks()
+        try:
+            first = next(chunks, None)
+        finally:
+            chunks.close()
+        if first is None:
+            raise ValueError("Uploaded dataset is empty")
+        # Out of core, only the reservoir samples are held in memory
+        return first.head(ESTIMATE_SAMPLE_ROWS), OOC_SAMPLE_ROWS + OOC_TEST_ROWS
+    step = max(1, len(data) // ESTIMATE_SAMPLE_ROWS)
+    if isinstance(data, pd.DataFrame):
+        return data.iloc[::step].head(ESTIMATE_SAMPLE_ROWS), len(data)
+    return pd.DataFrame(data[::step][:ESTIMATE_SAMPLE_ROWS]), len(data)
+
+
+def _targets(target_column):
+    """Target columns of a request: a list for multi-target requests (see multi_target.py)."""
+    return list(target_column) if isinstance(target_column, list) else [target_column]
+
+
+def estimate_shape(data, target_column):
+    """(rows, raw feature columns, features after encoding, classes, numeric columns) of a request's dataset."""
+    sample, n_rows = _sample_frame(data)
+    targets = _targets(target_column)
+    X = sample.drop(columns=targets, errors="ignore")
+    cat_cols = categorical_columns(X)
+    n_features = len(X.columns) - len(cat_cols)
+    for c in cat_cols:
+        unique = X[c].nunique()
+        if unique > len(X) / 2:
+            unique = unique * n_rows / max(len(X), 1)  # mostly unique: grows with the rows
+        n_features += max(int(unique) - 1, 0)
+    n_classes = max((sample[t].nunique() for t in targets if t in sample.columns), default=2)
+    return n_rows, len(X.columns), max(n_features, 1), max(n_classes, 2), len(X.columns) - len(cat_cols)
+
+
+def estimate_run(n_rows, n_raw, n_features, n_classes, options, cpu_factor=1.0, tasks=1, n_numeric=None):
+    """
+    CPU-seconds and peak MB of one training run (see module docstring). tasks > 1
+    is a multi-target run: one run per target over a shared encoded matrix.
+    n_numeric (numeric columns among n_raw; None = unknown, size alone) decides 'auto' encoding.
+    """
+    itemsize = 4 if options.get("compact") else 8
+    mode = options.get("encoding", "auto")
+    if mode == "auto":
+        n_numeric = n_numeric or 0
+        mode = auto_mode(n_rows, n_numeric, n_features - n_numeric)
+    if mode == "dense":
+        encoded_mb = n_rows * n_features * itemsize / MB
+        cost_features = n_features
+    else:
+        # CSR (value + column index per raw column) plus the native-categorical frame
+        encoded_mb = n_rows * n_raw * (2 * itemsize + 4) / MB
+        cost_features = n_raw
+    train_mb = encoded_mb * 0.8
+    workers = PARALLEL_WORKERS if options.get("parallel") else 1
+    factors = sorted((memory_history.factor(name) for name in MODEL_BUILDERS), reverse=True)
+    working_mb = sum(factors[:workers]) * max(train_mb, 1.0)
+    if workers > 1:
+        working_mb += WORKER_BASE_MB * workers
+    cpu_seconds = tasks * sum(
+        time_history.predict_seconds(name, estimate_model_cost(name, int(n_rows * 0.8), cost_features, n_classes))
+        for name in MODEL_BUILDERS
+    )
+    if tasks > 1:
+        # The shared matrix stays in memory next to each task's train/test rows
+        encoded_mb *= 2
+    return {
+        "rows": n_rows,
+        "features": n_features,
+        "classes": n_classes,
+        "encoding": mode,
+        "cpuSeconds": round(cpu_seconds * cpu_factor, 2),
+        "peakMb": round(n_rows * n_raw * 8 / MB + encoded_mb + working_mb, 1),
+    }
+
+
+def downsample(data, target_column, n_rows):
+    """
+    Stratified sample of n_rows rows of a request's dataset, as a DataFrame
+    (stratified on the first target of a multi-target request).
+    """
+    df = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+    rows = stratified_sample(np.arange(len(df)), df[_targets(target_column)[0]].to_numpy(), n_rows)
+    return df.iloc[np.sort(rows)].reset_index(drop=True)
+
+
+class Ticket:
+    """One admitted (or waiting) training run."""
+
+    _ids = itertools.count(1)
+
+    def __init__(self, client, estimate, decision, original_rows=None):
+        self.id = next(self._ids)
+        self.client = client
+        self.estimate = estimate
+        self.decision = decision
+        self.original_rows = original_rows  # set when downsampled
+        self.arrived = time.time()
+        self.started = None
+        self.waited = 0.0
+
+    def to_dict(self):
+        info = {
+            "client": self.client,
+            "decision": self.decision,
+            "estimate": self.estimate,
+            "queuedSeconds": round(self.waited, 2),
+        }
+        if self.original_rows is not None:
+            info["originalRows"] = self.original_rows
+            info["sampledRows"] = self.estimate["rows"]
+        return info
+
+
+class AdmissionController:
+    """Capacity accounting, the fair-share wait queue and the CPU calibration factor."""
+
+    def __init__(self, capacity_mb=None, slots=ADMISSION_SLOTS, max_waiting=ADMISSION_MAX_WAITING,
+                 queue_timeout=ADMISSION_QUEUE_TIMEOUT, downsample=ADMISSION_DOWNSAMPLE,
+                 min_rows=ADMISSION_MIN_ROWS, half_life=ADMISSION_HALF_LIFE):
+        self.capacity_mb = capacity_mb or ADMISSION_MEMORY_MB or memory_ceiling_mb() or DEFAULT_CAPACITY_MB
+        # Resident memory of the idle process (interpreter, Flask, libraries) is not available to runs
+        self.base_mb = current_rss_mb()
+        self.slots = slots
+        self.max_waiting = max_waiting
+        self.queue_timeout = queue_timeout
+        self.downsample = downsample
+        self.min_rows = min_rows
+        self.half_life = half_life
+        self.cpu_factor = 1.0
+        self._running = {}   # ticket id -> Ticket
+        self._waiting = []   # Tickets, in arrival order
+        self._usage = {}     # client -> (decayed CPU-seconds, time of last update)
+        self.admitted = self.queued = self.downsampled = self.rejected = 0
+        self._cond = threading.Condition()
+
+    # ---- planning ----
+
+    def plan(self, client, data, target_column, options):
+        """
+        Costs a request and decides how it runs. Returns (ticket, data), where
+        data is a stratified sample if the request was downsampled.
+        Raises AdmissionRejected.
+        """
+        n_rows, n_raw, n_features, n_classes, n_numeric = estimate_shape(data, target_column)
+        tasks = len(_targets(target_column))
+        estimate = estimate_run(n_rows, n_raw, n_features, n_classes, options, self.cpu_factor, tasks, n_numeric)
+        original_rows = None
+        decision = "admit"
+
+        budget_mb = self.capacity_mb - self.base_mb
+        if estimate["peakMb"] > budget_mb:
+            fit_rows = int(n_rows * max(budget_mb, 0) * DOWNSAMPLE_HEADROOM / estimate["peakMb"])
+            if not self.downsample or isinstance(data, ChunkedDataset) or fit_rows < self.min_rows:
+                self._count("rejected")
+                raise AdmissionRejected(
+                    f"Estimated peak memory {estimate['peakMb']:.0f}MB exceeds the {budget_mb:.0f}MB "
+                    f"available for training", status=413, estimate=estimate)
+            data = downsample(data, target_column, fit_rows)
+            estimate = estimate_run(len(data), n_raw, n_features, n_classes, options, self.cpu_factor, tasks,
+                                    n_numeric)
+            original_rows, decision = n_rows, "downsample"
+            self._count("downsampled")
+            print(f"[ADMISSION] {client}: downsampled {n_rows} -> {len(data)} rows to fit "
+                  f"{budget_mb:.0f}MB")
+
+        with self._cond:
+            if not self._fits(estimate):
+                if len(self._waiting) >= self.max_waiting:
+                    self.rejected += 1
+                    raise AdmissionRejected(f"Too many training requests waiting (max {self.max_waiting})",
+                                            status=503, estimate=estimate)
+                if decision == "admit":
+                    decision = "queue"
+        return Ticket(client, estimate, decision, original_rows), data
+
+    # ---- running ----
+
+    def acquire(self, ticket, cancel=None, on_wait=None, wait=True):
+        """
+        Blocks until the ticket may run (capacity and fair share). on_wait(position)
+        is called whenever the queue position changes. Returns False if `cancel`
+        was set while waiting. Raises AdmissionRejected after the queue timeout,
+        or at once with wait=False if the ticket cannot start now.
+        """
+        deadline = time.time() + self.queue_timeout
+        last_position = None
+        with self._cond:
+            self._waiting.append(ticket)
+            try:
+                while not self._may_start(ticket):
+                    if cancel is not None and cancel.is_set():
+                        return False
+                    if not wait:
+                        self.rejected += 1
+                        raise AdmissionRejected(
+                            "No capacity free for a synchronous run; retry later, or submit it to "
+                            "/api/jobs to wait in the queue", status=503, estimate=ticket.estimate)
+                    if time.time() > deadline:
+                        self.rejected += 1
+                        raise AdmissionRejected(
+                            f"Waited {self.queue_timeout:.0f}s for capacity; try again later",
+                            status=503, estimate=ticket.estimate)
+                    position = self._position(ticket)
+                    if on_wait is not None and position != last_position:
+                        last_position = position
+                        on_wait(position)
+                    self._cond.wait(WAIT_POLL_SECONDS)
+            finally:
+                self._waiting.remove(ticket)
+            ticket.started = time.time()
+            ticket.waited = ticket.started - ticket.arrived
+            self._running[ticket.id] = ticket
+            if ticket.waited > WAIT_POLL_SECONDS:
+                self.queued += 1
+            self.admitted += 1
+            self._cond.notify_all()
+        print(f"[ADMISSION] {ticket.client}: started run {ticket.id} "
+              f"(~{ticket.estimate['peakMb']:.0f}MB, ~{ticket.estimate['cpuSeconds']:.0f}s"
+              f"{f', waited {ticket.waited:.0f}s' if ticket.waited >= 1 else ''})")
+        record_stage("admission_wait", ticket.waited)
+        return True
+
+    def release(self, ticket, elapsed_seconds=None):
+        """
+        Frees the ticket's capacity and charges its client. elapsed_seconds (wall
+        time of a run that actually trained; None for replays and failures)
+        calibrates the CPU estimate.
+        """
+        with self._cond:
+            if self._running.pop(ticket.id, None) is None:
+                return
+            used = ticket.estimate["cpuSeconds"]
+            if elapsed_seconds is not None and used > 0:
+                ratio = elapsed_seconds / (used / self.cpu_factor)
+                ratio = min(max(ratio, CALIBRATION_BOUNDS[0]), CALIBRATION_BOUNDS[1])
+                self.cpu_factor += CALIBRATION_WEIGHT * (ratio - self.cpu_factor)
+                used = elapsed_seconds
+            self._charge(ticket.client, used)
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            now = time.time()
+            return {
+                "capacityMb": self.capacity_mb,
+                "baseMb": round(self.base_mb, 1),
+                "slots": self.slots,
+                "inUseMb": round(sum(t.estimate["peakMb"] for t in self._running.values()), 1),
+                "running": [t.to_dict() for t in self._running.values()],
+                "waiting": [t.to_dict() for t in self._waiting],
+                "clientUsage": {c: round(self._decayed(c, now), 2) for c in self._usage},
+                "cpuCalibration": round(self.cpu_factor, 3),
+                "admitted": self.admitted,
+                "queued": self.queued,
+                "downsampled": self.downsampled,
+                "rejected": self.rejected,
+            }
+
+    # ---- internals (called with self._cond held, except _count) ----
+
+    def _count(self, counter):
+        with self._cond:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+    def _fits(self, estimate):
+        if len(self._running) >= self.slots:
+            return False
+        in_use = sum(t.estimate["peakMb"] for t in self._running.values())
+        # A run that fits the capacity on its own always starts on an idle instance
+        return not self._running or self.base_mb + in_use + estimate["peakMb"] <= self.capacity_mb
+
+    def _priority(self, ticket, now):
+        running = sum(1 for t in self._running.values() if t.client == ticket.client)
+        return running, self._decayed(ticket.client, now), ticket.arrived
+
+    def _position(self, ticket):
+        now = time.time()
+        return sorted(self._waiting, key=lambda t: self._priority(t, now)).index(ticket) + 1
+
+    def _may_start(self, ticket):
+        return self._position(ticket) == 1 and self._fits(ticket.estimate)
+
+    def _decayed(self, client, now):
+        used, at = self._usage.get(client, (0.0, now))
+        return used * 0.5 ** ((now - at) / self.half_life)
+
+    def _charge(self, client, seconds):
+        now = time.time()
+        self._usage[client] = (self._decayed(client, now) + seconds, now)
+
+
+# Process-wide admission controller used by app.py and jobs.py
+admission_controller = AdmissionController()
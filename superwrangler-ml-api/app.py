@@ -1,11 +1,37 @@
-from flask import Flask, request, jsonify, Response
+from flask import Flask, request, jsonify, Response, stream_with_context
 from flask_cors import CORS
 from ml_engine import train_all_models, train_all_models_streaming
+from parallel import PARALLEL_DEFAULT
+from result_cache import result_cache
+from ingest import CHUNKED_TYPES, is_columnar, iter_body_chunks, read_columnar_body
+from encoding import COMPACT_DEFAULT, ENCODING_MODES
+from jobs import job_manager, QueueFullError
+from registry import SAVE_MODES, ModelNotFoundError, model_registry, rows_frame
+from model_factory import PRELOAD_MODELS, preload
+from scoring import BATCH_CHUNK_ROWS, MAX_CHUNK_ROWS, OUTPUT_FORMATS, score_chunks, serialize_chunks
+from out_of_core import OOC_THRESHOLD_MB, spool_body
+from warm_start import update_run
+from admission import ADMISSION_ENABLED, AdmissionRejected, admission_controller
+from multi_target import train_multi_target_streaming
+from instrumentation import metrics, span
+import itertools
 import json
+import os
+import queue
+import threading
+import time
 
 app = Flask(__name__)
 CORS(app)  # Allow requests from SuperWrangler frontend
 
+# With `gunicorn --preload`, this runs once in the master and the workers share the pages
+if PRELOAD_MODELS:
+    preload()
+
+# Seconds between SSE keep-alives while a model trains (also how fast a
+# closed /api/train-stream connection is noticed)
+STREAM_HEARTBEAT = float(os.environ.get("ML_STREAM_HEARTBEAT", "5"))
+
 @app.route("/api/health", methods=["GET"])
 def health_check():
     """Health check endpoint to confirm API is running."""
@@ -42,35 +68,277 @@ def get_algorithms():
         "excludedModels": excluded_from_advanced
     }), 200
 
-@app.route("/api/train", methods=["POST"])
-def train_models():
-    """Receives data, trains models, and returns results."""
-    try:
-        payload = request.json
-        
+def _option(payload, name, default):
+    """
+    Reads a boolean option from the JSON payload, or from the query string for
+    binary uploads. Strings parse the same way in both ("1", "true", "yes").
+    """
+    value = payload.get(name) if payload is not None else request.args.get(name)
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def _out_of_core():
+    """True if the training body should be spooled to disk and trained on in chunks."""
+    if (request.mimetype or "").lower() not in CHUNKED_TYPES:
+        return False
+    if _option(None, "outOfCore", False):
+        return True
+    return bool(OOC_THRESHOLD_MB and request.content_length
+                and request.content_length > OOC_THRESHOLD_MB * 1024 * 1024)
+
+
+def _target_param(payload, multi=False):
+    """
+    The target column, or with multi=True the list of target columns (JSON list,
+    or comma-separated in the query string). None if missing.
+    """
+    name = "targetColumns" if multi else "targetColumn"
+    value = payload.get(name) if payload is not None else request.args.get(name)
+    if multi and isinstance(value, str):
+        value = [c for c in value.split(",") if c]
+    return value or None
+
+
+def _parse_training_request(multi=False):
+    """Times _read_training_request (the "parse" stage, see instrumentation.py)."""
+    with span("parse"):
+        return _read_training_request(multi)
+
+
+def _read_training_request(multi=False):
+    """
+    Reads the dataset, target column and training options from the request.
+    
+    JSON body: {"data": [...rows], "targetColumn": ..., "parallel": ..., "useCache": ...,
+                "race": ..., "encoding": "auto" | "dense" | "sparse", "compact": ...,
+                "modelTimeLimit": seconds, "saveModels": "best" | "all" | "none", "profile": ...}
+    Binary body (Arrow IPC, Parquet, CSV - see ingest.py): the dataset itself, with
+    ?targetColumn=...&parallel=...&useCache=...&race=...&encoding=...&compact=...&modelTimeLimit=...
+    &saveModels=...&profile=... in the query string.
+    
+    With ?outOfCore=true, or for binary bodies over ML_OOC_THRESHOLD_MB, the body
+    (also NDJSON) is spooled to disk and trained on out of core (see out_of_core.py).
+    
+    multi=True reads a multi-target request (see multi_target.py): "targetColumns"
+    (list) instead of "targetColumn", plus optional "excludeColumns" (list).
+    target_column is then the list of targets.
+    
+    Returns (data, target_column, options, error); error is a message for a 400.
+    """
+    target_name = "targetColumns" if multi else "targetColumn"
+    if multi and _out_of_core():
+        return None, None, None, "Multi-target training needs the dataset in memory (no outOfCore)"
+    if _out_of_core():
+        target_column = request.args.get("targetColumn")
+        if not target_column:
+            return None, None, None, "Missing 'targetColumn' query parameter"
+        try:
+            data = spool_body(request.mimetype, request.stream)
+        except ValueError as e:
+            return None, None, None, f"Invalid data: {str(e)}"
+        payload = None
+    elif is_columnar(request.mimetype):
+        target_column = _target_param(None, multi)
+        if not target_column:
+            return None, None, None, f"Missing '{target_name}' query parameter"
+        try:
+            data = read_columnar_body(request.mimetype, request.get_data(cache=False))
+        except ValueError as e:
+            return None, None, None, f"Invalid data: {str(e)}"
+        if data.empty:
+            return None, None, None, "Uploaded dataset is empty"
+        payload = None
+    else:
+        payload = request.get_json(silent=True)
         if not payload:
-            return jsonify({"error": "No JSON payload provided"}), 400
+            return None, None, None, "No JSON payload provided"
             
         data = payload.get("data")
-        target_column = payload.get("targetColumn")
+        target_column = _target_param(payload, multi)
         
         if not data or not target_column:
-            return jsonify({"error": "Missing 'data' or 'targetColumn' in request"}), 400
+            return None, None, None, f"Missing 'data' or '{target_name}' in request"
         
         if not isinstance(data, list) or len(data) == 0:
-            return jsonify({"error": "Data must be a non-empty list"}), 400
+            return None, None, None, "Data must be a non-empty list"
+    
+    encoding = payload.get("encoding", "auto") if payload is not None else request.args.get("encoding", "auto")
+    if encoding not in ENCODING_MODES:
+        return None, None, None, f"Invalid encoding '{encoding}'. Use one of: {', '.join(ENCODING_MODES)}"
+    
+    time_limit = payload.get("modelTimeLimit") if payload is not None else request.args.get("modelTimeLimit")
+    if time_limit is not None:
+        try:
+            time_limit = float(time_limit)
+        except (TypeError, ValueError):
+            time_limit = -1
+        if time_limit < 0:
+            return None, None, None, "'modelTimeLimit' must be a number of seconds (0 = no limit)"
+    
+    save_models = payload.get("saveModels") if payload is not None else request.args.get("saveModels")
+    if save_models is not None and save_models not in SAVE_MODES:
+        return None, None, None, f"Invalid saveModels '{save_models}'. Use one of: {', '.join(SAVE_MODES)}"
+    
+    options = {
+        "parallel": _option(payload, "parallel", PARALLEL_DEFAULT),
+        "use_cache": _option(payload, "useCache", True),
+        "race": _option(payload, "race", False),
+        "encoding": encoding,
+        "compact": _option(payload, "compact", COMPACT_DEFAULT),
+        "model_time_limit": time_limit,
+        "save_models": save_models,
+        "profile": _option(payload, "profile", False),
+    }
+    if multi:
+        if payload is not None:
+            exclude = payload.get("excludeColumns") or []
+        else:
+            exclude = [c for c in request.args.get("excludeColumns", "").split(",") if c]
+        if (not isinstance(target_column, list) or not isinstance(exclude, list)
+                or not all(isinstance(c, str) for c in [*target_column, *exclude])):
+            return None, None, None, "'targetColumns' and 'excludeColumns' must be lists of column names"
+        options["exclude_columns"] = exclude
+    return data, target_column, options, None
+
+
+def _client_id():
+    """Client identity for fair share (see admission.py): X-Client-Id header, else the remote address."""
+    return request.headers.get("X-Client-Id") or request.remote_addr or "anonymous"
+
+
+def _admit(data, target_column, options):
+    """
+    Costs a training request and plans how it runs (see admission.py).
+    Returns (ticket, data, error_response); data is a row sample if the request
+    was downsampled, ticket is None with admission control off.
+    """
+    if not ADMISSION_ENABLED:
+        return None, data, None
+    try:
+        ticket, data = admission_controller.plan(_client_id(), data, target_column, options)
+    except AdmissionRejected as e:
+        return None, None, _rejected(e)
+    except (KeyError, ValueError) as e:
+        return None, None, (jsonify({"error": f"Invalid data: {str(e)}"}), 400)
+    return ticket, data, None
+
+
+def _rejected(e):
+    """Response for an AdmissionRejected: 413 too large for this instance, 503 busy (retry later)."""
+    response = jsonify({"error": str(e), "estimate": e.estimate})
+    if e.status == 503:
+        response.headers["Retry-After"] = "30"
+    return response, e.status
+
+
+@app.route("/api/train", methods=["POST"])
+def train_models():
+    """Receives data, trains models, and returns results."""
+    ticket = None
+    elapsed = None
+    try:
+        data, target_column, options, error = _parse_training_request()
+        if error:
+            return jsonify({"error": error}), 400
+        
+        ticket, data, rejected = _admit(data, target_column, options)
+        if rejected:
+            return rejected
+        if ticket is not None:
+            # Never wait for capacity here: a queued run would hold a request thread
+            admission_controller.acquire(ticket, wait=False)
             
         # Train models
-        results = train_all_models(data, target_column)
+        start = time.time()
+        results = train_all_models(data, target_column, **options)
+        if not results["replayed"]:
+            elapsed = time.time() - start
+        if ticket is not None:
+            results["admission"] = ticket.to_dict()
         
-        return jsonify(results), 200
+        with span("serialize"):
+            response = jsonify(results)
+        return response, 200
         
+    except AdmissionRejected as e:
+        return _rejected(e)
     except KeyError as e:
         return jsonify({"error": f"Missing required field: {str(e)}"}), 400
     except ValueError as e:
         return jsonify({"error": f"Invalid data: {str(e)}"}), 400
     except Exception as e:
         return jsonify({"error": f"Training failed: {str(e)}"}), 500
+    finally:
+        if ticket is not None:
+            admission_controller.release(ticket, elapsed)
+
+
+def _stream_with_cancel(data, target_column, options, ticket=None, train=train_all_models_streaming):
+    """
+    Runs train_all_models_streaming (or `train`, a generator with the same
+    signature) in a background thread and yields its events, or None every
+    STREAM_HEARTBEAT seconds while nothing happened.
+    
+    Sending those keep-alives is what notices a closed connection: the write
+    fails, the server closes this generator, and the run is cancelled instead
+    of training the remaining models for nobody.
+    
+    With an admission ticket the run first waits for capacity (see admission.py),
+    sending a 'queued' event whenever its queue position changes.
+    """
+    cancel = threading.Event()
+    events = queue.Queue()
+    
+    def queued(position):
+        events.put({"type": "queued", "position": position, "estimate": ticket.estimate})
+    
+    def produce():
+        elapsed = None
+        try:
+            if ticket is not None and not admission_controller.acquire(ticket, cancel=cancel, on_wait=queued):
+                return
+            start = time.time()
+            replayed = False
+            announced = False
+            for event in train(data, target_column, cancel=cancel, **options):
+                if event["type"] in ("start", "multi_start"):
+                    replayed = replayed or event.get("replayed", False)
+                    if ticket is not None and not announced:
+                        event = dict(event, admission=ticket.to_dict())
+                        announced = True
+                events.put(event)
+            if not replayed and not cancel.is_set():
+                elapsed = time.time() - start
+        except Exception as e:
+            events.put({"type": "error", "error": str(e)})
+        finally:
+            if ticket is not None:
+                admission_controller.release(ticket, elapsed)
+            events.put(None)
+    
+    threading.Thread(target=produce, name="ml-stream", daemon=True).start()
+    metrics.inc("ml_streams_active")
+    finished = False
+    try:
+        while True:
+            try:
+                event = events.get(timeout=STREAM_HEARTBEAT)
+            except queue.Empty:
+                yield None
+                continue
+            if event is None:
+                finished = True
+                return
+            yield event
+    finally:
+        metrics.inc("ml_streams_active", value=-1)
+        if not finished:
+            print("[STREAM] Client disconnected - cancelling training")
+            cancel.set()
 
 
 @app.route("/api/train-stream", methods=["POST"])
@@ -78,28 +346,28 @@ def train_models_stream():
     """
     Streams training results as each model completes using Server-Sent Events.
     MEMORY OPTIMIZED: Processes one model at a time with garbage collection.
+    Closing the connection cancels the run.
     """
     # Get request data before entering generator
-    payload = request.get_json()
-    if not payload:
-        return jsonify({"error": "No JSON payload provided"}), 400
-        
-    data = payload.get("data")
-    target_column = payload.get("targetColumn")
-    
-    if not data or not target_column:
-        return jsonify({"error": "Missing 'data' or 'targetColumn' in request"}), 400
-    
-    if not isinstance(data, list) or len(data) == 0:
-        return jsonify({"error": "Data must be a non-empty list"}), 400
+    data, target_column, options, error = _parse_training_request()
+    if error:
+        return jsonify({"error": error}), 400
+    ticket, data, rejected = _admit(data, target_column, options)
+    if rejected:
+        return rejected
     
     def generate():
         """Generator that yields SSE events for each model completion."""
+        stream = _stream_with_cancel(data, target_column, options, ticket)
         try:
             print("[STREAM] Starting memory-optimized model training stream...")
             # Stream results as they complete (ONE AT A TIME)
-            for event_data in train_all_models_streaming(data, target_column):
-                event = f"data: {json.dumps(event_data)}\n\n"
+            for event_data in stream:
+                if event_data is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                with span("serialize"):
+                    event = f"data: {json.dumps(event_data)}\n\n"
                 print(f"[STREAM] Yielding event type: {event_data.get('type')}")
                 yield event
             
@@ -109,19 +377,358 @@ def train_models_stream():
             print(f"[STREAM ERROR] {str(e)}")
             error_event = f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
             yield error_event
+        finally:
+            stream.close()
     
     # Create response with proper SSE headers
-    response = Response(generate(), mimetype='text/event-stream')
+    return _sse_response(generate())
+
+
+@app.route("/api/train-multi-stream", methods=["POST"])
+def train_multi_target_stream():
+    """
+    Streams a multi-target run (see multi_target.py): the feature columns are
+    encoded once and every model is trained for each target in turn. Every
+    event has a "target" field; closing the connection cancels the run.
+    
+    Same bodies as /api/train-stream, with "targetColumns" (list) instead of
+    "targetColumn" and optional "excludeColumns" (list) - comma-separated in
+    the query string for binary bodies.
+    """
+    data, target_columns, options, error = _parse_training_request(multi=True)
+    if error:
+        return jsonify({"error": error}), 400
+    ticket, data, rejected = _admit(data, target_columns, options)
+    if rejected:
+        return rejected
+    
+    def generate():
+        stream = _stream_with_cancel(data, target_columns, options, ticket, train=train_multi_target_streaming)
+        try:
+            print(f"[STREAM] Starting multi-target stream ({len(target_columns)} targets)...")
+            for event_data in stream:
+                if event_data is None:
+                    yield ": keep-alive\n\n"
+                    continue
+                with span("serialize"):
+                    event = f"data: {json.dumps(event_data)}\n\n"
+                yield event
+        except Exception as e:
+            print(f"[STREAM ERROR] {str(e)}")
+            yield f"data: {json.dumps({'type': 'error', 'error': str(e)})}\n\n"
+        finally:
+            stream.close()
+    
+    return _sse_response(generate())
+
+
+@app.route("/api/admission", methods=["GET"])
+def admission_stats():
+    """Capacity in use, running and waiting training requests, per-client usage (see admission.py)."""
+    return jsonify(admission_controller.stats()), 200
+
+
+def _register_gauges():
+    """Gauges read when /api/metrics is rendered (see instrumentation.py)."""
+    def admission_counts():
+        stats = admission_controller.stats()
+        return {(("state", "running"),): len(stats["running"]), (("state", "waiting"),): len(stats["waiting"]),
+                (("state", "in_use_mb"),): stats["inUseMb"]}
+    
+    def job_counts():
+        return {(("status", status),): count for status, count in job_manager.counts().items()}
+    
+    def cache_counts():
+        stats = result_cache.stats()
+        return {(("result", "hit"),): stats["hits"], (("result", "miss"),): stats["misses"]}
+    
+    metrics.register("ml_jobs", "gauge", "Training jobs by status (queue depth = queued)", job_counts)
+    metrics.register("ml_admission", "gauge", "Admission control: requests running, waiting, memory in use (MB)",
+                     admission_counts)
+    metrics.register("ml_result_cache_lookups_total", "counter", "Result cache lookups by result", cache_counts)
+
+
+_register_gauges()
+
+
+@app.route("/api/metrics", methods=["GET"])
+def metrics_endpoint():
+    """Stage and model latency histograms, run counters and queue gauges in the Prometheus text format."""
+    return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
+
+@app.route("/api/cache/results", methods=["DELETE"])
+def invalidate_result_cache():
+    """
+    Invalidates stored training results.
+    ?key=<resultKey> removes one run (resultKey is in the start event); no key clears all.
+    """
+    key = request.args.get("key")
+    try:
+        removed = result_cache.invalidate(key)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify({"removed": removed, "cache": result_cache.stats()}), 200
+
+
+def _sse_response(generator):
+    """Wraps an SSE generator in a Response with the streaming headers."""
+    response = Response(generator, mimetype='text/event-stream')
     response.headers['Cache-Control'] = 'no-cache'
     response.headers['Connection'] = 'keep-alive'
     response.headers['X-Accel-Buffering'] = 'no'  # Disable Nginx buffering
     response.headers['Access-Control-Allow-Origin'] = '*'
-    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, OPTIONS'
-    response.headers['Access-Control-Allow-Headers'] = 'Content-Type'
+    response.headers['Access-Control-Allow-Methods'] = 'GET, POST, DELETE, OPTIONS'
+    response.headers['Access-Control-Allow-Headers'] = 'Content-Type, Last-Event-ID'
+    return response
+
+
+@app.route("/api/jobs", methods=["POST"])
+def submit_job():
+    """
+    Submits a training job and returns immediately (202).
+    Accepts the same bodies as /api/train (JSON or Arrow/Parquet/CSV).
+    """
+    data, target_column, options, error = _parse_training_request()
+    if error:
+        return jsonify({"error": error}), 400
+    ticket, data, rejected = _admit(data, target_column, options)
+    if rejected:
+        return rejected
+    
+    try:
+        job = job_manager.submit(data, target_column, options, ticket=ticket)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 429
+    
+    return jsonify({
+        "jobId": job.id,
+        "status": job.status,
+        "statusUrl": f"/api/jobs/{job.id}",
+        "eventsUrl": f"/api/jobs/{job.id}/events"
+    }), 202
+
+
+@app.route("/api/jobs/<job_id>", methods=["GET"])
+def get_job(job_id):
+    """Job status plus the results of every model finished so far."""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify(job.to_dict()), 200
+
+
+@app.route("/api/jobs/<job_id>", methods=["DELETE"])
+def cancel_job(job_id):
+    """Cancels a queued or running job (a running job stops as soon as possible, see jobs.py)."""
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    return jsonify({"jobId": job.id, "status": job.status, "cancelRequested": job.cancel_requested}), 200
+
+
+@app.route("/api/jobs/<job_id>/events", methods=["GET"])
+def job_events(job_id):
+    """
+    Attaches to a job's SSE stream. All past events are sent first, then new
+    ones as they happen. Each event has an id (its index), so a reconnecting
+    client resumes with the Last-Event-ID header or ?from=<next index>.
+    """
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' not found"}), 404
+    
+    last_id = request.headers.get("Last-Event-ID")
+    try:
+        position = int(last_id) + 1 if last_id is not None else int(request.args.get("from", 0))
+    except ValueError:
+        return jsonify({"error": "Invalid Last-Event-ID / from"}), 400
+    
+    def generate():
+        nonlocal position
+        while True:
+            events, finished = job.wait_for_events(position, timeout=15)
+            for event_data in events:
+                yield f"id: {position}\ndata: {json.dumps(event_data)}\n\n"
+                position += 1
+            if finished and not events:
+                yield f"event: end\ndata: {json.dumps({'type': 'end', 'status': job.status})}\n\n"
+                return
+            if not events:
+                yield ": keep-alive\n\n"
+    
+    return _sse_response(generate())
+
+
+@app.route("/api/predict", methods=["POST"])
+def predict():
+    """
+    Predictions from a saved model (see registry.py).
+    
+    JSON body: {"modelId": ..., "rows": [...], "algorithm": optional (default: the
+                run's best model), "probabilities": optional bool}
+    Binary body (Arrow IPC, Parquet, CSV): the rows, with ?modelId=...&algorithm=...
+    &probabilities=... in the query string.
+    """
+    if is_columnar(request.mimetype):
+        payload = None
+        model_id = request.args.get("modelId")
+        algorithm = request.args.get("algorithm")
+        try:
+            rows = read_columnar_body(request.mimetype, request.get_data(cache=False))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    else:
+        payload = request.get_json(silent=True)
+        if not payload:
+            return jsonify({"error": "No JSON payload provided"}), 400
+        model_id = payload.get("modelId")
+        algorithm = payload.get("algorithm")
+        rows = payload.get("rows")
+        if not isinstance(rows, list):
+            return jsonify({"error": "'rows' must be a list of records"}), 400
+    if not model_id:
+        return jsonify({"error": "Missing 'modelId'"}), 400
+    
+    start = time.perf_counter()
+    try:
+        loaded = model_registry.load(model_id, algorithm)
+        X = rows_frame(rows)
+        if len(X) == 0:
+            return jsonify({"error": "No rows to predict"}), 400
+        labels, proba = loaded.predict(X, probabilities=_option(payload, "probabilities", False))
+    except ModelNotFoundError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid rows: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Prediction failed: {str(e)}"}), 500
+    
+    response = {
+        "modelId": model_id,
+        "algorithm": loaded.algorithm,
+        "predictions": labels.tolist(),
+        "count": len(labels),
+        "predictionTime": round((time.perf_counter() - start) * 1000, 2)
+    }
+    if proba is not None:
+        response["classes"] = loaded.classes
+        response["probabilities"] = proba.tolist()
+    return jsonify(response), 200
+
+
+@app.route("/api/predict-batch", methods=["POST"])
+def predict_batch():
+    """
+    Scores a large file with a saved model, streaming the predictions back
+    chunk by chunk (see scoring.py).
+    
+    Body: the rows as CSV, NDJSON, Arrow IPC or Parquet (by Content-Type).
+    Query: ?modelId=...&algorithm=...&format=ndjson|csv&probabilities=...
+           &idColumn=...&chunkRows=...
+    """
+    if (request.mimetype or "").lower() not in CHUNKED_TYPES:
+        return jsonify({"error": "Send the rows as CSV, NDJSON, Arrow or Parquet (Content-Type)"}), 415
+    model_id = request.args.get("modelId")
+    if not model_id:
+        return jsonify({"error": "Missing 'modelId' query parameter"}), 400
+    output_format = request.args.get("format", "ndjson")
+    if output_format not in OUTPUT_FORMATS:
+        return jsonify({"error": f"Invalid format '{output_format}'. Use one of: {', '.join(OUTPUT_FORMATS)}"}), 400
+    try:
+        chunk_rows = int(request.args.get("chunkRows", BATCH_CHUNK_ROWS))
+    except ValueError:
+        chunk_rows = 0
+    if not 0 < chunk_rows <= MAX_CHUNK_ROWS:
+        return jsonify({"error": f"'chunkRows' must be between 1 and {MAX_CHUNK_ROWS}"}), 400
+    id_column = request.args.get("idColumn")
+    
+    try:
+        loaded = model_registry.load(model_id, request.args.get("algorithm"))
+    except ModelNotFoundError as e:
+        return jsonify({"error": e.args[0]}), 404
+    
+    # The first chunk is read up front, so bad input still gets a 400
+    chunks = iter_body_chunks(request.mimetype, request.stream, chunk_rows)
+    try:
+        first = next(chunks, None)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    if first is None:
+        return jsonify({"error": "No rows to predict"}), 400
+    missing = loaded.transform.missing_columns(first)
+    if id_column and id_column not in first.columns:
+        missing.append(id_column)
+    if missing:
+        return jsonify({"error": f"Missing columns: {', '.join(map(str, missing))}"}), 400
     
+    frames = score_chunks(loaded, itertools.chain([first], chunks),
+                          probabilities=_option(None, "probabilities", False), id_column=id_column)
+    response = Response(stream_with_context(serialize_chunks(frames, output_format)),
+                        mimetype=OUTPUT_FORMATS[output_format])
+    response.headers['X-Accel-Buffering'] = 'no'
+    response.headers['X-Model-Id'] = model_id
+    response.headers['X-Algorithm'] = loaded.algorithm
     return response
 
 
+@app.route("/api/models", methods=["GET"])
+def list_models():
+    """Saved models, newest first."""
+    models = model_registry.list()
+    return jsonify({"models": models, "count": len(models), "loaded": model_registry.stats()}), 200
+
+
+@app.route("/api/models/<model_id>", methods=["GET"])
+def get_model(model_id):
+    try:
+        return jsonify(model_registry.metadata(model_id)), 200
+    except ModelNotFoundError as e:
+        return jsonify({"error": e.args[0]}), 404
+
+
+@app.route("/api/models/<model_id>/update", methods=["POST"])
+def update_model(model_id):
+    """
+    Warm-start update of a saved run with appended rows (see warm_start.py).
+    The updated models are saved under a new modelId.
+    
+    JSON body: {"data": [...rows, target column included]}
+    Binary body (Arrow IPC, Parquet, CSV): the rows.
+    """
+    if is_columnar(request.mimetype):
+        try:
+            rows = read_columnar_body(request.mimetype, request.get_data(cache=False))
+        except ValueError as e:
+            return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    else:
+        payload = request.get_json(silent=True)
+        if not payload:
+            return jsonify({"error": "No JSON payload provided"}), 400
+        rows = payload.get("data")
+        if not isinstance(rows, list) or len(rows) == 0:
+            return jsonify({"error": "'data' must be a non-empty list"}), 400
+    
+    try:
+        return jsonify(update_run(model_id, rows)), 200
+    except ModelNotFoundError as e:
+        return jsonify({"error": e.args[0]}), 404
+    except (ValueError, TypeError) as e:
+        return jsonify({"error": f"Invalid data: {str(e)}"}), 400
+    except Exception as e:
+        return jsonify({"error": f"Update failed: {str(e)}"}), 500
+
+
+@app.route("/api/models/<model_id>", methods=["DELETE"])
+def delete_model(model_id):
+    try:
+        model_registry.metadata(model_id)
+    except ModelNotFoundError as e:
+        return jsonify({"error": e.args[0]}), 404
+    model_registry.delete(model_id)
+    return jsonify({"modelId": model_id, "deleted": True}), 200
+
+
 if __name__ == "__main__":
     print("=" * 50)
     print("SuperWrangler ML API Starting (MEMORY OPTIMIZED)...")
@@ -130,10 +737,23 @@ if __name__ == "__main__":
     print("Algorithms:      http://127.0.0.1:5000/api/algorithms")
     print("Train (Batch):   POST http://127.0.0.1:5000/api/train")
     print("Train (Stream):  POST http://127.0.0.1:5000/api/train-stream")
+    print("Multi-Target:    POST http://127.0.0.1:5000/api/train-multi-stream")
+    print("Clear Results:   DELETE http://127.0.0.1:5000/api/cache/results")
+    print("Admission:       GET http://127.0.0.1:5000/api/admission")
+    print("Metrics:         GET http://127.0.0.1:5000/api/metrics")
+    print("Jobs:            POST http://127.0.0.1:5000/api/jobs")
+    print("Job Status:      GET/DELETE http://127.0.0.1:5000/api/jobs/<id>")
+    print("Job Events:      GET http://127.0.0.1:5000/api/jobs/<id>/events")
+    print("Predict:         POST http://127.0.0.1:5000/api/predict")
+    print("Batch Scoring:   POST http://127.0.0.1:5000/api/predict-batch?modelId=<id>")
+    print("Models:          GET/DELETE http://127.0.0.1:5000/api/models[/<id>]")
+    print("Update Model:    POST http://127.0.0.1:5000/api/models/<id>/update")
     print("=" * 50)
     print("Optimizations:")
     print("  • 3-fold CV (down from 5)")
     print("  • Sequential processing (n_jobs=1)")
+    print(f"  • Parallel model pool: {'on' if PARALLEL_DEFAULT else 'off'} (per request: \"parallel\": true)")
+    print(f"  • Out-of-core training: ?outOfCore=true (automatic above {OOC_THRESHOLD_MB}MB)")
     print("  • Reduced estimators (30-70% reduction)")
     print("  • Garbage collection after each model")
     print("=" * 50)
@@ -0,0 +1,317 @@
+"""
+Benchmark suite for the ML engine.
+
+Generates synthetic classification datasets offline over a grid of row
+counts, numeric feature counts, categorical cardinalities and class counts,
+runs every model from get_models() through the training pipeline and records
+wall time, CPU time and memory per stage (preprocess, fit, predict, cv).
+
+Usage:
+    python benchmark.py run                          # quick grid -> benchmarks/<timestamp>.json
+    python benchmark.py run --grid full --out base.json
+    python benchmark.py run --rows 1000,20000 --cardinality 0,500 --models "LightGBM,CatBoost"
+    python benchmark.py run --baseline base.json     # run, then compare
+    python benchmark.py run --compact --baseline base.json
+    python benchmark.py compare base.json new.json   # exit code 1 on regressions
+    python benchmark.py startup                      # import time + RSS of a fresh API worker
+
+A stage regresses when its wall time, CPU time or working memory grows by more
+than --threshold (relative) AND by more than a small absolute floor, so
+millisecond-level noise on tiny datasets is not flagged. A model that
+succeeded in the baseline but fails now, or whose F1 drops by more than
+--f1-drop, is flagged as well.
+"""
+import argparse
+import gc
+import itertools
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+GRIDS = {
+    "quick": {"rows": [1000, 5000], "features": [10], "cardinality": [0, 100], "classes": [2, 4]},
+    "full": {"rows": [1000, 10000, 50000], "features": [10, 50], "cardinality": [0, 100, 1000], "classes": [2, 5]},
+}
+CATEGORICAL_COLUMNS = 3
+METRICS = ("wallMs", "cpuMs", "workingMb")
+
+# Absolute change below which a relative regression is treated as noise
+NOISE_FLOOR = {"wallMs": 50.0, "cpuMs": 50.0, "workingMb": 10.0}
+DEFAULT_THRESHOLD = 0.25
+DEFAULT_F1_DROP = 0.02
+
+
+def make_dataset(rows, features, cardinality, classes, seed=0):
+    """
+    Synthetic classification DataFrame: `features` numeric columns, plus
+    CATEGORICAL_COLUMNS string columns with `cardinality` categories each
+    (none when cardinality is 0), and a 'target' column with `classes` labels.
+    The first categorical column carries signal; the others are noise.
+    """
+    from sklearn.datasets import make_classification
+
+    X, y = make_classification(
+        n_samples=rows, n_features=features, n_informative=max(2, features // 2),
+        n_redundant=0, n_classes=classes, n_clusters_per_class=1, random_state=seed,
+    )
+    df = pd.DataFrame(X, columns=[f"num_{i}" for i in range(features)])
+    if cardinality:
+        rng = np.random.default_rng(seed)
+        # Category correlated with the label (plus noise), then pure-noise columns
+        signal = (y * (cardinality // classes) + rng.integers(0, max(cardinality // classes, 1), rows)) % cardinality
+        df["cat_0"] = [f"c{v}" for v in signal]
+        for i in range(1, CATEGORICAL_COLUMNS):
+            df[f"cat_{i}"] = [f"c{v}" for v in rng.integers(0, cardinality, rows)]
+    df["target"] = [f"class_{v}" for v in y]
+    return df
+
+
+def dataset_id(rows, features, cardinality, classes):
+    return f"r{rows}-f{features}-k{cardinality}-c{classes}"
+
+
+def environment():
+    """Machine and library versions, so results from different hosts are not mixed up unnoticed."""
+    from result_cache import library_versions
+
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpuCount": os.cpu_count(),
+        "libraries": library_versions(),
+    }
+
+
+def _stage(memory, phase):
+    values = memory.get(phase) if memory else None
+    return {m: values[m] for m in METRICS} if values else None
+
+
+def run_benchmark(grid, model_names=None, encoding="auto", seed=0, compact=False):
+    """Runs every dataset of the grid through the pipeline. Returns the report dict."""
+    from memory import track_memory
+    from ml_engine import get_models, prepare_data, run_models
+
+    datasets = []
+    results = []
+    combos = list(itertools.product(grid["rows"], grid["features"], grid["cardinality"], grid["classes"]))
+    for idx, (rows, features, cardinality, classes) in enumerate(combos, 1):
+        ds_id = dataset_id(rows, features, cardinality, classes)
+        print(f"\n[{idx}/{len(combos)}] Dataset {ds_id}")
+        df = make_dataset(rows, features, cardinality, classes, seed=seed)
+
+        memory = {}
+        with track_memory("preprocess", memory):
+            prepared = prepare_data(df, "target", use_cache=False, encoding=encoding, compact=compact)
+        del df
+        datasets.append({
+            "id": ds_id, "rows": rows, "features": features, "cardinality": cardinality, "classes": classes,
+            "encoding": prepared["encoding"],
+            "preprocess": _stage(memory, "preprocess"),
+        })
+
+        models = get_models(model_names)
+        for name, result in run_models(models, prepared, parallel=False):
+            memory = result.get("memory")
+            results.append({
+                "dataset": ds_id,
+                "model": name,
+                "status": result["status"],
+                "f1": result["f1Score"],
+                "error": result.get("error"),
+                "memoryGuard": result.get("memoryGuard"),
+                "peakRssMb": memory["peakRssMb"] if memory else None,
+                "stages": {phase: _stage(memory, phase) for phase in ("fit", "predict", "cv")},
+            })
+            stages = results[-1]["stages"]
+            wall = sum(s["wallMs"] for s in stages.values() if s)
+            print(f"  {name}: {result['status']}, {wall:.0f}ms, F1 {result['f1Score']:.4f}")
+        del prepared
+        gc.collect()
+
+    return {
+        "version": 1,
+        "createdAt": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(),
+        "grid": grid,
+        "encoding": encoding,
+        "compact": compact,
+        "datasets": datasets,
+        "results": results,
+    }
+
+
+def _regressed(metric, old, new, threshold):
+    if old is None or new is None:
+        return False
+    return new - old > NOISE_FLOOR[metric] and new > old * (1 + threshold)
+
+
+def compare(baseline, current, threshold=DEFAULT_THRESHOLD, f1_drop=DEFAULT_F1_DROP):
+    """
+    Compares two reports. Returns a list of regression dicts
+    {dataset, model, stage, metric, baseline, current} (model is None for preprocess).
+    """
+    regressions = []
+
+    old_datasets = {d["id"]: d for d in baseline["datasets"]}
+    for dataset in current["datasets"]:
+        old = old_datasets.get(dataset["id"])
+        if not old or not old["preprocess"] or not dataset["preprocess"]:
+            continue
+        for metric in METRICS:
+            if _regressed(metric, old["preprocess"][metric], dataset["preprocess"][metric], threshold):
+                regressions.append({"dataset": dataset["id"], "model": None, "stage": "preprocess", "metric": metric,
+                                    "baseline": old["preprocess"][metric], "current": dataset["preprocess"][metric]})
+
+    old_results = {(r["dataset"], r["model"]): r for r in baseline["results"]}
+    for result in current["results"]:
+        old = old_results.get((result["dataset"], result["model"]))
+        if not old:
+            continue
+        where = {"dataset": result["dataset"], "model": result["model"]}
+        if old["status"] == "success" and result["status"] != "success":
+            regressions.append({**where, "stage": "status", "metric": "status",
+                                "baseline": old["status"], "current": result["status"]})
+            continue
+        if old["status"] == "success" and old["f1"] - result["f1"] > f1_drop:
+            regressions.append({**where, "stage": "quality", "metric": "f1",
+                                "baseline": old["f1"], "current": result["f1"]})
+        for stage, values in result["stages"].items():
+            old_values = old["stages"].get(stage)
+            if not values or not old_values:
+                continue
+            for metric in METRICS:
+                if _regressed(metric, old_values[metric], values[metric], threshold):
+                    regressions.append({**where, "stage": stage, "metric": metric,
+                                        "baseline": old_values[metric], "current": values[metric]})
+    return regressions
+
+
+def print_comparison(regressions, baseline, current):
+    if baseline["environment"] != current["environment"]:
+        print("⚠️  Baseline was recorded on a different environment:")
+        print(f"   baseline: {json.dumps(baseline['environment'])}")
+        print(f"   current:  {json.dumps(current['environment'])}")
+    if not regressions:
+        print("✓ No regressions against the baseline")
+        return
+    print(f"❌ {len(regressions)} regression(s) against the baseline:")
+    for r in regressions:
+        label = f"{r['dataset']} {r['model'] or ''} {r['stage']} {r['metric']}".replace("  ", " ")
+        if isinstance(r["baseline"], (int, float)) and isinstance(r["current"], (int, float)) and r["baseline"]:
+            change = f" ({(r['current'] / r['baseline'] - 1):+.0%})"
+        else:
+            change = ""
+        print(f"  {label}: {r['baseline']} -> {r['current']}{change}")
+
+
+# Run in a fresh interpreter: imports the API like a gunicorn worker does
+_STARTUP_PROBE = """
+import json, resource, time
+start = time.perf_counter()
+import app
+elapsed = time.perf_counter() - start
+print(json.dumps({"importSeconds": elapsed, "rssMb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024}))
+"""
+
+
+def measure_startup(repeats=3, preload=False):
+    """
+    Median import time and peak RSS of `import app` in fresh processes, i.e.
+    what a worker pays before it can answer /api/health.
+    """
+    env = dict(os.environ, ML_PRELOAD_MODELS="1" if preload else "0")
+    here = os.path.dirname(os.path.abspath(__file__))
+    samples = []
+    for _ in range(repeats):
+        out = subprocess.run([sys.executable, "-c", _STARTUP_PROBE], cwd=here, env=env,
+                             capture_output=True, text=True, check=True).stdout
+        samples.append(json.loads(out.strip().splitlines()[-1]))
+    return {
+        "preload": preload,
+        "importSeconds": round(statistics.median(s["importSeconds"] for s in samples), 3),
+        "rssMb": round(statistics.median(s["rssMb"] for s in samples), 1),
+    }
+
+
+def _int_list(value):
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+def _load(path):
+    with open(path) as f:
+        return json.load(f)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the SuperWrangler ML engine")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    run = sub.add_parser("run", help="run the benchmark grid")
+    run.add_argument("--grid", choices=sorted(GRIDS), default="quick")
+    run.add_argument("--rows", type=_int_list, help="override row counts, e.g. 1000,20000")
+    run.add_argument("--features", type=_int_list, help="override numeric feature counts")
+    run.add_argument("--cardinality", type=_int_list, help="override categorical cardinalities (0 = none)")
+    run.add_argument("--classes", type=_int_list, help="override class counts")
+    run.add_argument("--models", help="comma-separated model names (default: all)")
+    run.add_argument("--encoding", default="auto", choices=("auto", "dense", "sparse"))
+    run.add_argument("--seed", type=int, default=0)
+    run.add_argument("--compact", action="store_true", help="float32 matrices + integer labels")
+    run.add_argument("--out", help="output JSON (default: benchmarks/<timestamp>.json)")
+    run.add_argument("--baseline", help="compare against this report after the run")
+    run.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    run.add_argument("--f1-drop", type=float, default=DEFAULT_F1_DROP)
+
+    cmp = sub.add_parser("compare", help="compare two reports")
+    cmp.add_argument("baseline")
+    cmp.add_argument("current")
+    cmp.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD)
+    cmp.add_argument("--f1-drop", type=float, default=DEFAULT_F1_DROP)
+
+    startup = sub.add_parser("startup", help="measure API import time and worker RSS")
+    startup.add_argument("--repeats", type=int, default=3)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "startup":
+        for preload in (False, True):
+            stats = measure_startup(args.repeats, preload=preload)
+            label = "ML_PRELOAD_MODELS=1" if preload else "lazy (default)"
+            print(f"{label:<22} import {stats['importSeconds']:.2f}s, RSS {stats['rssMb']:.0f}MB")
+        return 0
+
+    if args.command == "compare":
+        baseline, current = _load(args.baseline), _load(args.current)
+    else:
+        grid = dict(GRIDS[args.grid])
+        for key in ("rows", "features", "cardinality", "classes"):
+            if getattr(args, key):
+                grid[key] = getattr(args, key)
+        model_names = [m.strip() for m in args.models.split(",")] if args.models else None
+
+        current = run_benchmark(grid, model_names=model_names, encoding=args.encoding, seed=args.seed,
+                                compact=args.compact)
+        out = args.out or os.path.join("benchmarks", time.strftime("%Y%m%d-%H%M%S") + ".json")
+        os.makedirs(os.path.dirname(out) or ".", exist_ok=True)
+        with open(out, "w") as f:
+            json.dump(current, f, indent=2)
+        print(f"\n✓ Benchmark written to {out}")
+        if not args.baseline:
+            return 0
+        baseline = _load(args.baseline)
+
+    regressions = compare(baseline, current, threshold=args.threshold, f1_drop=args.f1_drop)
+    print_comparison(regressions, baseline, current)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
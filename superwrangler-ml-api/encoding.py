@@ -0,0 +1,359 @@
+"""
+Feature encoding stage - picks a matrix representation per model.
+
+Modes:
+  dense   pd.get_dummies(drop_first=True) + StandardScaler, as a dense float64
+          matrix. Every model gets this matrix (the original pipeline), except
+          the histogram-based boosters, which get its bin codes (binning.py).
+  sparse  Numeric columns are standardized, and categoricals are one-hot encoded
+          into scipy CSR and scaled WITHOUT centering (centering would densify
+          them). Models that handle categoricals natively (LightGBM, CatBoost,
+          Histogram GB) get a DataFrame with the raw categorical columns
+          instead, so a zip code column stays one column, not thousands.
+  auto    sparse when the dense one-hot matrix would exceed ML_DENSE_LIMIT_MB
+          because of its dummy columns, dense otherwise (default). Numeric
+          columns stay dense however large: CSR would only add an index per
+          value, and the boosting / SVM models are slow on it.
+
+Compact mode (compact=True) builds float32 matrices instead of float64. The
+dense matrix is written straight from the feature columns into one
+preallocated buffer, block by block and in the requested row order, instead of
+going through get_dummies, astype and fit_transform copies. The scaler is fitted
+block by block and applied in place. Most models fit float32 input as is; the
+ones in UPCAST_MODELS would convert it to float64 on every fit and predict
+call, so they get one float64 copy up front instead.
+"""
+import copy
+import os
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from binning import BINNED_MODELS
+from instrumentation import span
+
+ENCODING_MODES = ("auto", "dense", "sparse")
+DENSE_LIMIT_MB = int(os.environ.get("ML_DENSE_LIMIT_MB", "256"))
+
+# float32 matrices + integer labels by default (per request: "compact")
+COMPACT_DEFAULT = os.environ.get("ML_COMPACT_DTYPES", "0") == "1"
+COMPACT_DTYPE = np.float32
+
+# Models that convert float32 input to float64 (liblinear, HistGB binning)
+UPCAST_MODELS = {"Linear SVC", "Histogram Gradient Boosting"}
+
+# Compact dense matrices are filled and scaled in row blocks of about this size
+BLOCK_BYTES = 16 * 1024 * 1024
+
+# Histogram-based learners bin categories into at most 255 bins; columns with
+# more categories are handed to them as ordinal codes instead
+MAX_NATIVE_CARDINALITY = 255
+
+# Models that accept raw categorical columns (pandas 'category' dtype)
+NATIVE_CATEGORICAL_MODELS = {"LightGBM", "CatBoost", "Histogram Gradient Boosting"}
+
+# Models that accept scipy CSR input
+SPARSE_MODELS = {
+    "Ridge Classifier", "SGD Classifier", "Perceptron",
+    "Extra Tree", "Extra Trees Ensemble",
+    "AdaBoost", "Gradient Boosting", "XGBoost", "LightGBM", "CatBoost",
+    "Bagging Classifier", "Voting Classifier", "Stacking Classifier",
+    "Linear SVC",
+}
+
+
+def categorical_columns(X):
+    """Columns pd.get_dummies would expand (object, string and category dtypes)."""
+    return [
+        c for c in X.columns
+        if X[c].dtype == object or isinstance(X[c].dtype, pd.CategoricalDtype)
+        or pd.api.types.is_string_dtype(X[c].dtype)
+    ]
+
+
+def matrix_nbytes(X):
+    """Memory held by a dense array, CSR matrix or DataFrame."""
+    if sp.issparse(X):
+        return X.data.nbytes + X.indices.nbytes + X.indptr.nbytes
+    if isinstance(X, pd.DataFrame):
+        return int(X.memory_usage(index=False, deep=False).sum())
+    return X.nbytes
+
+
+def take_rows(X, idx):
+    """Row subset of a dense array, CSR matrix or DataFrame."""
+    if isinstance(X, pd.DataFrame):
+        return X.iloc[idx].reset_index(drop=True)
+    return X[idx]
+
+
+def auto_mode(n_rows, n_numeric, n_dummies):
+    """'sparse' when one-hot dummy columns make the dense matrix exceed DENSE_LIMIT_MB, else 'dense'."""
+    dense_mb = n_rows * (n_numeric + n_dummies) * 8 / (1024 * 1024)
+    return "sparse" if dense_mb > DENSE_LIMIT_MB and n_dummies > n_numeric else "dense"
+
+
+def resolve_mode(X, mode):
+    """Turns 'auto' into 'dense' or 'sparse' from the projected dense one-hot size."""
+    if mode != "auto":
+        return mode
+    cat_cols = categorical_columns(X)
+    n_dummies = sum(max(X[c].nunique() - 1, 0) for c in cat_cols)
+    return auto_mode(len(X), len(X.columns) - len(cat_cols), n_dummies)
+
+
+class FeatureTransform:
+    """
+    The fitted state of encode_features (dummy column layout, scalers, one-hot
+    encoder, native category lists). transform() applies exactly the same
+    encoding to new rows, e.g. for predictions with a saved model.
+    """
+
+    # Transforms pickled before compact mode existed are float64
+    dtype = np.float64
+    # ... and those pickled before shared binning have no bins
+    bins = None
+
+    def __init__(self, mode, columns, cat_cols, scaler, dummy_columns=None,
+                 num_cols=None, one_hot=None, cat_scaler=None, categories=None, dtype=np.float64, bins=None):
+        self.mode = mode
+        self.columns = columns              # input feature columns, in training order
+        self.cat_cols = cat_cols
+        self.scaler = scaler                # dense: all dummies; sparse: numeric columns
+        self.dummy_columns = dummy_columns  # dense: pd.get_dummies(drop_first=True) layout
+        self.num_cols = num_cols            # sparse only
+        self.one_hot = one_hot
+        self.cat_scaler = cat_scaler
+        self.categories = categories        # training categories per categorical column (sparse, compact dense)
+        self.dtype = dtype
+        self.bins = bins                    # binning.BinMapper of the dense matrix, if binned
+
+    def with_bins(self, bins):
+        """Copy of this transform that also bins the dense matrix with a fitted BinMapper."""
+        transform = copy.copy(self)
+        transform.bins = bins
+        return transform
+
+    def missing_columns(self, X):
+        return [c for c in self.columns if c not in X.columns]
+
+    def transform(self, X):
+        """Encodes new rows. Returns {"matrix", "native", "binned"} like encode_features."""
+        missing = self.missing_columns(X)
+        if missing:
+            raise ValueError(f"Missing feature columns: {', '.join(map(str, missing))}")
+        X = X[self.columns]
+
+        if self.mode == "dense" and self.dtype == COMPACT_DTYPE:
+            matrix = _dense_compact(X, self.cat_cols, self.categories, len(self.dummy_columns))
+            _scale_in_place(self.scaler, matrix)
+            return self._dense(matrix)
+        if self.mode == "dense":
+            # Unseen categories get all-zero dummies; dropped first levels are not in the layout
+            dummies = pd.get_dummies(X, columns=self.cat_cols).reindex(columns=self.dummy_columns, fill_value=0)
+            return self._dense(self.scaler.transform(dummies.astype(np.float64)))
+
+        cat_values = X[self.cat_cols].astype(str)
+        blocks = []
+        if self.num_cols:
+            numeric = X[self.num_cols].astype(self.dtype).to_numpy()
+            blocks.append(sp.csr_matrix(self.scaler.transform(numeric)))
+        if self.cat_cols:
+            blocks.append(self.cat_scaler.transform(self.one_hot.transform(cat_values)))
+        matrix = sp.hstack(blocks, format="csr", dtype=self.dtype)
+
+        native = X[self.num_cols].astype(self.dtype)
+        for c in self.cat_cols:
+            values = pd.Categorical(cat_values[c], categories=self.categories[c])
+            if len(self.categories[c]) > MAX_NATIVE_CARDINALITY:
+                codes = values.codes.astype(self.dtype)
+                codes[codes < 0] = np.nan  # unseen category -> missing
+                native[c] = codes
+            else:
+                native[c] = values
+        return {"matrix": matrix, "native": native[self.columns], "binned": None}
+
+    def _dense(self, matrix):
+        binned = self.bins.transform(matrix) if self.bins is not None else None
+        return {"matrix": matrix, "native": None, "binned": binned}
+
+
+def _block_rows(n_columns, itemsize):
+    return max(1, BLOCK_BYTES // max(n_columns * itemsize, 1))
+
+
+def _dense_compact(X, cat_cols, categories, n_columns, row_order=None):
+    """
+    pd.get_dummies(X, drop_first=True) as one float32 array, written column by
+    column into row blocks of a preallocated buffer (rows in row_order, if given).
+    Categories not in `categories` get all-zero dummies.
+    """
+    n_rows = len(X) if row_order is None else len(row_order)
+    matrix = np.empty((n_rows, n_columns), dtype=COMPACT_DTYPE)
+    numeric = [X[c].to_numpy() for c in X.columns if c not in cat_cols]
+    codes = [pd.Categorical(X[c], categories=categories[c]).codes for c in cat_cols]
+    step = _block_rows(n_columns, matrix.itemsize)
+    for start in range(0, n_rows, step):
+        stop = min(start + step, n_rows)
+        rows = slice(start, stop) if row_order is None else row_order[start:stop]
+        block = matrix[start:stop]
+        for j, values in enumerate(numeric):
+            block[:, j] = values[rows]
+        col = len(numeric)
+        for c, c_codes in zip(cat_cols, codes):
+            width = len(categories[c]) - 1  # first level dropped
+            if width > 0:
+                block[:, col:col + width] = 0
+                sub = c_codes[rows].astype(np.intp)
+                hit = np.nonzero(sub >= 1)[0]
+                block[hit, col + sub[hit] - 1] = 1
+            col += width
+    return matrix
+
+
+def _scale_in_place(scaler, matrix, fit=False):
+    """Fits (optionally) and applies a StandardScaler block by block, overwriting matrix."""
+    step = _block_rows(matrix.shape[1], matrix.itemsize)
+    if fit:
+        for start in range(0, len(matrix), step):
+            scaler.partial_fit(matrix[start:start + step])
+    for start in range(0, len(matrix), step):
+        matrix[start:start + step] = scaler.transform(matrix[start:start + step])
+
+
+def encode_features(X, mode="auto", compact=False, row_order=None):
+    """
+    Encodes the feature frame. Returns a dict:
+      encoding    'dense' or 'sparse'
+      matrix      dense ndarray or CSR, for every model without native categoricals
+      native      DataFrame with categorical columns (sparse mode only, else None)
+      n_features  columns in `matrix`
+      transform   FeatureTransform that re-applies this encoding to new rows
+    
+    The bin codes for BINNED_MODELS are not computed here: their edges are
+    fitted on the training rows once the split is known (see binning.py).
+    
+    compact=True encodes to float32 (see module docstring). row_order (index
+    array) returns the rows of `matrix` and `native` in that order.
+    """
+    if mode not in ENCODING_MODES:
+        raise ValueError(f"Unknown encoding '{mode}'. Use one of: {', '.join(ENCODING_MODES)}")
+    mode = resolve_mode(X, mode)
+    cat_cols = categorical_columns(X)
+
+    if mode == "dense" and compact:
+        categories = {c: list(pd.Categorical(X[c]).categories) for c in cat_cols}
+        dummy_columns = [c for c in X.columns if c not in cat_cols]
+        dummy_columns += [f"{c}_{level}" for c in cat_cols for level in categories[c][1:]]
+        with span("dummies"):
+            matrix = _dense_compact(X, cat_cols, categories, len(dummy_columns), row_order)
+        scaler = StandardScaler(copy=False)
+        with span("scale"):
+            _scale_in_place(scaler, matrix, fit=True)
+        transform = FeatureTransform("dense", list(X.columns), cat_cols, scaler, dummy_columns=dummy_columns,
+                                     categories=categories, dtype=COMPACT_DTYPE)
+        return {"encoding": "dense", "matrix": matrix, "native": None, "n_features": matrix.shape[1],
+                "transform": transform}
+
+    if mode == "dense":
+        # One-hot encode categorical features
+        with span("dummies"):
+            X_encoded = pd.get_dummies(X, drop_first=True)
+        # Scale features (important for linear models)
+        scaler = StandardScaler()
+        with span("scale"):
+            matrix = scaler.fit_transform(X_encoded)
+        if row_order is not None:
+            matrix = matrix[row_order]
+        transform = FeatureTransform("dense", list(X.columns), cat_cols, scaler,
+                                     dummy_columns=list(X_encoded.columns))
+        return {"encoding": "dense", "matrix": matrix, "native": None, "n_features": matrix.shape[1],
+                "transform": transform}
+
+    dtype = COMPACT_DTYPE if compact else np.float64
+    num_cols = [c for c in X.columns if c not in cat_cols]
+    cat_values = X[cat_cols].astype(str)
+
+    blocks = []
+    scaler = one_hot = cat_scaler = None
+    if num_cols:
+        numeric = X[num_cols].astype(dtype).to_numpy()
+        scaler = StandardScaler()
+        with span("scale"):
+            blocks.append(sp.csr_matrix(scaler.fit_transform(numeric)))
+    if cat_cols:
+        one_hot = OneHotEncoder(drop="first", sparse_output=True, dtype=dtype, handle_unknown="ignore")
+        cat_scaler = StandardScaler(with_mean=False)
+        with span("dummies"):
+            blocks.append(cat_scaler.fit_transform(one_hot.fit_transform(cat_values)))
+    matrix = sp.hstack(blocks, format="csr", dtype=dtype)
+
+    # Raw columns for native-categorical learners (trees do not need scaling)
+    native = X[num_cols].astype(dtype)
+    categories = {}
+    for c in cat_cols:
+        values = cat_values[c].astype("category")
+        categories[c] = list(values.cat.categories)
+        if len(values.cat.categories) > MAX_NATIVE_CARDINALITY:
+            native[c] = values.cat.codes.astype(dtype)
+        else:
+            native[c] = values
+    native = native[list(X.columns)]
+    if row_order is not None:
+        matrix, native = matrix[row_order], take_rows(native, row_order)
+
+    print(f"Sparse encoding: {matrix.shape[1]} columns, "
+          f"{matrix.nnz / max(matrix.shape[0] * matrix.shape[1], 1):.1%} non-zero")
+    transform = FeatureTransform("sparse", list(X.columns), cat_cols, scaler, num_cols=num_cols,
+                                 one_hot=one_hot, cat_scaler=cat_scaler, categories=categories, dtype=dtype)
+    return {"encoding": "sparse", "matrix": matrix, "native": native, "n_features": matrix.shape[1],
+            "transform": transform}
+
+
+def model_inputs(name, encoded):
+    """
+    The representation one fitted model expects, from FeatureTransform.transform()
+    output (native categoricals, bin codes, CSR or dense) - same choice as inputs_for_model.
+    """
+    if name in NATIVE_CATEGORICAL_MODELS and encoded["native"] is not None:
+        return encoded["native"]
+    if name in BINNED_MODELS and encoded.get("binned") is not None:
+        return encoded["binned"]
+    matrix = encoded["matrix"]
+    if sp.issparse(matrix) and name not in SPARSE_MODELS:
+        matrix = matrix.toarray()
+    return _upcast(name, matrix)
+
+
+def _upcast(name, X):
+    """float64 copy of a compact matrix for models in UPCAST_MODELS (X itself otherwise)."""
+    if name in UPCAST_MODELS and X.dtype == COMPACT_DTYPE:
+        return X.astype(np.float64)
+    return X
+
+
+def inputs_for_model(name, model, prepared):
+    """
+    Chooses the representation for one model from a prepared dataset.
+    Returns (X_train, X_test) and configures `model` for native categoricals.
+    """
+    native_train = prepared.get("X_train_native")
+    if name in NATIVE_CATEGORICAL_MODELS and native_train is not None:
+        cat_cols = [c for c in native_train.columns if isinstance(native_train[c].dtype, pd.CategoricalDtype)]
+        if name == "CatBoost":
+            model.set_params(cat_features=cat_cols)
+        elif name == "Histogram Gradient Boosting":
+            model.set_params(categorical_features="from_dtype")
+        return native_train, prepared["X_test_native"]
+
+    binned_train = prepared.get("X_train_binned")
+    if name in BINNED_MODELS and binned_train is not None:
+        return binned_train, prepared["X_test_binned"]
+
+    X_train, X_test = prepared["X_train"], prepared["X_test"]
+    if sp.issparse(X_train) and name not in SPARSE_MODELS:
+        # Unknown model: only densify for models that need it
+        X_train, X_test = X_train.toarray(), X_test.toarray()
+    return _upcast(name, X_train), _upcast(name, X_test)
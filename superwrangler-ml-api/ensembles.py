@@ -0,0 +1,258 @@
+"""
+Ensemble stage - builds the Voting and Stacking classifiers from base learners
+that are already fitted, instead of refitting them inside each ensemble.
+
+Both ensembles in get_models() combine the same Ridge / ExtraTrees / SGD base
+learners. sklearn would fit those bases separately for Voting and for
+Stacking, run Stacking's internal 5-fold CV, and then refit BOTH ensembles
+three more times for our own CV. Here every base learner is fitted once on the
+training set and once per fold of the shared fold plan (evaluation.py):
+
+  - a base learner identical to a standalone model (Ridge Classifier, SGD
+    Classifier) reuses that model's fitted estimator and CV fold models;
+  - any other base learner (the 20-tree ExtraTrees) is fitted here, once,
+    and shared by both ensembles.
+
+The ensembles are then only combinations of those predictions:
+  - Voting (soft): average of predict_proba, exactly like VotingClassifier.
+  - Stacking: the final estimator is fitted on the out-of-fold outputs of the
+    bases over Stacking's own cv (the default 5-fold StratifiedKFold), so the
+    fitted ensemble is the same one sklearn would build. Those folds are not
+    the shared 3-fold plan, so each base is cross-fitted once more for them;
+    the shared fold models are reused only when Stacking's cv gives exactly
+    the shared folds.
+
+CV of the ensembles reuses the fold models of the bases. For Voting the fold
+predictions are averaged, which is exact. For Stacking each fold is a full
+stacking fit on that fold's training rows, like cross_val_score runs it: the
+fold's base models are the shared fold models, and the fold's final estimator
+is fitted on meta-features cross-fitted (Stacking's cv) on those training rows
+only. No held-out row reaches the final estimator it is scored with.
+"""
+import time
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+from sklearn.model_selection import check_cv
+
+from encoding import inputs_for_model, matrix_nbytes, take_rows
+from evaluation import evaluate_fitted, iter_folds
+from memory import summarize, track_memory
+from registry import save_model
+
+ENSEMBLE_MODELS = ("Voting Classifier", "Stacking Classifier")
+
+
+def _signature(estimator):
+    """Identity of an unfitted estimator: class + parameters."""
+    return type(estimator), tuple(sorted((k, str(v)) for k, v in estimator.get_params().items()))
+
+
+def reusable_base_models(models):
+    """Names of standalone models in `models` whose fits an ensemble can reuse."""
+    base_signatures = {
+        _signature(est)
+        for name in ENSEMBLE_MODELS if name in models
+        for _, est in models[name].estimators
+    }
+    return {
+        name for name, model in models.items()
+        if name not in ENSEMBLE_MODELS and _signature(model) in base_signatures
+    }
+
+
+def _stack_output(estimator, X):
+    """Meta-features of one base learner, as StackingClassifier(stack_method='auto') builds them."""
+    for method in ("predict_proba", "decision_function", "predict"):
+        if hasattr(estimator, method):
+            output = np.asarray(getattr(estimator, method)(X))
+            break
+    if output.ndim == 1:
+        return output.reshape(-1, 1)
+    if method == "predict_proba" and output.shape[1] == 2:
+        return output[:, 1:]  # binary: p(class 0) = 1 - p(class 1)
+    return output
+
+
+class _BaseLearner:
+    """A base learner fitted on the full training set and on each CV fold."""
+
+    def __init__(self, model, fold_models):
+        self.model = model
+        self.fold_models = fold_models
+
+    def oof(self, output, X_train, fold_ids):
+        """Out-of-fold `output(fold_model, X_val)` for every training row."""
+        result = None
+        for fold_model, (_, val_idx) in zip(self.fold_models, iter_folds(fold_ids)):
+            values = output(fold_model, take_rows(X_train, val_idx))
+            if result is None:
+                result = np.empty((len(fold_ids),) + values.shape[1:], dtype=values.dtype)
+            result[val_idx] = values
+        return result
+
+
+class PrefitVotingClassifier:
+    """Soft-voting combination of already fitted base learners."""
+
+    def __init__(self, estimators, params):
+        self.estimators_ = estimators
+        self.classes_ = estimators[0].classes_
+        self._params = params
+
+    def predict_proba(self, X):
+        return np.mean([est.predict_proba(X) for est in self.estimators_], axis=0)
+
+    def predict(self, X):
+        return self.classes_[np.argmax(self.predict_proba(X), axis=1)]
+
+    def get_params(self, deep=True):
+        return self._params
+
+
+class PrefitStackingClassifier:
+    """Final estimator over the stack outputs of already fitted base learners."""
+
+    def __init__(self, estimators, final_estimator, params):
+        self.estimators_ = estimators
+        self.final_estimator_ = final_estimator
+        self.classes_ = final_estimator.classes_
+        self._params = params
+
+    def transform(self, X):
+        return np.hstack([_stack_output(est, X) for est in self.estimators_])
+
+    def predict(self, X):
+        return self.final_estimator_.predict(self.transform(X))
+
+    def get_params(self, deep=True):
+        return self._params
+
+
+def _fit_base(estimator, X_train, y_train, fold_ids):
+    """Fits a base learner on the full training set and on every fold."""
+    model = clone(estimator).fit(X_train, y_train)
+    fold_models = [
+        clone(estimator).fit(take_rows(X_train, train_idx), y_train[train_idx])
+        for train_idx, _ in iter_folds(fold_ids)
+    ]
+    return _BaseLearner(model, fold_models)
+
+
+def _stack_features(ensemble, learners, X_train, y_train, fold_ids):
+    """
+    Out-of-fold meta-features of the base learners over Stacking's own cv, as
+    StackingClassifier builds them to fit its final estimator.
+    """
+    splits = list(check_cv(ensemble.cv, y_train, classifier=True).split(X_train, y_train))
+    shared = list(iter_folds(fold_ids))
+    if len(splits) == len(shared) and all(
+            np.array_equal(val_idx, shared_val) for (_, val_idx), (_, shared_val) in zip(splits, shared)):
+        return np.hstack([l.oof(_stack_output, X_train, fold_ids) for l in learners])
+    return _cross_fit_meta(learners, X_train, y_train, splits)
+
+
+def _cross_fit_meta(learners, X, y, splits):
+    """Out-of-fold meta-features of the base learners, refitted (unfitted clones) on each split."""
+    blocks = []
+    for learner in learners:
+        block = None
+        for train_idx, val_idx in splits:
+            fold_model = clone(learner.model).fit(take_rows(X, train_idx), y[train_idx])
+            values = _stack_output(fold_model, take_rows(X, val_idx))
+            if block is None:
+                block = np.empty((len(y),) + values.shape[1:], dtype=values.dtype)
+            block[val_idx] = values
+        blocks.append(block)
+    return np.hstack(blocks)
+
+
+def _combine(ensemble, bases, X_train, y_train, fold_ids):
+    """
+    Builds one Voting / Stacking model from fitted base learners (fitting any
+    missing base learner into `bases`). Returns (model, out-of-fold predictions).
+    """
+    from sklearn.ensemble import VotingClassifier, StackingClassifier
+    
+    learners = []
+    for label, estimator in ensemble.estimators:
+        signature = _signature(estimator)
+        if signature in bases:
+            print(f"  ↺ {label}: reusing fitted base learner")
+        else:
+            print(f"  + {label}: fitting base learner once for all ensembles")
+            bases[signature] = _fit_base(estimator, X_train, y_train, fold_ids)
+        learners.append(bases[signature])
+    params = ensemble.get_params()
+
+    if isinstance(ensemble, VotingClassifier):
+        missing = [type(l.model).__name__ for l in learners if not hasattr(l.model, "predict_proba")]
+        if ensemble.voting == "soft" and missing:
+            # Same failure VotingClassifier(voting='soft') hits at predict time
+            raise AttributeError(f"'{missing[0]}' object has no attribute 'predict_proba'")
+        model = PrefitVotingClassifier([l.model for l in learners], params)
+        oof_proba = np.mean(
+            [l.oof(lambda m, X: m.predict_proba(X), X_train, fold_ids) for l in learners], axis=0
+        )
+        return model, model.classes_[np.argmax(oof_proba, axis=1)]
+
+    if isinstance(ensemble, StackingClassifier):
+        final = clone(ensemble.final_estimator).fit(
+            _stack_features(ensemble, learners, X_train, y_train, fold_ids), y_train)
+        model = PrefitStackingClassifier([l.model for l in learners], final, params)
+        # CV of the ensemble: a stacking fit per fold on that fold's training rows only
+        oof_pred = np.empty(len(y_train), dtype=y_train.dtype)
+        for fold, (train_idx, val_idx) in enumerate(iter_folds(fold_ids)):
+            X_fold, y_fold = take_rows(X_train, train_idx), y_train[train_idx]
+            splits = list(check_cv(ensemble.cv, y_fold, classifier=True).split(X_fold, y_fold))
+            fold_final = clone(ensemble.final_estimator).fit(
+                _cross_fit_meta(learners, X_fold, y_fold, splits), y_fold)
+            X_val = take_rows(X_train, val_idx)
+            oof_pred[val_idx] = fold_final.predict(
+                np.hstack([_stack_output(l.fold_models[fold], X_val) for l in learners]))
+        return model, oof_pred
+
+    raise TypeError(f"{type(ensemble).__name__} is not a Voting or Stacking classifier")
+
+
+def train_ensembles(ensembles, prepared, base_artifacts):
+    """
+    Generator that yields (name, result) for each Voting / Stacking model in
+    `ensembles`. base_artifacts maps standalone model names to the artifacts
+    dict train_and_evaluate filled in for them (fitted model + fold models).
+    """
+    from ml_engine import build_result, failed_result
+
+    y_train, y_test = prepared["y_train"], prepared["y_test"]
+    fold_ids = prepared["cv_folds"]
+
+    # Fitted base learners by signature - from standalone runs first
+    bases = {}
+    for name, artifacts in base_artifacts.items():
+        if artifacts.get("fold_models"):
+            bases[_signature(artifacts["model"])] = _BaseLearner(artifacts["model"], artifacts["fold_models"])
+
+    for name, ensemble in ensembles.items():
+        print(f"Building {name} from shared base learners...")
+        memory = {}
+        try:
+            start_train = time.time()
+            X_train, X_test = inputs_for_model(name, ensemble, prepared)
+            with track_memory("fit", memory):
+                model, oof_pred = _combine(ensemble, bases, X_train, y_train, fold_ids)
+            training_time = (time.time() - start_train) * 1000  # Convert to ms
+
+            with track_memory("predict", memory):
+                metrics, _ = evaluate_fitted(model, X_train, y_train, X_test, y_test)
+            cv_scores = np.array([
+                f1_score(y_train[val_idx], oof_pred[val_idx], average='weighted', zero_division=0)
+                for _, val_idx in iter_folds(fold_ids)
+            ])
+            if prepared.get("model_dir"):
+                save_model(prepared["model_dir"], name, model)
+            yield name, build_result(name, model.get_params(), metrics, cv_scores.mean(), cv_scores.std(),
+                                     training_time, memory=summarize(memory, matrix_nbytes(X_train) / (1024 * 1024)))
+        except Exception as e:
+            print(f"  ❌ {name} failed: {str(e)}")
+            yield name, failed_result(name, e)
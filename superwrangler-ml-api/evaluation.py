@@ -0,0 +1,134 @@
+"""
+Single-pass evaluation engine used by train_and_evaluate.
+
+Each prediction array is computed exactly once per model:
+  - predict_proba(X_test)  -> ROC-AUC, and the test predictions as the
+                              argmax class (what predict() returns for these
+                              classifiers) -> accuracy, precision, recall, F1,
+                              confusion matrix, test score
+  - predict(X_test)        -> test predictions, only for models without predict_proba
+  - predict(X_train)       -> train score
+  - one predict per CV fold -> CV F1 mean/std + out-of-fold predictions
+
+(model.score() used to re-predict X_test and X_train. cross_val_score also
+predicted each fold once, but only kept the scores; here the fold predictions
+are kept as out-of-fold predictions for later stages.)
+
+Cross-validation follows a shared fold plan: a per-row fold id array computed
+once per dataset in prepare_data, so every model is validated on the same folds
+and the out-of-fold predictions of different models line up row for row.
+"""
+import time
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import (
+    accuracy_score, precision_recall_fscore_support, f1_score, roc_auc_score, confusion_matrix,
+)
+from sklearn.model_selection import StratifiedKFold, KFold
+
+from encoding import take_rows
+
+CV_FOLDS = 3
+
+
+def make_fold_ids(y_train, n_splits=CV_FOLDS):
+    """
+    Fold plan as an int8 array: fold_ids[i] = CV fold of training row i.
+    Same folds cross_val_score(cv=3) used (StratifiedKFold, no shuffle), with a
+    plain KFold fallback when a class is too small to stratify.
+    Returns None if there are too few rows for CV.
+    """
+    n_splits = min(n_splits, len(y_train) // 2)
+    if n_splits < 2:
+        return None
+    fold_ids = np.empty(len(y_train), dtype=np.int8)
+    try:
+        splits = list(StratifiedKFold(n_splits=n_splits).split(np.zeros(len(y_train)), y_train))
+    except ValueError:
+        splits = list(KFold(n_splits=n_splits).split(np.zeros(len(y_train))))
+    for fold, (_, val_idx) in enumerate(splits):
+        fold_ids[val_idx] = fold
+    return fold_ids
+
+
+def iter_folds(fold_ids):
+    """Yields (train_idx, val_idx) for each fold in a fold id array."""
+    for fold in range(int(fold_ids.max()) + 1):
+        yield np.flatnonzero(fold_ids != fold), np.flatnonzero(fold_ids == fold)
+
+
+def roc_auc_from_proba(y_true, proba):
+    """ROC-AUC from a predict_proba array (binary or weighted one-vs-rest)."""
+    if proba.shape[1] == 2:  # Binary classification
+        return roc_auc_score(y_true, proba[:, 1])
+    return roc_auc_score(y_true, proba, multi_class='ovr', average='weighted')  # Multi-class
+
+
+def cross_validate_oof(model, X_train, y_train, fold_ids, fold_models=None):
+    """
+    Fits a clone of `model` per fold and predicts the held-out rows once.
+    Returns (fold F1 scores, out-of-fold predictions). If a fold_models list is
+    passed, the fitted fold models are appended to it (in fold order).
+    """
+    oof_pred = np.empty(len(y_train), dtype=np.asarray(y_train).dtype)
+    scores = []
+    for train_idx, val_idx in iter_folds(fold_ids):
+        fold_model = clone(model)
+        fold_model.fit(take_rows(X_train, train_idx), y_train[train_idx])
+        # ravel: CatBoost returns an (n, 1) column
+        oof_pred[val_idx] = np.ravel(fold_model.predict(take_rows(X_train, val_idx)))
+        if fold_models is not None:
+            fold_models.append(fold_model)
+        scores.append(f1_score(y_train[val_idx], oof_pred[val_idx], average='weighted', zero_division=0))
+    return np.array(scores), oof_pred
+
+
+def evaluate_fitted(model, X_train, y_train, X_test, y_test):
+    """
+    All test/train metrics of an already fitted model, one inference pass per array.
+    For models with predict_proba, the test predictions are the argmax classes
+    of the same predict_proba(X_test) pass that gives ROC-AUC.
+    Returns (metrics dict, predictions dict).
+    """
+    start_pred = time.time()
+    proba = None
+    try:
+        if hasattr(model, "predict_proba"):
+            proba = np.asarray(model.predict_proba(X_test))
+    except Exception:
+        proba = None
+    if proba is not None:
+        y_pred = np.asarray(model.classes_)[np.argmax(proba, axis=1)]
+    else:
+        # ravel: CatBoost returns an (n, 1) column
+        y_pred = np.ravel(model.predict(X_test))
+    prediction_time = (time.time() - start_pred) * 1000  # Convert to ms
+    train_pred = model.predict(X_train)
+
+    accuracy = accuracy_score(y_test, y_pred)
+    precision, recall, f1, _ = precision_recall_fscore_support(
+        y_test, y_pred, average='weighted', zero_division=0
+    )
+
+    # ROC-AUC (if applicable) - from the same predict_proba array
+    roc_auc = None
+    try:
+        if proba is not None:
+            roc_auc = roc_auc_from_proba(y_test, proba)
+    except Exception:
+        roc_auc = None
+
+    metrics = {
+        "accuracy": accuracy,
+        "precision": precision,
+        "recall": recall,
+        "f1": f1,
+        "roc_auc": roc_auc,
+        "train_score": accuracy_score(y_train, train_pred),
+        "test_score": accuracy,  # classifier score() IS accuracy on the same predictions
+        "confusion_matrix": confusion_matrix(y_test, y_pred),
+        "prediction_time": prediction_time,
+    }
+    predictions = {"test_pred": y_pred, "test_proba": proba, "train_pred": train_pred}
+    return metrics, predictions
@@ -0,0 +1,225 @@
+"""
+Stage-level timing instrumentation, Prometheus metrics and run profiling.
+
+Spans: span(stage) times one stage of a training run (dataframe, split,
+dummies, scale, binning, encode, prepare, fingerprint, result_cache, training,
+registry_save, ... - see README) into
+
+  ml_stage_duration_seconds{stage}         histogram
+
+and into the run's trace (start_trace()). train_all_models_streaming puts the
+per-stage totals of its trace into the 'complete' event ("stageTimings", ms).
+The trace lives in a context variable, so each thread (request, stream
+producer, job worker) traces its own run.
+
+Models: the fit / predict / cv wall times come from each result's memory block
+(memory.track_memory), so models trained in the process pool or in a
+subprocess are counted too:
+
+  ml_model_duration_seconds{model,phase}   histogram
+  ml_model_results_total{model,status}     counter
+  ml_runs_total{outcome}                   counter (completed, replayed, failed, cancelled)
+
+Gauges (queue depth, jobs and streams in flight, admission state) are read
+from callbacks when GET /api/metrics renders the Prometheus text format.
+Metrics are per process: with several gunicorn workers, each reports its own.
+
+Profiling: a run started with "profile": true (or picked at random with
+probability ML_PROFILE_SAMPLE_RATE) runs under cProfile. Its 'complete' event
+gets a "profile" block with the top ML_PROFILE_TOP functions by cumulative
+time, and the full dump is written to ML_PROFILE_DIR when that is set. Only the
+thread running the stream is profiled: models trained in the process pool or a
+subprocess show up as the wait for their result.
+"""
+import contextvars
+import cProfile
+import os
+import pstats
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+METRICS_ENABLED = os.environ.get("ML_METRICS", "1") == "1"
+PROFILE_SAMPLE_RATE = float(os.environ.get("ML_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.environ.get("ML_PROFILE_DIR", "")
+PROFILE_TOP = int(os.environ.get("ML_PROFILE_TOP", "25"))
+
+# Histogram bucket upper bounds (seconds): stages range from milliseconds to minutes
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+
+# Type and help text of every metric
+METRICS = {
+    "ml_stage_duration_seconds": ("histogram", "Wall time of each stage of a training run"),
+    "ml_model_duration_seconds": ("histogram", "Wall time of each model phase (fit, predict, cv)"),
+    "ml_model_results_total": ("counter", "Model results by model and status"),
+    "ml_runs_total": ("counter", "Training runs by outcome"),
+    "ml_streams_active": ("gauge", "Training streams in flight (/api/train-stream, /api/train-multi-stream)"),
+    "ml_batch_scoring_errors_total": ("counter", "Batch scoring responses ended by an error midway"),
+}
+
+# Run phases of a result's memory block (see memory.track_memory)
+MODEL_PHASES = ("fit", "predict", "cv")
+
+
+def _labels_text(labels, extra=None):
+    items = list(labels) + ([extra] if extra else [])
+    if not items:
+        return ""
+    escaped = (str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"') for _, v in items)
+    return "{" + ",".join(f'{k}="{v}"' for (k, _), v in zip(items, escaped)) + "}"
+
+
+def _number(value):
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class MetricsRegistry:
+    """Thread-safe histograms, counters and gauges, rendered in the Prometheus text format."""
+
+    def __init__(self, buckets=DURATION_BUCKETS):
+        self.buckets = buckets
+        self._histograms = {}  # name -> {labels: [bucket counts..., sum, count]}
+        self._values = {}      # name -> {labels: value} (counters, gauges)
+        self._callbacks = {}   # name -> (type, help, fn returning a number or {labels dict: number})
+        self._lock = threading.Lock()
+
+    def observe(self, name, labels, seconds):
+        """Adds one observation to a histogram."""
+        if not METRICS_ENABLED:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {}).setdefault(key, [0] * (len(self.buckets) + 2))
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+
+    def inc(self, name, labels=None, value=1):
+        """Adds to a counter or gauge (a negative value decrements a gauge)."""
+        if not METRICS_ENABLED:
+            return
+        key = tuple(sorted((labels or {}).items()))
+        with self._lock:
+            values = self._values.setdefault(name, {})
+            values[key] = values.get(key, 0) + value
+
+    def register(self, name, kind, help_text, fn):
+        """Adds a metric read at render time. fn returns a number, or {labels dict as tuple: number}."""
+        self._callbacks[name] = (kind, help_text, fn)
+
+    def render(self):
+        lines = []
+        with self._lock:
+            histograms = {name: {k: list(v) for k, v in series.items()} for name, series in self._histograms.items()}
+            values = {name: dict(series) for name, series in self._values.items()}
+
+        for name, series in sorted(histograms.items()):
+            kind, help_text = METRICS.get(name, ("histogram", name))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, counts in sorted(series.items()):
+                for bound, count in zip(self.buckets, counts):
+                    lines.append(f"{name}_bucket{_labels_text(labels, ('le', _number(bound)))} {count}")
+                lines.append(f"{name}_bucket{_labels_text(labels, ('le', '+Inf'))} {counts[-1]}")
+                lines.append(f"{name}_sum{_labels_text(labels)} {counts[-2]!r}")
+                lines.append(f"{name}_count{_labels_text(labels)} {counts[-1]}")
+
+        for name, series in sorted(values.items()):
+            kind, help_text = METRICS.get(name, ("counter", name))
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            for labels, value in sorted(series.items()):
+                lines.append(f"{name}{_labels_text(labels)} {_number(value)}")
+
+        for name, (kind, help_text, fn) in sorted(self._callbacks.items()):
+            try:
+                value = fn()
+            except Exception as e:
+                print(f"⚠️ Metric {name} failed: {str(e)}")
+                continue
+            lines += [f"# HELP {name} {help_text}", f"# TYPE {name} {kind}"]
+            series = value if isinstance(value, dict) else {(): value}
+            for labels, number in sorted(series.items()):
+                lines.append(f"{name}{_labels_text(labels)} {_number(number)}")
+        return "\n".join(lines) + "\n"
+
+
+# Process-wide metrics registry used by ml_engine, app.py and the stages they call
+metrics = MetricsRegistry()
+
+_trace = contextvars.ContextVar("ml_trace", default=None)
+
+
+def start_trace():
+    """Starts the stage trace of a run in this thread. Returns it ({stage: total ms})."""
+    trace = {}
+    _trace.set(trace)
+    return trace
+
+
+def record_stage(stage, seconds):
+    """Records a stage duration measured by the caller (see span)."""
+    metrics.observe("ml_stage_duration_seconds", {"stage": stage}, seconds)
+    trace = _trace.get()
+    if trace is not None:
+        trace[stage] = trace.get(stage, 0.0) + seconds * 1000
+
+
+@contextmanager
+def span(stage):
+    """Times a stage into ml_stage_duration_seconds and the current run's trace."""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(stage, time.perf_counter() - start)
+
+
+def count_run(outcome):
+    metrics.inc("ml_runs_total", {"outcome": outcome})
+
+
+def observe_result(name, result):
+    """Records one model result: its status and the wall time of its fit / predict / cv phases."""
+    metrics.inc("ml_model_results_total", {"model": name, "status": result["status"]})
+    memory = result.get("memory") or {}
+    for phase in MODEL_PHASES:
+        block = memory.get(phase)
+        if isinstance(block, dict) and "wallMs" in block:
+            metrics.observe("ml_model_duration_seconds", {"model": name, "phase": phase}, block["wallMs"] / 1000)
+
+
+def start_profile(requested=False):
+    """An enabled cProfile.Profile if the run is profiled (requested or sampled), else None."""
+    sampled = not requested and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+    if not (requested or sampled):
+        return None
+    profiler = cProfile.Profile()
+    profiler.sampled = sampled
+    profiler.enable()
+    return profiler
+
+
+def profile_report(profiler, run_key):
+    """Stops the profiler. Returns the run's "profile" block (top functions, dump file)."""
+    profiler.disable()
+    path = None
+    if PROFILE_DIR:
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        path = os.path.join(PROFILE_DIR, f"{run_key[:12]}-{int(time.time())}.prof")
+        profiler.dump_stats(path)
+    stats = pstats.Stats(profiler).sort_stats("cumulative")
+    top = []
+    for func in stats.fcn_list[:PROFILE_TOP]:
+        _, calls, total, cumulative, _ = stats.stats[func]
+        filename, line, function = func
+        top.append({
+            "function": f"{os.path.basename(filename)}:{line}({function})" if line else function,
+            "calls": calls,
+            "totalTime": round(total * 1000, 2),
+            "cumulativeTime": round(cumulative * 1000, 2),
+        })
+    print(f"⏱ Profiled run {run_key[:12]}: {stats.total_calls} calls{f', dump: {path}' if path else ''}")
+    return {"sampled": profiler.sampled, "totalCalls": stats.total_calls, "sortedBy": "cumulative",
+            "top": top, "file": path}
@@ -0,0 +1,222 @@
+"""
+Asynchronous training jobs.
+
+A job is one train_all_models_streaming() run executed by a bounded pool of
+background worker threads instead of the HTTP request thread. Every event the
+run produces is kept on the job, so clients can poll the status, or attach
+(and re-attach after a dropped connection) to the SSE stream and receive the
+events they missed without restarting training.
+
+Job lifecycle: queued -> running -> completed | failed | cancelled
+Finished jobs are kept for ML_JOB_TTL seconds, then forgotten.
+"""
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+from admission import AdmissionRejected, admission_controller
+from ml_engine import train_all_models_streaming
+
+JOB_WORKERS = int(os.environ.get("ML_JOB_WORKERS", "1"))
+JOB_MAX_QUEUED = int(os.environ.get("ML_JOB_MAX_QUEUED", "8"))
+JOB_TTL = int(os.environ.get("ML_JOB_TTL", "3600"))  # seconds
+
+FINISHED_STATES = ("completed", "failed", "cancelled")
+
+
+class QueueFullError(Exception):
+    """Raised when too many jobs are already waiting for a worker."""
+
+
+class Job:
+    """State of one training job. Mutated only under the job's condition lock."""
+
+    def __init__(self, data, target_column, options, ticket=None):
+        self.id = uuid.uuid4().hex
+        self.target_column = target_column
+        self.options = options
+        self.data = data  # released as soon as the run starts
+        self.ticket = ticket  # admission ticket (see admission.py), None = not admission controlled
+        self.status = "queued"
+        self.events = []
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_requested = False
+        self.cancel_event = threading.Event()  # cooperative cancellation of the run
+        self.future = None
+        self.condition = threading.Condition()
+
+    def to_dict(self):
+        """Status plus the results of every model finished so far."""
+        with self.condition:
+            model_events = [e for e in self.events if e["type"] == "model_complete"]
+            results = [e["result"] for e in model_events]
+            start = next((e for e in self.events if e["type"] == "start"), None)
+            summary = next((e for e in self.events if e["type"] == "complete"), None)
+            return {
+                "jobId": self.id,
+                "status": self.status,
+                "targetColumn": self.target_column,
+                "createdAt": self.created_at,
+                "startedAt": self.started_at,
+                "finishedAt": self.finished_at,
+                "completedModels": len(results),
+                "totalModels": model_events[-1]["totalModels"] if model_events else None,
+                "datasetInfo": start["datasetInfo"] if start else None,
+                "results": summary["results"] if summary else results,
+                "bestModel": summary["bestModel"] if summary else None,
+                "totalTime": summary["totalTime"] if summary else None,
+                "error": self.error,
+                "admission": self.ticket.to_dict() if self.ticket is not None else None,
+            }
+
+    def wait_for_events(self, after, timeout):
+        """
+        Blocks until there are events past index `after`, the job finishes, or
+        the timeout passes. Returns (new_events, finished).
+        """
+        with self.condition:
+            if len(self.events) <= after and self.status not in FINISHED_STATES:
+                self.condition.wait(timeout)
+            return self.events[after:], self.status in FINISHED_STATES
+
+    def _append(self, event):
+        with self.condition:
+            self.events.append(event)
+            self.condition.notify_all()
+
+    def _finish(self, status, error=None):
+        with self.condition:
+            self.status = status
+            self.error = error
+            self.finished_at = time.time()
+            self.data = None
+            self.condition.notify_all()
+
+
+class JobManager:
+    """Bounded local worker pool plus the registry of submitted jobs."""
+
+    def __init__(self, workers=JOB_WORKERS, max_queued=JOB_MAX_QUEUED, ttl=JOB_TTL):
+        self.workers = workers
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="ml-job")
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    def submit(self, data, target_column, options, ticket=None):
+        """
+        Queues a training run. Raises QueueFullError when the queue is full.
+        With an admission ticket, the job stays queued until the admission
+        controller lets it start.
+        """
+        self._expire()
+        with self._lock:
+            if self.counts()["queued"] >= self.max_queued:
+                raise QueueFullError(f"Too many queued jobs (max {self.max_queued})")
+            job = Job(data, target_column, options, ticket)
+            self._jobs[job.id] = job
+            job.future = self._executor.submit(self._run, job)
+        print(f"[JOBS] Queued job {job.id}")
+        return job
+
+    def get(self, job_id):
+        self._expire()
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def cancel(self, job_id):
+        """
+        Cancels a job. Queued jobs never start; running jobs stop before the
+        next model, and a model running in a subprocess (see timeouts.py) is
+        killed. Returns the job, or None if unknown.
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        with job.condition:
+            if job.status in FINISHED_STATES:
+                return job
+            job.cancel_requested = True
+            job.cancel_event.set()
+        if job.future.cancel():
+            job._finish("cancelled")
+        print(f"[JOBS] Cancel requested for job {job.id}")
+        return job
+
+    def counts(self):
+        """Number of jobs per status (queue depth = 'queued', in flight = 'running')."""
+        counts = {"queued": 0, "running": 0, "completed": 0, "failed": 0, "cancelled": 0}
+        for job in list(self._jobs.values()):
+            counts[job.status] += 1
+        return counts
+
+    def _run(self, job):
+        """Worker thread body: runs the training stream and records every event."""
+        ticket = job.ticket
+        if ticket is not None:
+            try:
+                admitted = admission_controller.acquire(ticket, cancel=job.cancel_event)
+            except AdmissionRejected as e:
+                job._append({"type": "error", "error": str(e)})
+                job._finish("failed", str(e))
+                return
+            if not admitted:
+                job._finish("cancelled")
+                return
+        with job.condition:
+            if job.cancel_requested:
+                job._finish("cancelled")
+                if ticket is not None:
+                    admission_controller.release(ticket)
+                return
+            job.status = "running"
+            job.started_at = time.time()
+            data, job.data = job.data, None
+        print(f"[JOBS] Running job {job.id}")
+
+        stream = train_all_models_streaming(data, job.target_column, cancel=job.cancel_event, **job.options)
+        del data
+        elapsed = None
+        try:
+            for event in stream:
+                if event["type"] == "start" and ticket is not None:
+                    event = dict(event, admission=ticket.to_dict())
+                job._append(event)
+                if event["type"] == "error":
+                    job._finish("failed", event["error"])
+                    return
+                if job.cancel_requested or event["type"] == "cancelled":
+                    stream.close()
+                    job._finish("cancelled")
+                    return
+            job._finish("completed")
+            if not job.events[0].get("replayed"):
+                elapsed = job.finished_at - job.started_at
+        except Exception as e:
+            print(f"[JOBS] Job {job.id} failed: {str(e)}")
+            job._append({"type": "error", "error": str(e)})
+            job._finish("failed", str(e))
+        finally:
+            if ticket is not None:
+                admission_controller.release(ticket, elapsed)
+            print(f"[JOBS] Job {job.id} {job.status}")
+
+    def _expire(self):
+        """Forgets finished jobs older than the TTL."""
+        now = time.time()
+        with self._lock:
+            for job_id in [
+                j.id for j in self._jobs.values()
+                if j.status in FINISHED_STATES and now - j.finished_at > self.ttl
+            ]:
+                del self._jobs[job_id]
+
+
+# Process-wide job manager used by app.py
+job_manager = JobManager()
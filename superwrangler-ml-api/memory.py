@@ -0,0 +1,286 @@
+"""
+Per-model memory accounting and the memory guard.
+
+Measurement: every phase of train_and_evaluate (fit, predict, cv) is wrapped in
+track_memory(), which records the process RSS before and after the phase
+(allocation delta) and the peak RSS reached during it, along with the phase's
+wall and CPU time. On Linux the kernel's
+high-water mark (VmHWM) is reset at the start of each phase through
+/proc/self/clear_refs; elsewhere the peak falls back to the lifetime maximum
+from getrusage(). VmHWM is per process, so when phases of concurrent runs
+(request threads, job workers) overlap, the peak covers all of them: the
+phase is not reset while another one is tracked, is marked "overlapped", and
+its factor is not fed into MemoryHistory (the guard would learn a wrong one).
+
+Guard: before a model is fitted, guard_model() predicts its peak RSS as
+    current RSS + memory factor x training data size (MB)
+where the memory factor is the largest one observed for that model in recent
+runs (MemoryHistory), or the static MODEL_MEMORY_FACTOR before the first run.
+If the prediction exceeds the memory ceiling, the model is downsized step by
+step until it fits: fewer estimators, then a shallower tree, then a row
+subsample of the training set. The result reports what was changed.
+"""
+import os
+import resource
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+# Memory ceiling (MB) for one training process. 0 = derive it from the
+# container's cgroup memory limit (90%); no limit found = guard disabled.
+MEMORY_CEILING_MB = int(os.environ.get("ML_MEMORY_CEILING_MB", "0"))
+
+# Peak working memory of each model as a multiple of the X_train size
+MODEL_MEMORY_FACTOR = {
+    "Ridge Classifier": 2.0,
+    "SGD Classifier": 1.0,
+    "Perceptron": 1.0,
+    "Extra Tree": 1.5,
+    "Extra Trees Ensemble": 4.0,
+    "AdaBoost": 2.0,
+    "Gradient Boosting": 3.0,
+    "Histogram Gradient Boosting": 1.5,
+    "XGBoost": 2.5,
+    "LightGBM": 2.0,
+    "CatBoost": 3.0,
+    "Bagging Classifier": 5.0,
+    "Voting Classifier": 4.0,
+    "Stacking Classifier": 6.0,
+    "Linear SVC": 2.0,
+}
+DEFAULT_MEMORY_FACTOR = 3.0
+
+# Observations kept per model (the guard uses the largest one). Runs on less
+# training data than HISTORY_MIN_DATA_MB are not recorded: their working memory
+# is mostly served from pages the allocator already holds, and would teach the
+# guard a factor of ~0.
+HISTORY_SIZE = 5
+HISTORY_MIN_DATA_MB = 16
+
+# Downsizing limits and the share of working memory each step is assumed to keep
+MIN_ESTIMATORS = 5
+MIN_DEPTH = 3
+MIN_SUBSAMPLE_ROWS = 200
+ESTIMATOR_PARAMS = ("n_estimators", "iterations")
+DEPTH_PARAMS = ("max_depth", "depth")
+ESTIMATOR_STEP_KEEPS = 0.6
+DEPTH_STEP_KEEPS = 0.75
+
+# Phases being tracked in this process: token -> overlapped with another phase
+_active_phases = {}
+_active_lock = threading.Lock()
+
+_PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1024 * 1024) if hasattr(os, "sysconf") else 4096 / (1024 * 1024)
+_peak_resettable = None
+
+
+def current_rss_mb():
+    """Resident set size of this process (MB)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except OSError:
+        return _lifetime_peak_mb()
+
+
+def _lifetime_peak_mb():
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # kB on Linux
+
+
+def _reset_peak():
+    """Resets the kernel RSS high-water mark. Returns False where unsupported."""
+    global _peak_resettable
+    if _peak_resettable is False:
+        return False
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        _peak_resettable = True
+    except OSError:
+        _peak_resettable = False
+    return _peak_resettable
+
+
+def _peak_rss_mb():
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return _lifetime_peak_mb()
+
+
+@contextmanager
+def track_memory(phase, stats):
+    """
+    Records the peak RSS, allocation delta and working memory (peak - start)
+    of the block into stats[phase], plus its wall and CPU time (ms).
+    A phase that overlapped another tracked phase gets "overlapped": true.
+    """
+    token = object()
+    with _active_lock:
+        exclusive = not _active_phases
+        for other in _active_phases:
+            _active_phases[other] = True
+        _active_phases[token] = not exclusive
+        if exclusive:
+            # Never reset the high-water mark under another phase's feet
+            _reset_peak()
+    before = current_rss_mb()
+    start_wall, start_cpu = time.perf_counter(), time.process_time()
+    try:
+        yield
+    finally:
+        wall_ms = (time.perf_counter() - start_wall) * 1000
+        cpu_ms = (time.process_time() - start_cpu) * 1000
+        after = current_rss_mb()
+        peak = max(_peak_rss_mb(), before, after)
+        with _active_lock:
+            overlapped = _active_phases.pop(token)
+        stats[phase] = {"peakRssMb": round(peak, 1), "deltaMb": round(after - before, 1),
+                        "workingMb": round(peak - before, 1),
+                        "wallMs": round(wall_ms, 2), "cpuMs": round(cpu_ms, 2)}
+        if overlapped:
+            stats[phase]["overlapped"] = True
+
+
+def summarize(stats, data_mb):
+    """Memory block of a result: the phases plus the overall peak."""
+    phases = {k: v for k, v in stats.items() if isinstance(v, dict)}
+    summary = {
+        **phases,
+        "peakRssMb": max((v["peakRssMb"] for v in phases.values()), default=None),
+        "workingMb": max((v["workingMb"] for v in phases.values()), default=None),
+        "dataMb": round(data_mb, 3),
+    }
+    if any(v.get("overlapped") for v in phases.values()):
+        summary["overlapped"] = True
+    return summary
+
+
+def memory_ceiling_mb():
+    """Configured ceiling, or 90% of the cgroup memory limit. None = no ceiling."""
+    if MEMORY_CEILING_MB > 0:
+        return MEMORY_CEILING_MB
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        try:
+            with open(path) as f:
+                value = f.read().strip()
+        except OSError:
+            continue
+        if value.isdigit() and int(value) < 1 << 60:  # "max" / huge = unlimited
+            return int(value) / (1024 * 1024) * 0.9
+    return None
+
+
+class MemoryHistory:
+    """Recent working-memory factors (working MB per training-data MB) per model."""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self._factors = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, memory):
+        """Adds the observation from a result's memory block (not if its peak was shared with another run)."""
+        if (not memory or memory.get("workingMb") is None or memory["dataMb"] < HISTORY_MIN_DATA_MB
+                or memory.get("overlapped")):
+            return
+        factor = max(memory["workingMb"], 0.0) / memory["dataMb"]
+        with self._lock:
+            self._factors.setdefault(name, deque(maxlen=self.size)).append(factor)
+
+    def factor(self, name):
+        """Largest recent factor, or the static estimate before the first run."""
+        with self._lock:
+            observed = self._factors.get(name)
+            if observed:
+                return max(observed)
+        return MODEL_MEMORY_FACTOR.get(name, DEFAULT_MEMORY_FACTOR)
+
+    def observed(self, name):
+        with self._lock:
+            return list(self._factors.get(name, ()))
+
+    def load(self, name, factors):
+        """Replaces a model's history (used to seed pool workers from the parent)."""
+        with self._lock:
+            self._factors[name] = deque(factors, maxlen=self.size)
+
+
+def _downsize_step(model, rows_fraction, n_rows):
+    """
+    Next downsizing step for `model`. Returns (description, share of working
+    memory kept, new rows_fraction), or None when nothing is left to shrink.
+    """
+    params = model.get_params(deep=False)
+    for param in ESTIMATOR_PARAMS:
+        value = params.get(param)
+        if isinstance(value, int) and value > MIN_ESTIMATORS:
+            new = max(MIN_ESTIMATORS, value // 2)
+            model.set_params(**{param: new})
+            return f"{param} {value} -> {new}", ESTIMATOR_STEP_KEEPS, rows_fraction
+    if "max_iter" in params and "max_leaf_nodes" in params:  # Histogram GB: max_iter = trees
+        value = params["max_iter"]
+        if value > MIN_ESTIMATORS:
+            new = max(MIN_ESTIMATORS, value // 2)
+            model.set_params(max_iter=new)
+            return f"max_iter {value} -> {new}", ESTIMATOR_STEP_KEEPS, rows_fraction
+    for param in DEPTH_PARAMS:
+        value = params.get(param)
+        if isinstance(value, int) and value > MIN_DEPTH:
+            new = max(MIN_DEPTH, value - 2)
+            model.set_params(**{param: new})
+            return f"{param} {value} -> {new}", DEPTH_STEP_KEEPS, rows_fraction
+    if n_rows * rows_fraction / 2 >= MIN_SUBSAMPLE_ROWS:
+        return f"subsample {rows_fraction / 2:.0%} of training rows", 0.5, rows_fraction / 2
+    return None
+
+
+def guard_model(name, model, data_mb, n_rows, history=None, ceiling_mb=None):
+    """
+    Downsizes `model` in place until its predicted peak fits under the ceiling.
+    Returns None when nothing had to change, else a dict with the prediction,
+    the ceiling, the adjustments made and rowsFraction (< 1 = train on a subsample).
+    """
+    ceiling_mb = ceiling_mb or memory_ceiling_mb()
+    if not ceiling_mb:
+        return None
+    history = history or memory_history
+    base_mb = current_rss_mb()
+    working_mb = history.factor(name) * max(data_mb, 1.0)
+    predicted_mb = base_mb + working_mb
+    if predicted_mb <= ceiling_mb:
+        return None
+
+    adjustments = []
+    rows_fraction = 1.0
+    while base_mb + working_mb > ceiling_mb:
+        try:
+            step = _downsize_step(model, rows_fraction, n_rows)
+        except ValueError:
+            step = None
+        if step is None:
+            break
+        description, keeps, rows_fraction = step
+        working_mb *= keeps
+        adjustments.append(description)
+
+    fits = base_mb + working_mb <= ceiling_mb
+    print(f"  ⚠️  {name}: predicted peak {predicted_mb:.0f}MB > ceiling {ceiling_mb:.0f}MB; "
+          + (", ".join(adjustments) if adjustments else "nothing left to downsize")
+          + ("" if fits else " (may still exceed the ceiling)"))
+    return {
+        "predictedPeakMb": round(predicted_mb, 1),
+        "downsizedPeakMb": round(base_mb + working_mb, 1),
+        "ceilingMb": round(ceiling_mb, 1),
+        "adjustments": adjustments,
+        "rowsFraction": rows_fraction,
+    }
+
+
+# Process-wide memory history, fed by train_all_models_streaming
+memory_history = MemoryHistory()
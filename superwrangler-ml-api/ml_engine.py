@@ -2,40 +2,38 @@ import pandas as pd
 import time
 import numpy as np
 import gc
-from sklearn.model_selection import train_test_split, cross_val_score
-from sklearn.metrics import accuracy_score, precision_score, recall_score, f1_score, roc_auc_score, confusion_matrix
-from sklearn.preprocessing import StandardScaler
+import itertools
+from sklearn.model_selection import train_test_split
 
-# Import Linear Models
-from sklearn.linear_model import LogisticRegression, RidgeClassifier, SGDClassifier, Perceptron
+from parallel import (
+    estimate_model_cost, predicted_seconds, prepared_shape, release_shared, run_isolated,
+    share_prepared, train_models_parallel,
+)
+from timeouts import needs_isolation, resolve_time_limit, time_history
+from preprocess_cache import dataset_fingerprint, preprocess_cache
+from result_cache import result_cache, result_key
+from racing import race_models, stratified_sample
+from memory import guard_model, memory_history, summarize, track_memory
+from encoding import COMPACT_DEFAULT, encode_features, inputs_for_model, matrix_nbytes, take_rows
+from ensembles import ENSEMBLE_MODELS, reusable_base_models, train_ensembles
+from registry import SAVE_MODELS_DEFAULT, SAVE_MODES, model_registry, save_model
+from evaluation import cross_validate_oof, evaluate_fitted, make_fold_ids
+from model_factory import build_models
+from out_of_core import INCREMENTAL_MODELS, ChunkedDataset, prepare_out_of_core, train_incremental
+from multi_target import SharedFeatures
+from binning import SHARED_BINNING, bin_features
+from instrumentation import count_run, observe_result, profile_report, record_stage, span, start_profile, start_trace
 
-# Import Tree-Based Models
-from sklearn.tree import DecisionTreeClassifier
-from sklearn.ensemble import RandomForestClassifier, ExtraTreesClassifier
 
-# Import Boosting Models
-from sklearn.ensemble import AdaBoostClassifier, GradientBoostingClassifier, HistGradientBoostingClassifier
-from xgboost import XGBClassifier
-from lightgbm import LGBMClassifier
-from catboost import CatBoostClassifier
+def __getattr__(name):
+    # Models saved before the model factory pickled the wrapper as ml_engine.ExtraTreeClassifierWrapper
+    if name == "ExtraTreeClassifierWrapper":
+        import model_factory
+        return model_factory.ExtraTreeClassifierWrapper
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
-# Import Ensemble Models
-from sklearn.ensemble import BaggingClassifier, VotingClassifier, StackingClassifier
 
-# Import SVM Models
-from sklearn.svm import SVC, LinearSVC
-
-# Import Other Models
-from sklearn.neighbors import KNeighborsClassifier
-from sklearn.naive_bayes import GaussianNB
-from sklearn.neural_network import MLPClassifier
-
-# Custom Extra Tree model (single tree)
-class ExtraTreeClassifierWrapper(ExtraTreesClassifier):
-    def __init__(self, **kwargs):
-        super().__init__(n_estimators=1, **kwargs)
-
-def get_models():
+def get_models(names=None):
     """
     Returns ADVANCED models only (15 total) - MEMORY OPTIMIZED for Render.
     
@@ -54,147 +52,174 @@ def get_models():
     - All boosting models (AdaBoost, Gradient Boosting, XGBoost, LightGBM, CatBoost)
     - Ensemble methods (Bagging, Voting, Stacking)
     - Linear SVC
+    
+    The estimators come from model_factory, which imports each library (xgboost,
+    lightgbm, catboost, sklearn.ensemble, ...) only when a model needs it.
+    names restricts the result to those models.
     """
+    return build_models(names)
+
+
+def train_and_evaluate(name, model, X_train, y_train, X_test, y_test, fold_ids=None, artifacts=None):
+    """
+    Trains a single model and returns its performance metrics.
     
-    # Define base estimators for ensemble models (memory-efficient versions)
-    base_ridge = RidgeClassifier(random_state=42)
-    base_et = ExtraTreesClassifier(n_estimators=20, max_depth=10, random_state=42, n_jobs=1)
-    base_sgd = SGDClassifier(random_state=42, max_iter=500, n_jobs=1)
+    Every prediction array is computed once (see evaluation.py). fold_ids is the
+    shared CV fold plan from prepare_data; it is derived here when not given.
+    If an `artifacts` dict is passed it receives the fitted model, its CV fold
+    models and its prediction arrays (test, train, out-of-fold) for reuse by
+    later stages (e.g. the ensembles in ensembles.py).
     
-    return {
-        # Advanced Linear Models (3) - NOT in Quick ML
-        "Ridge Classifier": RidgeClassifier(random_state=42),
-        "SGD Classifier": SGDClassifier(random_state=42, max_iter=500, n_jobs=1),
-        "Perceptron": Perceptron(random_state=42, max_iter=500, n_jobs=1),
-        
-        # Advanced Tree-Based Models (2) - Extra Trees only
-        "Extra Tree": ExtraTreeClassifierWrapper(max_depth=10, random_state=42),
-        "Extra Trees Ensemble": ExtraTreesClassifier(n_estimators=30, max_depth=10, random_state=42, n_jobs=1),
-        
-        # Boosting Models (6) - NONE in Quick ML - These are the power algorithms
-        "AdaBoost": AdaBoostClassifier(n_estimators=30, random_state=42),
-        "Gradient Boosting": GradientBoostingClassifier(n_estimators=30, max_depth=5, random_state=42),
-        "Histogram Gradient Boosting": HistGradientBoostingClassifier(max_iter=30, max_depth=5, random_state=42),
-        "XGBoost": XGBClassifier(n_estimators=30, max_depth=5, random_state=42, use_label_encoder=False, eval_metric='logloss', n_jobs=1, verbosity=0, tree_method='hist'),
-        "LightGBM": LGBMClassifier(n_estimators=30, max_depth=5, num_leaves=15, random_state=42, n_jobs=1, verbose=-1),
-        "CatBoost": CatBoostClassifier(iterations=30, depth=5, random_state=42, verbose=0, thread_count=1),
-        
-        # Ensemble Models (3) - NOT in Quick ML
-        "Bagging Classifier": BaggingClassifier(n_estimators=20, random_state=42, n_jobs=1),
-        "Voting Classifier": VotingClassifier(
-            estimators=[('ridge', base_ridge), ('et', base_et), ('sgd', base_sgd)],
-            voting='soft',
-            n_jobs=1
-        ),
-        "Stacking Classifier": StackingClassifier(
-            estimators=[('ridge', base_ridge), ('et', base_et), ('sgd', base_sgd)],
-            final_estimator=RidgeClassifier(),
-            n_jobs=1
-        ),
-        
-        # Linear SVC (1) - More advanced than basic SVC in Quick ML
-        "Linear SVC": LinearSVC(random_state=42, dual=False, max_iter=1000),
-    }
-
-def train_and_evaluate(name, model, X_train, y_train, X_test, y_test):
-    """Trains a single model and returns its performance metrics."""
+    The result's "memory" block has the peak RSS and allocation delta of the
+    fit, predict and cv phases (see memory.py).
+    """
+    memory = {}
+    data_mb = matrix_nbytes(X_train) / (1024 * 1024)
     try:
         # Training
         start_train = time.time()
-        model.fit(X_train, y_train)
+        with track_memory("fit", memory):
+            model.fit(X_train, y_train)
         training_time = (time.time() - start_train) * 1000  # Convert to ms
         
-        # Prediction
-        start_pred = time.time()
-        y_pred = model.predict(X_test)
-        prediction_time = (time.time() - start_pred) * 1000  # Convert to ms
-        
-        # Train score
-        train_score = model.score(X_train, y_train)
-        test_score = model.score(X_test, y_test)
+        # Prediction + all test/train metrics from the same prediction arrays
+        with track_memory("predict", memory):
+            metrics, predictions = evaluate_fitted(model, X_train, y_train, X_test, y_test)
         
-        # Calculate metrics
-        accuracy = accuracy_score(y_test, y_pred)
-        precision = precision_score(y_test, y_pred, average='weighted', zero_division=0)
-        recall = recall_score(y_test, y_pred, average='weighted', zero_division=0)
-        f1 = f1_score(y_test, y_pred, average='weighted', zero_division=0)
-        
-        # Confusion Matrix
-        cm = confusion_matrix(y_test, y_pred)
-        
-        # ROC-AUC (if applicable)
-        roc_auc = None
+        # Cross-validation - 3-fold shared plan, sequential to save memory
+        oof_pred = None
+        fold_models = [] if artifacts is not None else None
         try:
-            if hasattr(model, "predict_proba"):
-                y_proba = model.predict_proba(X_test)
-                if y_proba.shape[1] == 2:  # Binary classification
-                    roc_auc = roc_auc_score(y_test, y_proba[:, 1])
-                else:  # Multi-class
-                    roc_auc = roc_auc_score(y_test, y_proba, multi_class='ovr', average='weighted')
-        except:
-            roc_auc = None
-        
-        # Cross-validation - REDUCED to 3-fold and sequential to save memory
-        try:
-            cv_scores = cross_val_score(model, X_train, y_train, cv=min(3, len(X_train) // 2), 
-                                       scoring='f1_weighted', n_jobs=1)
+            if fold_ids is None:
+                fold_ids = make_fold_ids(y_train)
+            with track_memory("cv", memory):
+                cv_scores, oof_pred = cross_validate_oof(model, X_train, y_train, fold_ids, fold_models=fold_models)
             cv_f1_mean = cv_scores.mean()
             cv_f1_std = cv_scores.std()
-        except:
-            cv_f1_mean = f1
+        except Exception:
+            cv_f1_mean = metrics["f1"]
             cv_f1_std = 0.0
+            fold_models = None
         
-        # Get hyperparameters
-        hyperparameters = {k: str(v) for k, v in model.get_params().items() if not k.startswith('_')}
+        if artifacts is not None:
+            artifacts.update(predictions, model=model, oof_pred=oof_pred, fold_models=fold_models)
         
-        return {
-            "algorithm": name,
-            "accuracy": float(accuracy),
-            "precision": float(precision),
-            "recall": float(recall),
-            "f1Score": float(f1),
-            "rocAuc": float(roc_auc) if roc_auc is not None else None,
-            "cvF1Mean": float(cv_f1_mean),
-            "cvF1Std": float(cv_f1_std),
-            "trainingTime": float(training_time),
-            "predictionTime": float(prediction_time),
-            "trainScore": float(train_score),
-            "testScore": float(test_score),
-            "confusionMatrix": cm.tolist(),
-            "hyperparameters": hyperparameters,
-            "status": "success"
-        }
+        return build_result(name, model.get_params(), metrics, cv_f1_mean, cv_f1_std, training_time,
+                            memory=summarize(memory, data_mb))
     except Exception as e:
         print(f"  ❌ {name} failed: {str(e)}")
-        return {
-            "algorithm": name,
-            "accuracy": 0.0,
-            "precision": 0.0,
-            "recall": 0.0,
-            "f1Score": 0.0,
-            "rocAuc": None,
-            "cvF1Mean": 0.0,
-            "cvF1Std": 0.0,
-            "trainingTime": 0.0,
-            "predictionTime": 0.0,
-            "trainScore": 0.0,
-            "testScore": 0.0,
-            "confusionMatrix": [[0]],
-            "hyperparameters": {},
-            "status": "failed",
-            "error": str(e)
-        }
+        result = failed_result(name, e)
+        result["memory"] = summarize(memory, data_mb)
+        return result
 
-def train_all_models(data, target_column):
-    """Main function to train all models and return results."""
-    print("\n" + "="*50)
-    print("Starting Advanced ML Training")
-    print("="*50)
-    
-    start_time = time.time()
+def build_result(name, params, metrics, cv_f1_mean, cv_f1_std, training_time, memory=None):
+    """Result entry for a successfully evaluated model (metrics from evaluate_fitted)."""
+    # Get hyperparameters
+    hyperparameters = {k: str(v) for k, v in params.items() if not k.startswith('_')}
     
+    roc_auc = metrics["roc_auc"]
+    return {
+        "algorithm": name,
+        "accuracy": float(metrics["accuracy"]),
+        "precision": float(metrics["precision"]),
+        "recall": float(metrics["recall"]),
+        "f1Score": float(metrics["f1"]),
+        "rocAuc": float(roc_auc) if roc_auc is not None else None,
+        "cvF1Mean": float(cv_f1_mean),
+        "cvF1Std": float(cv_f1_std),
+        "trainingTime": float(training_time),
+        "predictionTime": float(metrics["prediction_time"]),
+        "trainScore": float(metrics["train_score"]),
+        "testScore": float(metrics["test_score"]),
+        "confusionMatrix": metrics["confusion_matrix"].tolist(),
+        "hyperparameters": hyperparameters,
+        "memory": memory,
+        "status": "success"
+    }
+
+def failed_result(name, error, status="failed"):
+    """Result entry for a model that did not produce metrics."""
+    return {
+        "algorithm": name,
+        "accuracy": 0.0,
+        "precision": 0.0,
+        "recall": 0.0,
+        "f1Score": 0.0,
+        "rocAuc": None,
+        "cvF1Mean": 0.0,
+        "cvF1Std": 0.0,
+        "trainingTime": 0.0,
+        "predictionTime": 0.0,
+        "trainScore": 0.0,
+        "testScore": 0.0,
+        "confusionMatrix": [[0]],
+        "hyperparameters": {},
+        "status": status,
+        "error": str(error)
+    }
+
+def prepare_data(data, target_column, use_cache=True, dataset_key=None, encoding="auto", compact=False):
+    """
+    Validates, encodes, scales and splits the dataset.
+    Returns a dict with X_train/X_test/y_train/y_test, the shared CV fold plan
+    (cv_folds) and the datasetInfo block. With sparse encoding (see encoding.py)
+    X_train/X_test are CSR and X_train_native/X_test_native hold the raw
+    categorical columns for LightGBM, CatBoost and Histogram GB. With dense
+    encoding X_train_binned/X_test_binned hold the bin codes for the
+    histogram-based boosters, with edges fitted on X_train (see binning.py).
+    
+    compact=True builds float32 matrices, written once in train-then-test row
+    order so X_train/X_test are views of one buffer, and integer-encodes the
+    labels (label_classes maps the codes back).
+    
+    Results are cached by dataset fingerprint + target + encoding (see
+    preprocess_cache.py), so a resubmitted dataset skips the pandas work.
+    Returned arrays are shared with the cache and must not be modified in place.
+    Pass dataset_key when the caller already computed dataset_fingerprint(data, target_column).
+    """
+    if not use_cache:
+        return _preprocess(data, target_column, encoding, compact)
+    
+    key = (f"{dataset_key or dataset_fingerprint(data, target_column)}-{encoding}{'-compact' if compact else ''}"
+           f"{'' if SHARED_BINNING else '-unbinned'}")
+    prepared = preprocess_cache.get(key)
+    if prepared is not None:
+        print(f"Preprocessing cache hit ({key[:12]})")
+        return prepared
+    
+    prepared = _preprocess(data, target_column, encoding, compact)
+    preprocess_cache.put(key, prepared)
+    return prepared
+
+
+def _split_indices(y):
+    """Row indices of the 80/20 train/test split (stratified when possible)."""
+    rows = np.arange(len(y))
+    try:
+        train_idx, test_idx = train_test_split(rows, test_size=0.20, random_state=42, stratify=y)
+        print(f"Train: {len(train_idx)}, Test: {len(test_idx)} (stratified)")
+    except ValueError:
+        # If stratification fails (too few samples per class), split without it
+        train_idx, test_idx = train_test_split(rows, test_size=0.20, random_state=42)
+        print(f"Train: {len(train_idx)}, Test: {len(test_idx)} (non-stratified)")
+    return train_idx, test_idx
+
+
+def _encode_labels(y):
+    """Integer codes (int32) of the target and the sorted label of each code."""
+    try:
+        codes, classes = pd.factorize(y, sort=True, use_na_sentinel=False)
+    except TypeError:
+        # Mixed label types that do not sort: codes in order of appearance
+        codes, classes = pd.factorize(y, use_na_sentinel=False)
+    return codes.astype(np.int32), np.asarray(classes)
+
+
+def _preprocess(data, target_column, encoding="auto", compact=False):
+    """The uncached preprocessing pipeline behind prepare_data."""
     # Convert to DataFrame
-    df = pd.DataFrame(data)
+    with span("dataframe"):
+        df = pd.DataFrame(data)
     print(f"Dataset shape: {df.shape}")
     
     # Validate target column exists
@@ -203,197 +228,460 @@ def train_all_models(data, target_column):
     
     # Prepare data
     X = df.drop(columns=[target_column])
-    y = df[target_column]
     
     # Check if we have enough data
     if len(X) < 10:
         raise ValueError("Dataset too small. Need at least 10 samples.")
     
+    y, label_classes, unique_classes = _target_labels(df[target_column], compact)
+    print(f"Features: {len(X.columns)}, Classes: {unique_classes}")
+    
+    # Split data (80/20 train/test split with stratification)
+    with span("split"):
+        train_idx, test_idx = _split_indices(y)
+    
+    # One-hot encode + scale (dense, or CSR + native categoricals - see encoding.py)
+    with span("encode"):
+        if compact:
+            # Rows written in train-then-test order: the split is two slices, no copies
+            encoded = encode_features(X, encoding, compact=True, row_order=np.concatenate([train_idx, test_idx]))
+        else:
+            encoded = encode_features(X, encoding)
+    print(f"After encoding: {encoded['n_features']} features ({encoded['encoding']}"
+          f"{', compact' if compact else ''})")
+    
+    return _assemble_prepared(encoded, y, label_classes, unique_classes, train_idx, test_idx,
+                              len(X.columns), ordered=compact)
+
+
+def _target_labels(target, compact=False):
+    """
+    (labels, label_classes, class count) of a target column (Series). The labels
+    are integer codes with compact=True (label_classes maps them back), else the
+    values themselves (label_classes None).
+    Raises ValueError for a target with fewer than 2 classes.
+    """
     # Check if target has at least 2 classes
-    unique_classes = y.nunique()
+    unique_classes = target.nunique()
     if unique_classes < 2:
         raise ValueError(f"Target must have at least 2 classes. Found: {unique_classes}")
+    if compact:
+        return (*_encode_labels(target.to_numpy()), unique_classes)
+    return target.to_numpy(), None, unique_classes
+
+
+def _assemble_prepared(encoded, y, label_classes, n_classes, train_idx, test_idx, n_columns, ordered=False):
+    """
+    The prepared dict (see prepare_data) from encode_features output and a split.
+    ordered=True means the encoded rows are already in train-then-test order
+    (encode_features row_order), so the split is two slices.
+    """
+    if ordered:
+        train_rows, test_rows = slice(0, len(train_idx)), slice(len(train_idx), None)
+    else:
+        train_rows, test_rows = train_idx, test_idx
+    y_train = y[train_idx]
+    
+    with span("split"):
+        X_train, X_test = take_rows(encoded["matrix"], train_rows), take_rows(encoded["matrix"], test_rows)
+        # Shared CV fold plan - every model is cross-validated on the same folds
+        cv_folds = make_fold_ids(y_train)
+    prepared = {
+        "X_train": X_train,
+        "X_test": X_test,
+        "y_train": y_train,
+        "y_test": y[test_idx],
+        "cv_folds": cv_folds,
+        "encoding": encoded["encoding"],
+        # Fitted encoding, re-applied to new rows at prediction time (see registry.py)
+        "feature_transform": encoded["transform"],
+        "datasetInfo": {
+            "samples": len(y),
+            "features": n_columns,
+            "featuresAfterEncoding": encoded["n_features"],
+            "encoding": encoded["encoding"],
+            "classes": n_classes,
+            "trainSize": len(train_idx),
+            "testSize": len(test_idx)
+        }
+    }
+    if label_classes is not None:
+        prepared["label_classes"] = label_classes
+    if encoded["native"] is not None:
+        prepared["X_train_native"] = take_rows(encoded["native"], train_rows)
+        prepared["X_test_native"] = take_rows(encoded["native"], test_rows)
+    if encoded["encoding"] == "dense":
+        # Bin edges from the training rows only, so the held-out rows do not shape them
+        X_train_binned, bins = bin_features(X_train)
+        if bins is not None:
+            prepared["X_train_binned"] = X_train_binned
+            prepared["X_test_binned"] = bins.transform(X_test)
+            prepared["feature_transform"] = encoded["transform"].with_bins(bins)
+    return prepared
+
+
+def train_all_models(data, target_column, **options):
+    """
+    Main function to train all models and return results.
+    options are passed through to train_all_models_streaming (parallel, use_cache, race,
+    encoding, compact, model_time_limit, save_models, profile).
+    """
+    summary = None
+    start = None
+    
+    # Same pipeline as the stream, collected into a single response
+    for event in train_all_models_streaming(data, target_column, **options):
+        if event["type"] == "start":
+            start = event
+        elif event["type"] == "complete":
+            summary = event
+        elif event["type"] == "error":
+            raise Exception(event["error"])
     
-    print(f"Features: {len(X.columns)}, Classes: {unique_classes}")
+    return {
+        "results": summary["results"],
+        "bestModel": summary["bestModel"],
+        "totalTime": summary["totalTime"],
+        "successCount": summary["successCount"],
+        "failureCount": summary["failureCount"],
+        "eliminatedCount": summary.get("eliminatedCount", 0),
+        "timeoutCount": summary.get("timeoutCount", 0),
+        "datasetInfo": start["datasetInfo"],
+        "resultKey": start["resultKey"],
+        "modelId": summary.get("modelId"),
+        "savedModels": summary.get("savedModels", []),
+        "replayed": start.get("replayed", False),
+        "stageTimings": summary.get("stageTimings"),
+        **({"profile": summary["profile"]} if "profile" in summary else {})
+    }
+
+
+def train_prepared(name, model, prepared, artifacts=None):
+    """
+    train_and_evaluate on a prepared dataset, using the representation this model accepts.
     
-    # One-hot encode categorical features
-    X_encoded = pd.get_dummies(X, drop_first=True)
-    print(f"After encoding: {X_encoded.shape[1]} features")
+    The memory guard runs first: if this model is predicted to exceed the memory
+    ceiling it is downsized (see memory.py) and the result gets a "memoryGuard"
+    block listing the changes. A model trained on a row subsample does not
+    hand its artifacts to later stages.
     
-    # Scale features (important for linear models)
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X_encoded)
+    If prepared has a "model_dir" (the run's registry staging directory), the
+    fitted model is saved there (see registry.py).
+    """
+    X_train, X_test = inputs_for_model(name, model, prepared)
+    y_train, fold_ids = prepared["y_train"], prepared["cv_folds"]
+    
+    guard = guard_model(name, model, matrix_nbytes(X_train) / (1024 * 1024), len(y_train))
+    if guard and guard["rowsFraction"] < 1:
+        rows = np.sort(stratified_sample(np.arange(len(y_train)), y_train, guard["rowsFraction"]))
+        X_train, y_train = take_rows(X_train, rows), y_train[rows]
+        fold_ids = fold_ids[rows] if fold_ids is not None else None
+        artifacts = None
+    
+    result = train_and_evaluate(name, model, X_train, y_train, X_test, prepared["y_test"],
+                                fold_ids=fold_ids, artifacts=artifacts)
+    if guard:
+        result["memoryGuard"] = guard
+    if prepared.get("model_dir") and result["status"] == "success":
+        save_model(prepared["model_dir"], name, model)
+    return result
+
+
+def _train_sequential(models, prepared, keep_artifacts=(), artifacts=None, cancel=None, time_limit=None):
+    """
+    Yields (name, result) ONE MODEL AT A TIME with garbage collection in between.
+    Models named in keep_artifacts store their fitted artifacts in `artifacts`.
     
-    # Split data (80/20 train/test split with stratification)
+    With a time_limit, models predicted to come close to it run in a killable
+    subprocess (see timeouts.py). Stops before the next model once `cancel` is set.
+    """
+    blocks = []
+    specs = None
     try:
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_scaled, y, test_size=0.20, random_state=42, stratify=y
-        )
-        print(f"Train: {len(X_train)}, Test: {len(X_test)} (stratified)")
-    except ValueError:
-        # If stratification fails (too few samples per class), split without it
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_scaled, y, test_size=0.20, random_state=42
-        )
-        print(f"Train: {len(X_train)}, Test: {len(X_test)} (non-stratified)")
+        names = list(models)
+        for idx, name in enumerate(names, 1):
+            if cancel is not None and cancel.is_set():
+                return
+            print(f"[{idx}/{len(names)}] Training {name}...")
+            model = models.pop(name)
+            
+            # Train and evaluate THIS model
+            kept = {} if name in keep_artifacts else None
+            expected = predicted_seconds(name, prepared)
+            if needs_isolation(expected, time_limit):
+                print(f"  ⏱ {name}: ~{expected:.0f}s expected, running in a subprocess ({time_limit:.0f}s limit)")
+                if specs is None:
+                    specs = share_prepared(prepared, blocks)
+                outcome = run_isolated(name, model, specs, kept is not None, time_limit, cancel)
+                if outcome is None:
+                    return
+                result, kept = outcome
+            else:
+                result = train_prepared(name, model, prepared, artifacts=kept)
+            if kept and result["status"] == "success":
+                artifacts[name] = kept
+            yield name, result
+            
+            # CRITICAL: Force garbage collection to free memory before next model
+            del model, kept
+            gc.collect()
+    finally:
+        release_shared(blocks)
+
+
+def run_models(models, prepared, parallel, cancel=None, time_limit=None):
+    """
+    Yields (name, result) for every model in `models`: the standalone models
+    first (sequentially or in the process pool), then the Voting / Stacking
+    ensembles, built from the base-learner fits of the standalone run (see ensembles.py).
+    """
+    ensembles = {name: models.pop(name) for name in ENSEMBLE_MODELS if name in models}
+    keep = reusable_base_models({**models, **ensembles})
+    base_artifacts = {}
+    
+    if parallel:
+        runner = train_models_parallel
+    else:
+        runner = _train_sequential
+    yield from runner(models, prepared, keep_artifacts=keep, artifacts=base_artifacts,
+                      cancel=cancel, time_limit=time_limit)
+    
+    if cancel is None or not cancel.is_set():
+        yield from train_ensembles(ensembles, prepared, base_artifacts)
+
+
+def _replay(events):
+    """Yields stored events from the result cache, marked as replayed."""
+    for event in events:
+        if event["type"] in ("start", "complete"):
+            event = dict(event, replayed=True)
+        yield event
+
+
+def train_all_models_streaming(data, target_column, profile=False, **options):
+    """
+    Generator function that yields results ONE MODEL AT A TIME - MEMORY OPTIMIZED.
+    Each model is trained, evaluated, yielded, then garbage collected before the next.
     
-    # Get models and train
-    models = get_models()
-    results = []
+    With parallel=True the models run in a process pool instead (see parallel.py)
+    and each model_complete event is yielded as soon as that model finishes,
+    which may be out of get_models() order.
     
-    print(f"\nTraining {len(models)} algorithms...")
-    print("-"*50)
+    If an identical run (same data, target, models and library versions) is in
+    the result cache, its stored events are replayed without training anything.
+    use_cache=False skips both caches and retrains (the new result is still stored).
     
-    for name, model in models.items():
-        print(f"Training {name}...")
-        result = train_and_evaluate(name, model, X_train, y_train, X_test, y_test)
-        results.append(result)
-        if result["status"] == "success":
-            print(f"  ✓ F1: {result['f1Score']:.4f}, Accuracy: {result['accuracy']:.4f}")
+    With race=True the models first race on growing subsamples (see racing.py);
+    eliminated models get a model_complete event with status 'eliminated' and
+    only the survivors are fully trained and evaluated.
     
-    print("-"*50)
+    encoding selects the feature representation: 'dense', 'sparse' or 'auto'
+    (see encoding.py). compact (default ML_COMPACT_DTYPES) trains on float32
+    matrices and integer-encoded labels (see prepare_data).
     
-    # Find best model
-    successful_results = [r for r in results if r["status"] == "success"]
-    if not successful_results:
-        raise Exception("All models failed to train")
+    model_time_limit (seconds, default ML_MODEL_TIME_LIMIT, 0 = none) bounds each
+    model; a model killed at the limit gets status 'timeout' (see timeouts.py).
     
-    best_model = max(successful_results, key=lambda x: x["f1Score"])
+    save_models ('best', 'all' or 'none', default ML_SAVE_MODELS) selects which
+    fitted models are saved to the model registry under the run's modelId, for
+    /api/predict (see registry.py).
     
-    total_time = (time.time() - start_time) * 1000  # Convert to ms
+    cancel is an optional threading.Event. Once it is set the run stops (running
+    subprocesses are killed), a 'cancelled' event is yielded and nothing is cached.
     
-    print(f"\n🏆 Best Model: {best_model['algorithm']}")
-    print(f"   F1-Score: {best_model['f1Score']:.4f}")
-    print(f"   Total Time: {total_time:.0f}ms")
-    print("="*50 + "\n")
+    data may also be an out_of_core.ChunkedDataset (a body spooled to disk): the
+    dataset is then read in chunks and never held in memory; encoding and compact
+    do not apply. Each result's "trainingStrategy" says how the model was trained
+    ('in_memory', or 'partial_fit' / 'chunked_boosting' / 'reservoir_sample' out
+    of core, see out_of_core.py).
     
-    return {
-        "results": results,
-        "bestModel": best_model,
-        "totalTime": total_time,
-        "successCount": len(successful_results),
-        "failureCount": len(results) - len(successful_results),
-        "datasetInfo": {
-            "samples": len(df),
-            "features": len(X.columns),
-            "featuresAfterEncoding": X_encoded.shape[1],
-            "classes": unique_classes,
-            "trainSize": len(X_train),
-            "testSize": len(X_test)
-        }
-    }
+    data may also be a multi_target.SharedFeatures: the run is then one task of
+    a multi-target run, over feature columns encoded once for every target
+    (its encoding and compact settings apply; see multi_target.py).
+    
+    Every stage is timed (see instrumentation.py); the 'complete' event gets the
+    run's "stageTimings" (ms). profile=True runs it under cProfile (never as a
+    replay) and adds a "profile" block to the 'complete' event.
+    
+    options: parallel, use_cache, race, encoding, compact, model_time_limit,
+    save_models, cancel (see above).
+    """
+    trace = start_trace()
+    profiler = start_profile(profile)
+    start = time.perf_counter()
+    outcome = "failed"
+    try:
+        for event in _train_streaming(data, target_column, replay=profiler is None, **options):
+            if event["type"] == "complete":
+                outcome = "replayed" if event.get("replayed") else "completed"
+                # Added to the yielded event only: a replay reports its own timings
+                event = dict(event, stageTimings={k: round(v, 2) for k, v in trace.items()})
+                if profiler is not None:
+                    event["profile"] = profile_report(profiler, event.get("modelId") or "run")
+                    profiler = None
+            elif event["type"] == "cancelled":
+                outcome = "cancelled"
+            yield event
+    except GeneratorExit:
+        # The consumer stopped reading (closed stream, cancelled job)
+        outcome = "cancelled"
+        raise
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        record_stage("run", time.perf_counter() - start)
+        count_run(outcome)
 
 
-def train_all_models_streaming(data, target_column):
-    """
-    Generator function that yields results ONE MODEL AT A TIME - MEMORY OPTIMIZED.
-    Each model is trained, evaluated, yielded, then garbage collected before the next.
-    """
+def _train_streaming(data, target_column, parallel=False, use_cache=True, race=False, encoding="auto",
+                     compact=None, model_time_limit=None, save_models=None, cancel=None, replay=True):
+    """The run behind train_all_models_streaming. replay=False never replays from the result cache."""
     print("\n" + "="*50)
     print("Starting STREAMING Advanced ML Training (Memory Optimized)")
     print("="*50)
     
     start_time = time.time()
     
-    # Convert to DataFrame
-    df = pd.DataFrame(data)
-    print(f"Dataset shape: {df.shape}")
-    
-    # Validate target column exists
-    if target_column not in df.columns:
-        raise ValueError(f"Target column '{target_column}' not found in data")
-    
-    # Prepare data
-    X = df.drop(columns=[target_column])
-    y = df[target_column]
-    
-    # Check if we have enough data
-    if len(X) < 10:
-        raise ValueError("Dataset too small. Need at least 10 samples.")
-    
-    # Check if target has at least 2 classes
-    unique_classes = y.nunique()
-    if unique_classes < 2:
-        raise ValueError(f"Target must have at least 2 classes. Found: {unique_classes}")
-    
-    print(f"Features: {len(X.columns)}, Classes: {unique_classes}")
-    
-    # One-hot encode categorical features
-    X_encoded = pd.get_dummies(X, drop_first=True)
-    print(f"After encoding: {X_encoded.shape[1]} features")
+    save_models = save_models or SAVE_MODELS_DEFAULT
+    compact = COMPACT_DEFAULT if compact is None else compact
+    if save_models not in SAVE_MODES:
+        yield {"type": "error", "error": f"Unknown saveModels '{save_models}'. Use one of: {', '.join(SAVE_MODES)}"}
+        return
     
-    # Scale features (important for linear models)
-    scaler = StandardScaler()
-    X_scaled = scaler.fit_transform(X_encoded)
+    out_of_core = isinstance(data, ChunkedDataset)
+    with span("fingerprint"):
+        if out_of_core or isinstance(data, SharedFeatures):
+            dataset_key = data.fingerprint(target_column)
+        else:
+            dataset_key = dataset_fingerprint(data, target_column)
+    cache_key = result_key(dataset_key, {"race": race, "encoding": encoding, "compact": compact, "save": save_models,
+                                         "binning": SHARED_BINNING})
+    model_id = cache_key[:20] if save_models != "none" else None
+    if use_cache and replay:
+        with span("result_cache"):
+            cached_events = result_cache.get(cache_key)
+        # A replay is only complete if the saved models are still in the registry
+        if cached_events is not None and (model_id is None or model_registry.exists(model_id)):
+            print(f"Result cache hit ({cache_key[:12]}) - replaying stored results")
+            yield from _replay(cached_events)
+            return
+    
+    with span("prepare"):
+        if out_of_core:
+            prepared = prepare_out_of_core(data, target_column)
+        elif isinstance(data, SharedFeatures):
+            # One task of a multi-target run: the features are already encoded
+            prepared = data.prepare(target_column)
+        else:
+            prepared = prepare_data(data, target_column, use_cache=use_cache, dataset_key=dataset_key,
+                                    encoding=encoding, compact=compact)
     
-    # Split data (80/20 train/test split with stratification)
-    try:
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_scaled, y, test_size=0.20, random_state=42, stratify=y
-        )
-        print(f"Train: {len(X_train)}, Test: {len(X_test)} (stratified)")
-    except ValueError:
-        # If stratification fails (too few samples per class), split without it
-        X_train, X_test, y_train, y_test = train_test_split(
-            X_scaled, y, test_size=0.20, random_state=42
-        )
-        print(f"Train: {len(X_train)}, Test: {len(X_test)} (non-stratified)")
+    # Every event is recorded so an identical later run can be replayed
+    recorded = []
     
     # Yield initial metadata
-    yield {
+    event = {
         "type": "start",
         "totalModels": 22,
-        "datasetInfo": {
-            "samples": len(df),
-            "features": len(X.columns),
-            "featuresAfterEncoding": X_encoded.shape[1],
-            "classes": unique_classes,
-            "trainSize": len(X_train),
-            "testSize": len(X_test)
-        }
+        "parallel": parallel,
+        "race": race,
+        "resultKey": cache_key,
+        "modelId": model_id,
+        "datasetInfo": prepared["datasetInfo"]
     }
+    recorded.append(event)
+    yield event
+    
+    # Fitted models are saved into a staging directory and committed at the end
+    staging = model_registry.begin(model_id) if model_id else None
+    run_prepared = dict(prepared, model_dir=staging) if staging else prepared
     
-    # Get models and train ONE AT A TIME
+    # Get models and train
     models = get_models()
-    results = []
+    model_order = list(models)
+    total_models = len(models)
+    results = {}
     successful_count = 0
     failure_count = 0
-    
-    print(f"\nTraining {len(models)} algorithms (ONE AT A TIME)...")
+    eliminated_count = 0
+    timeout_count = 0
+    time_limit = resolve_time_limit(model_time_limit)
+    
+    print(f"\nTraining {total_models} algorithms ({'PARALLEL' if parallel else 'ONE AT A TIME'})...")
+    # Out of core, the incremental models train over the whole file; the rest on the sample
+    incremental = {name: models.pop(name) for name in INCREMENTAL_MODELS if name in models} if out_of_core else {}
+    runner = run_models(models, run_prepared, parallel, cancel=cancel, time_limit=time_limit)
+    if race:
+        # The race removes eliminated models from `models` before the runner starts
+        runner = itertools.chain(race_models(models, prepared, cancel=cancel), runner)
+    if incremental:
+        runner = itertools.chain(train_incremental(incremental, run_prepared, data, cancel=cancel), runner)
     print("-"*50)
     
-    for idx, (name, model) in enumerate(models.items(), 1):
-        print(f"[{idx}/{len(models)}] Training {name}...")
-        
-        # Train and evaluate THIS model
-        result = train_and_evaluate(name, model, X_train, y_train, X_test, y_test)
+    training_start = time.perf_counter()
+    for name, result in runner:
+        if cancel is not None and cancel.is_set():
+            break
         
-        # Track results
-        results.append(result)
+        # Track results (and this model's memory use / time for the guards)
+        results[name] = result
+        if out_of_core:
+            result.setdefault("trainingStrategy", "reservoir_sample")
+            result.setdefault("rowsTrained", len(prepared["y_train"]))
+        else:
+            result.setdefault("trainingStrategy", "in_memory")
+        memory_history.record(name, result.get("memory"))
+        observe_result(name, result)
+        if name not in incremental:
+            # Incremental models trained on the whole file, not on the sample's shape
+            time_history.record(name, result, estimate_model_cost(name, *prepared_shape(prepared)))
         if result["status"] == "success":
             successful_count += 1
-            print(f"  ✓ F1: {result['f1Score']:.4f}, Accuracy: {result['accuracy']:.4f}")
+            print(f"  ✓ {name} F1: {result['f1Score']:.4f}, Accuracy: {result['accuracy']:.4f}")
+        elif result["status"] == "eliminated":
+            eliminated_count += 1
+            print(f"  ⏭ {name} {result['error']}")
+        elif result["status"] == "timeout":
+            timeout_count += 1
+            print(f"  ⏱ {name} {result['error']}")
         else:
             failure_count += 1
-            print(f"  ✗ Failed: {result.get('error', 'Unknown error')}")
+            print(f"  ✗ {name} Failed: {result.get('error', 'Unknown error')}")
         
         # Yield THIS model's result immediately
-        yield {
+        event = {
             "type": "model_complete",
-            "modelIndex": idx,
-            "totalModels": len(models),
+            "modelIndex": model_order.index(name) + 1,
+            "completedModels": len(results),
+            "totalModels": total_models,
             "result": result
         }
-        
-        # CRITICAL: Force garbage collection to free memory before next model
-        del model
-        gc.collect()
+        recorded.append(event)
+        yield event
+    record_stage("training", time.perf_counter() - training_start)
+    
+    if cancel is not None and cancel.is_set():
+        runner.close()
+        if staging:
+            model_registry.discard(staging)
+        print(f"⏹ Training cancelled after {len(results)}/{total_models} models")
+        yield {
+            "type": "cancelled",
+            "completedModels": len(results),
+            "totalModels": total_models
+        }
+        return
     
     print("-"*50)
     
+    # Summary keeps get_models() order regardless of completion order
+    results = [results[name] for name in model_order if name in results]
+    
     # Find best model
     successful_results = [r for r in results if r["status"] == "success"]
     if not successful_results:
+        if staging:
+            model_registry.discard(staging)
         yield {
             "type": "error",
             "error": "All models failed to train"
@@ -402,6 +690,33 @@ def train_all_models_streaming(data, target_column):
     
     best_model = max(successful_results, key=lambda x: x["f1Score"])
     
+    saved_models = []
+    if staging:
+        keep = [r["algorithm"] for r in successful_results] if save_models == "all" else [best_model["algorithm"]]
+        classes = np.unique(prepared["y_train"])
+        label_classes = prepared.get("label_classes")
+        metadata = {
+            "targetColumn": target_column,
+            "featureColumns": prepared["feature_transform"].columns,
+            "encoding": prepared["encoding"],
+            "classes": (classes if label_classes is None else label_classes[classes]).tolist(),
+            # Compact runs train on label codes; the models predict indexes into this list
+            "labelClasses": None if label_classes is None else label_classes.tolist(),
+            "bestModel": best_model["algorithm"],
+            "models": {r["algorithm"]: {"f1Score": r["f1Score"], "accuracy": r["accuracy"],
+                                        "trainingTime": r["trainingTime"]}
+                       for r in successful_results},
+            "datasetInfo": prepared["datasetInfo"],
+        }
+        try:
+            with span("registry_save"):
+                saved_models = model_registry.commit(model_id, staging, keep, metadata,
+                                                     prepared["feature_transform"])
+        except Exception as e:
+            print(f"❌ Could not save models: {str(e)}")
+            model_registry.discard(staging)
+            model_id = None
+    
     total_time = (time.time() - start_time) * 1000  # Convert to ms
     
     print(f"\n🏆 Best Model: {best_model['algorithm']}")
@@ -410,14 +725,25 @@ def train_all_models_streaming(data, target_column):
     print("="*50 + "\n")
     
     # Yield final summary
-    yield {
+    event = {
         "type": "complete",
         "results": results,
         "bestModel": best_model,
         "totalTime": total_time,
         "successCount": successful_count,
-        "failureCount": failure_count
+        "failureCount": failure_count,
+        "eliminatedCount": eliminated_count,
+        "timeoutCount": timeout_count,
+        "modelId": model_id,
+        "savedModels": saved_models
     }
+    recorded.append(event)
+    guarded = any("memoryGuard" in r for r in results)
+    if not timeout_count and not guarded and (model_id is not None or save_models == "none"):
+        # Timeouts and memory-guard downsizing depend on the load at the time; do not replay them
+        with span("result_cache_store"):
+            result_cache.put(cache_key, recorded)
+    yield event
     
     # Final cleanup
     gc.collect()
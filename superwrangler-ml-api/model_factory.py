@@ -0,0 +1,151 @@
+"""
+Model factory - builds the estimators of get_models() and imports each
+library only when a model that needs it is built.
+
+xgboost, lightgbm, catboost (which pulls in IPython) and sklearn's ensemble
+module take a large share of the API's import time and resident memory. Nothing
+imports them at module level any more: a web worker boots with just Flask,
+pandas and the sklearn core, and the backends load with the first training run
+(or the first saved model that is unpickled).
+
+preload() imports every backend up front. With ML_PRELOAD_MODELS=1 app.py calls
+it at import time, so `gunicorn --preload` imports the libraries once in the
+master and the forked workers share those pages copy-on-write. The process
+pool's forkserver preloads them too (parallel.py), so pool workers do not pay
+the imports per model.
+"""
+import functools
+import importlib
+import os
+import time
+
+# Import every model library at startup instead of on first use
+PRELOAD_MODELS = os.environ.get("ML_PRELOAD_MODELS", "0") == "1"
+
+# Module of every estimator class the models use
+ESTIMATOR_MODULES = {
+    "RidgeClassifier": "sklearn.linear_model",
+    "SGDClassifier": "sklearn.linear_model",
+    "Perceptron": "sklearn.linear_model",
+    "ExtraTreesClassifier": "sklearn.ensemble",
+    "AdaBoostClassifier": "sklearn.ensemble",
+    "GradientBoostingClassifier": "sklearn.ensemble",
+    "HistGradientBoostingClassifier": "sklearn.ensemble",
+    "BaggingClassifier": "sklearn.ensemble",
+    "VotingClassifier": "sklearn.ensemble",
+    "StackingClassifier": "sklearn.ensemble",
+    "XGBClassifier": "xgboost",
+    "LGBMClassifier": "lightgbm",
+    "CatBoostClassifier": "catboost",
+    "LinearSVC": "sklearn.svm",
+}
+BACKEND_MODULES = tuple(dict.fromkeys(ESTIMATOR_MODULES.values()))
+
+
+def estimator_class(class_name):
+    """The estimator class, importing its library on first use."""
+    return getattr(importlib.import_module(ESTIMATOR_MODULES[class_name]), class_name)
+
+
+def _build(class_name, **params):
+    return estimator_class(class_name)(**params)
+
+
+@functools.lru_cache(maxsize=None)
+def _extra_tree_wrapper():
+    """ExtraTreeClassifierWrapper, created on first use (it subclasses a sklearn.ensemble class)."""
+    class ExtraTreeClassifierWrapper(estimator_class("ExtraTreesClassifier")):
+        """Custom Extra Tree model (single tree)."""
+
+        # Explicit parameters: get_params() (clones in CV, the result cache key, the
+        # memory guard) only sees the arguments named in __init__
+        def __init__(self, max_depth=None, random_state=None):
+            super().__init__(n_estimators=1, max_depth=max_depth, random_state=random_state)
+
+    # Pickled (saved models, pool tasks) as model_factory.ExtraTreeClassifierWrapper
+    ExtraTreeClassifierWrapper.__module__ = __name__
+    ExtraTreeClassifierWrapper.__qualname__ = "ExtraTreeClassifierWrapper"
+    return ExtraTreeClassifierWrapper
+
+
+def __getattr__(name):
+    # Lets pickle find the lazily created wrapper class
+    if name == "ExtraTreeClassifierWrapper":
+        return _extra_tree_wrapper()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def _ensemble_bases():
+    """Base estimators shared by the Voting and Stacking models (memory-efficient versions)."""
+    return [
+        ("ridge", _build("RidgeClassifier", random_state=42)),
+        ("et", _build("ExtraTreesClassifier", n_estimators=20, max_depth=10, random_state=42, n_jobs=1)),
+        ("sgd", _build("SGDClassifier", random_state=42, max_iter=500, n_jobs=1)),
+    ]
+
+
+def _voting():
+    return _build("VotingClassifier", estimators=_ensemble_bases(), voting='soft', n_jobs=1)
+
+
+def _stacking():
+    return _build(
+        "StackingClassifier",
+        estimators=_ensemble_bases(),
+        final_estimator=_build("RidgeClassifier"),
+        n_jobs=1,
+    )
+
+
+# Builder of every model, in get_models() order
+MODEL_BUILDERS = {
+    # Advanced Linear Models (3) - NOT in Quick ML
+    "Ridge Classifier": lambda: _build("RidgeClassifier", random_state=42),
+    "SGD Classifier": lambda: _build("SGDClassifier", random_state=42, max_iter=500, n_jobs=1),
+    "Perceptron": lambda: _build("Perceptron", random_state=42, max_iter=500, n_jobs=1),
+
+    # Advanced Tree-Based Models (2) - Extra Trees only
+    "Extra Tree": lambda: _extra_tree_wrapper()(max_depth=10, random_state=42),
+    "Extra Trees Ensemble": lambda: _build("ExtraTreesClassifier", n_estimators=30, max_depth=10,
+                                           random_state=42, n_jobs=1),
+
+    # Boosting Models (6) - NONE in Quick ML - These are the power algorithms
+    "AdaBoost": lambda: _build("AdaBoostClassifier", n_estimators=30, random_state=42),
+    "Gradient Boosting": lambda: _build("GradientBoostingClassifier", n_estimators=30, max_depth=5,
+                                        random_state=42),
+    "Histogram Gradient Boosting": lambda: _build("HistGradientBoostingClassifier", max_iter=30, max_depth=5,
+                                                  random_state=42),
+    "XGBoost": lambda: _build("XGBClassifier", n_estimators=30, max_depth=5, random_state=42,
+                              use_label_encoder=False, eval_metric='logloss', n_jobs=1, verbosity=0,
+                              tree_method='hist'),
+    "LightGBM": lambda: _build("LGBMClassifier", n_estimators=30, max_depth=5, num_leaves=15, random_state=42,
+                               n_jobs=1, verbose=-1),
+    "CatBoost": lambda: _build("CatBoostClassifier", iterations=30, depth=5, random_state=42, verbose=0,
+                               thread_count=1, allow_writing_files=False),
+
+    # Ensemble Models (3) - NOT in Quick ML
+    "Bagging Classifier": lambda: _build("BaggingClassifier", n_estimators=20, random_state=42, n_jobs=1),
+    "Voting Classifier": _voting,
+    "Stacking Classifier": _stacking,
+
+    # Linear SVC (1) - More advanced than basic SVC in Quick ML
+    "Linear SVC": lambda: _build("LinearSVC", random_state=42, dual=False, max_iter=1000),
+}
+
+
+def build_models(names=None):
+    """Fresh, unfitted models by name (all of them by default), in MODEL_BUILDERS order."""
+    return {
+        name: build() for name, build in MODEL_BUILDERS.items()
+        if names is None or name in names
+    }
+
+
+def preload():
+    """Imports every model library now. Returns the seconds it took."""
+    start = time.perf_counter()
+    for module in BACKEND_MODULES:
+        importlib.import_module(module)
+    elapsed = time.perf_counter() - start
+    print(f"✓ Preloaded model libraries in {elapsed:.2f}s")
+    return elapsed
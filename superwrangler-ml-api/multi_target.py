@@ -0,0 +1,188 @@
+"""
+Multi-target training: several candidate target columns of one dataset.
+
+POST /api/train-multi-stream compares targets in one request instead of one
+upload per target. The rows become one DataFrame, and the feature columns are
+encoded and scaled once (encode_features). Each target then runs as a task
+over that shared matrix: only its labels, its split and its CV folds are
+built per task (SharedFeatures.prepare). train_all_models_streaming accepts a
+SharedFeatures in place of the data, so each task is an ordinary run: result
+cache replay, model registry, race, parallel and time limits all apply.
+
+The feature columns are every column except:
+
+  targets    every target column is left out of every task, so no task
+             learns one candidate target from another
+  excluded   excludeColumns of the request (columns derived from a target)
+  derived    columns detected as a re-coding of a target: their values map
+             one to one onto the target's values (e.g. "label" / "label_id")
+
+Every event of a task has a "target" field. The stream starts with a
+'multi_start' event (targets, feature columns, excluded columns) and ends
+with 'multi_complete' (best model and modelId per target, encoding time).
+A target that cannot be trained (e.g. a single class) gets an 'error' event
+and the remaining targets still run.
+"""
+import hashlib
+import time
+
+import numpy as np
+import pandas as pd
+
+from encoding import COMPACT_DEFAULT, encode_features
+from instrumentation import span
+from preprocess_cache import dataset_fingerprint
+
+
+def derived_columns(df, targets, candidates):
+    """
+    {column: target} for the candidate columns whose values map one to one onto
+    a target's values (the same column under another encoding).
+    """
+    target_codes = {}
+    for t in targets:
+        codes, uniques = pd.factorize(df[t], use_na_sentinel=False)
+        # Row identifiers map one to one onto anything unique; only class-like targets count
+        if 1 < len(uniques) < len(df):
+            target_codes[t] = (codes, len(uniques))
+    derived = {}
+    for c in candidates:
+        n_unique = df[c].nunique(dropna=False)
+        for t, (codes, n_classes) in target_codes.items():
+            if n_unique != n_classes:
+                continue
+            column_codes = pd.factorize(df[c], use_na_sentinel=False)[0]
+            if len(np.unique(column_codes.astype(np.int64) * n_classes + codes)) == n_classes:
+                derived[c] = t
+                break
+    return derived
+
+
+class SharedFeatures:
+    """The feature columns of a dataset, encoded once and shared by one task per target column."""
+
+    def __init__(self, data, targets, exclude=(), encoding="auto", compact=False):
+        with span("dataframe"):
+            self.frame = data if isinstance(data, pd.DataFrame) else pd.DataFrame(data)
+        print(f"Dataset shape: {self.frame.shape}")
+        if not targets:
+            raise ValueError("No target columns given")
+        if len(set(targets)) != len(targets):
+            raise ValueError("Target columns must be unique")
+        missing = [c for c in [*targets, *exclude] if c not in self.frame.columns]
+        if missing:
+            raise ValueError(f"Columns not found in data: {', '.join(map(str, missing))}")
+        if len(self.frame) < 10:
+            raise ValueError("Dataset too small. Need at least 10 samples.")
+
+        self.targets = list(targets)
+        self.encoding = encoding
+        self.compact = compact
+        candidates = [c for c in self.frame.columns if c not in self.targets and c not in exclude]
+        self.derived = derived_columns(self.frame, self.targets, candidates)
+        self.excluded = list(exclude) + list(self.derived)
+        self.feature_columns = [c for c in candidates if c not in self.derived]
+        if not self.feature_columns:
+            raise ValueError("No feature columns left after excluding the targets")
+        for column, target in self.derived.items():
+            print(f"  ⚠️ Excluding '{column}': one-to-one with target '{target}'")
+
+        # The feature set depends on every target and exclusion, not only the task's target
+        self.digest = dataset_fingerprint(
+            data, None, extra=["multi", self.targets, self.excluded, encoding, compact])
+        self.encoding_time = None
+        self._encoded = None
+
+    def fingerprint(self, target):
+        """Dataset key of one task (see preprocess_cache.dataset_fingerprint)."""
+        return hashlib.blake2b(f"{self.digest}:{target}".encode(), digest_size=20).hexdigest()
+
+    def encoded(self):
+        """encode_features output of the shared feature columns (computed on first use)."""
+        if self._encoded is None:
+            start = time.perf_counter()
+            with span("encode"):
+                self._encoded = encode_features(self.frame[self.feature_columns], self.encoding,
+                                                compact=self.compact)
+            self.encoding_time = (time.perf_counter() - start) * 1000
+            print(f"Shared encoding: {self._encoded['n_features']} features ({self._encoded['encoding']}"
+                  f"{', compact' if self.compact else ''}) in {self.encoding_time:.0f}ms")
+        return self._encoded
+
+    def prepare(self, target):
+        """The prepared dict (see ml_engine.prepare_data) of one target's task."""
+        from ml_engine import _assemble_prepared, _split_indices, _target_labels
+
+        y, label_classes, n_classes = _target_labels(self.frame[target], self.compact)
+        print(f"Target '{target}': Features: {len(self.feature_columns)}, Classes: {n_classes}")
+        train_idx, test_idx = _split_indices(y)
+        prepared = _assemble_prepared(self.encoded(), y, label_classes, n_classes, train_idx, test_idx,
+                                      len(self.feature_columns))
+        prepared["datasetInfo"]["excludedColumns"] = [t for t in self.targets if t != target] + self.excluded
+        return prepared
+
+    def release(self):
+        """Drops the frame and the shared matrix once every task has run."""
+        self.frame = self._encoded = None
+
+
+def train_multi_target_streaming(data, target_columns, exclude_columns=(), encoding="auto", compact=None,
+                                 cancel=None, **options):
+    """
+    Trains every model for each target column in turn over one shared feature
+    matrix, yielding each task's events tagged with "target" (see module docstring).
+    options are passed through to train_all_models_streaming.
+    """
+    from ml_engine import train_all_models_streaming
+
+    start_time = time.time()
+    compact = COMPACT_DEFAULT if compact is None else compact
+    shared = SharedFeatures(data, target_columns, exclude_columns, encoding, compact)
+    yield {
+        "type": "multi_start",
+        "targets": shared.targets,
+        "featureColumns": len(shared.feature_columns),
+        "excludedColumns": shared.excluded,
+        "derivedColumns": shared.derived,
+    }
+
+    summary = []
+    try:
+        for index, target in enumerate(shared.targets, 1):
+            if cancel is not None and cancel.is_set():
+                return
+            print(f"\n[MULTI] Target {index}/{len(shared.targets)}: {target}")
+            entry = {"target": target, "status": "failed"}
+            try:
+                for event in train_all_models_streaming(shared, target, encoding=encoding, compact=compact,
+                                                        cancel=cancel, **options):
+                    if event["type"] == "complete":
+                        best = event["bestModel"]
+                        entry = {"target": target, "status": "success", "bestModel": best["algorithm"],
+                                 "f1Score": best["f1Score"], "modelId": event["modelId"],
+                                 "replayed": event.get("replayed", False)}
+                    elif event["type"] == "error":
+                        entry["error"] = event["error"]
+                    elif event["type"] == "cancelled":
+                        entry["status"] = "cancelled"
+                    yield dict(event, target=target)
+            except (KeyError, ValueError) as e:
+                print(f"  ❌ Target '{target}' failed: {str(e)}")
+                entry["error"] = str(e)
+                yield {"type": "error", "target": target, "error": str(e)}
+            summary.append(entry)
+    finally:
+        encoding_time = shared.encoding_time
+        shared.release()
+
+    if cancel is not None and cancel.is_set():
+        return
+    successful = [e for e in summary if e["status"] == "success"]
+    total_time = (time.time() - start_time) * 1000
+    print(f"[MULTI] {len(successful)}/{len(summary)} targets trained in {total_time:.0f}ms")
+    yield {
+        "type": "multi_complete",
+        "targets": summary,
+        "encodingTime": encoding_time,
+        "totalTime": total_time,
+    }
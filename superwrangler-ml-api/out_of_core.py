@@ -0,0 +1,477 @@
+"""
+Out-of-core training for datasets larger than memory.
+
+The uploaded body (CSV, NDJSON, Arrow or Parquet) is spooled to a file in
+ML_OOC_DIR and read back in chunks of ML_OOC_CHUNK_ROWS rows
+(ingest.iter_body_chunks); the whole dataset is never in memory at once. Each
+row is sent to train or test by a random draw seeded per chunk, so every pass
+over the file sees the same split.
+
+  pass 1   row and class counts, category vocabularies (the
+           ML_OOC_MAX_CATEGORIES most frequent values of each column)
+  pass 2   scaler statistics (StandardScaler.partial_fit on the encoded chunks)
+           and stratified reservoir samples: ML_OOC_SAMPLE_ROWS training rows and
+           ML_OOC_TEST_ROWS test rows, every class keeping its share of rows
+  pass 3+  incremental training, ML_OOC_EPOCHS passes (train_incremental)
+
+The encoding is the sparse mode of encoding.py in float32 with integer label
+codes (as in compact mode), so the FeatureTransform and the saved models work
+with /api/predict and /api/predict-batch like those of any other run. Column
+types are taken from the first chunk.
+
+Training strategy of each model (the result's "trainingStrategy"):
+  partial_fit         SGD Classifier, Perceptron: partial_fit on every chunk
+  chunked_boosting    XGBoost, LightGBM: boosting continued on every chunk, each
+                      chunk adding its share of the configured trees (when
+                      there are more chunks than trees, chunks are grouped so
+                      the total stays at the configured count)
+  reservoir_sample    every other model: the normal pipeline on the training sample
+
+All models are evaluated on the test sample. The CV score of the incremental
+models is progressive validation: each chunk is scored before it is trained on.
+"""
+import hashlib
+import json
+import os
+import tempfile
+import time
+import weakref
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+from sklearn.metrics import f1_score
+from sklearn.preprocessing import OneHotEncoder, StandardScaler
+
+from encoding import COMPACT_DTYPE, FeatureTransform, categorical_columns, inputs_for_model, model_inputs
+from evaluation import evaluate_fitted, make_fold_ids
+from ingest import iter_body_chunks
+from preprocess_cache import PREPROCESS_VERSION
+from registry import save_model
+
+OOC_DIR = os.environ.get("ML_OOC_DIR") or None  # None: the system temp directory
+OOC_CHUNK_ROWS = int(os.environ.get("ML_OOC_CHUNK_ROWS", "50000"))
+OOC_SAMPLE_ROWS = int(os.environ.get("ML_OOC_SAMPLE_ROWS", "100000"))
+OOC_TEST_ROWS = int(os.environ.get("ML_OOC_TEST_ROWS", "20000"))
+OOC_EPOCHS = int(os.environ.get("ML_OOC_EPOCHS", "1"))
+OOC_MAX_CATEGORIES = int(os.environ.get("ML_OOC_MAX_CATEGORIES", "1000"))
+
+# Binary uploads larger than this train out of core without being asked to (0 = only on request)
+OOC_THRESHOLD_MB = int(os.environ.get("ML_OOC_THRESHOLD_MB", "1024"))
+
+TEST_FRACTION = 0.20
+SEED = 42
+
+# A class keeps at least this many rows in each reservoir (or all of its rows)
+MIN_CLASS_ROWS = 10
+
+PARTIAL_FIT_MODELS = ("SGD Classifier", "Perceptron")
+CHUNKED_BOOSTING_MODELS = ("XGBoost", "LightGBM")
+INCREMENTAL_MODELS = PARTIAL_FIT_MODELS + CHUNKED_BOOSTING_MODELS
+
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+class ChunkedDataset:
+    """
+    A request body spooled to disk, read back in chunks as often as needed.
+    The file is deleted by close() or when the object is garbage collected.
+    """
+
+    def __init__(self, path, mimetype, digest, size, chunk_rows=OOC_CHUNK_ROWS):
+        self.path = path
+        self.mimetype = mimetype
+        self.digest = digest  # blake2b of the body
+        self.size = size
+        self.chunk_rows = chunk_rows
+        self._finalizer = weakref.finalize(self, _remove, path)
+
+    def chunks(self):
+        """Yields the dataset as DataFrames of at most chunk_rows rows."""
+        with open(self.path, "rb") as f:
+            yield from iter_body_chunks(self.mimetype, f, self.chunk_rows)
+
+    def split_chunks(self):
+        """
+        Yields (chunk, is_test, keys) per chunk: the test assignment of every row
+        and a random reservoir key, identical on every pass.
+        """
+        for idx, chunk in enumerate(self.chunks()):
+            rng = np.random.default_rng([SEED, idx])
+            yield chunk, rng.random(len(chunk)) < TEST_FRACTION, rng.random(len(chunk))
+
+    def fingerprint(self, target_column):
+        """Dataset key for the caches: the body hash plus everything that shapes the sample."""
+        h = hashlib.blake2b(digest_size=20)
+        settings = [PREPROCESS_VERSION, "out-of-core", target_column, self.chunk_rows,
+                    OOC_SAMPLE_ROWS, OOC_TEST_ROWS, OOC_MAX_CATEGORIES, OOC_EPOCHS]
+        h.update(json.dumps(settings, default=str).encode())
+        h.update(self.digest.encode())
+        return h.hexdigest()
+
+    def close(self):
+        self._finalizer()
+
+
+def spool_body(mimetype, stream, chunk_rows=OOC_CHUNK_ROWS):
+    """Copies a request body stream to disk (hashing it on the way). Returns a ChunkedDataset."""
+    h = hashlib.blake2b(digest_size=20)
+    size = 0
+    fd, path = tempfile.mkstemp(prefix="ooc-", suffix=".body", dir=OOC_DIR)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                block = stream.read(1024 * 1024)
+                if not block:
+                    break
+                h.update(block)
+                f.write(block)
+                size += len(block)
+    except BaseException:
+        _remove(path)
+        raise
+    if not size:
+        _remove(path)
+        raise ValueError("Request body is empty")
+    print(f"[OOC] Spooled {size / (1024 * 1024):.1f}MB to {path}")
+    return ChunkedDataset(path, (mimetype or "").lower(), h.hexdigest(), size, chunk_rows)
+
+
+class _Reservoir:
+    """
+    Stratified reservoir sample: per class, the rows with the smallest random
+    keys seen so far, up to that class's capacity.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity  # rows per class code
+        self.rows = None
+        self.codes = np.empty(0, dtype=np.int32)
+        self.keys = np.empty(0)
+
+    def add(self, X, codes, keys):
+        if self.rows is not None:
+            X = pd.concat([self.rows, X], ignore_index=True)
+            codes = np.concatenate([self.codes, codes])
+            keys = np.concatenate([self.keys, keys])
+        order = np.lexsort((keys, codes))  # by class, then key
+        sorted_codes = codes[order]
+        rank = np.arange(len(order)) - np.searchsorted(sorted_codes, sorted_codes)
+        keep = np.sort(order[rank < self.capacity[sorted_codes]])
+        self.rows = X.iloc[keep].reset_index(drop=True)
+        self.codes, self.keys = codes[keep], keys[keep]
+
+
+def _capacities(counts, total):
+    """Reservoir size per class: its share of `total`, at least MIN_CLASS_ROWS, at most its row count."""
+    share = np.floor(counts * min(1.0, total / max(counts.sum(), 1)))
+    return np.minimum(counts, np.maximum(share, MIN_CLASS_ROWS)).astype(np.int64)
+
+
+class _Schema:
+    """Feature columns and label classes from pass 1; turns raw chunks into (X, label codes)."""
+
+    def __init__(self, target_column, columns, cat_cols, label_classes):
+        self.target_column = target_column
+        self.columns = columns
+        self.cat_cols = cat_cols
+        self.num_cols = [c for c in columns if c not in cat_cols]
+        self.label_classes = label_classes
+        self._label_index = pd.Index(label_classes)
+
+    def features(self, chunk):
+        """Feature columns of a chunk, numeric columns coerced to numbers."""
+        missing = [c for c in self.columns if c not in chunk.columns]
+        if missing:
+            raise ValueError(f"Chunk is missing columns: {', '.join(map(str, missing))}")
+        X = chunk[self.columns]
+        for c in self.num_cols:
+            if not pd.api.types.is_numeric_dtype(X[c].dtype):
+                X[c] = pd.to_numeric(X[c], errors="coerce")
+        return X
+
+    def codes(self, chunk):
+        """int32 label code of every row (-1: no target value)."""
+        return self._label_index.get_indexer(chunk[self.target_column]).astype(np.int32)
+
+
+def _scan(dataset, target_column):
+    """Pass 1: schema, per-class train/test row counts, category vocabularies and the chunk count."""
+    columns = cat_cols = None
+    label_counts = {}  # label -> [train rows, test rows]
+    vocab = {}
+    n_chunks = 0
+    for chunk, is_test, _ in dataset.split_chunks():
+        if columns is None:
+            if target_column not in chunk.columns:
+                raise ValueError(f"Target column '{target_column}' not found in data")
+            columns = [c for c in chunk.columns if c != target_column]
+            if not columns:
+                raise ValueError("Dataset has no feature columns")
+            cat_cols = categorical_columns(chunk[columns])
+            vocab = {c: Counter() for c in cat_cols}
+        n_chunks += 1
+        for split, rows in ((0, ~is_test), (1, is_test)):
+            for label, count in chunk[target_column][rows].value_counts().items():
+                label_counts.setdefault(label, [0, 0])[split] += count
+        for c in cat_cols:
+            vocab[c].update(chunk[c].astype(str).value_counts().to_dict())
+            if len(vocab[c]) > 4 * OOC_MAX_CATEGORIES:
+                # Approximate top-k: keep the heavy hitters, drop the long tail
+                vocab[c] = Counter(dict(vocab[c].most_common(2 * OOC_MAX_CATEGORIES)))
+    if columns is None:
+        raise ValueError("Uploaded dataset is empty")
+
+    labels = list(label_counts)
+    try:
+        labels = sorted(labels)
+    except TypeError:
+        pass  # mixed label types that do not sort: order of appearance
+    counts = np.array([label_counts[label] for label in labels], dtype=np.int64).reshape(-1, 2)
+    categories = {c: sorted(v for v, _ in vocab[c].most_common(OOC_MAX_CATEGORIES)) for c in cat_cols}
+    schema = _Schema(target_column, columns, cat_cols, np.asarray(labels))
+    return schema, counts, categories, n_chunks
+
+
+def _fit_transform_stats(dataset, schema, categories, train_capacity, test_capacity):
+    """Pass 2: fits the FeatureTransform's scalers chunk by chunk and fills both reservoirs."""
+    scaler = StandardScaler() if schema.num_cols else None
+    one_hot = cat_scaler = None
+    if schema.cat_cols:
+        one_hot = OneHotEncoder(categories=[categories[c] for c in schema.cat_cols], drop="first",
+                                sparse_output=True, dtype=COMPACT_DTYPE, handle_unknown="ignore")
+        one_hot.fit(pd.DataFrame({c: categories[c][:1] for c in schema.cat_cols}))
+        cat_scaler = StandardScaler(with_mean=False)
+
+    train, test = _Reservoir(train_capacity), _Reservoir(test_capacity)
+    for chunk, is_test, keys in dataset.split_chunks():
+        X = schema.features(chunk)
+        if scaler is not None:
+            scaler.partial_fit(X[schema.num_cols].astype(COMPACT_DTYPE).to_numpy())
+        if cat_scaler is not None:
+            cat_scaler.partial_fit(one_hot.transform(X[schema.cat_cols].astype(str)))
+        codes = schema.codes(chunk)
+        for reservoir, rows in ((train, ~is_test), (test, is_test)):
+            rows &= codes >= 0
+            reservoir.add(X[rows], codes[rows], keys[rows])
+
+    transform = FeatureTransform("sparse", schema.columns, schema.cat_cols, scaler, num_cols=schema.num_cols,
+                                 one_hot=one_hot, cat_scaler=cat_scaler, categories=categories,
+                                 dtype=COMPACT_DTYPE)
+    return transform, train, test
+
+
+def prepare_out_of_core(dataset, target_column):
+    """
+    Runs passes 1 and 2 over a ChunkedDataset. Returns a prepared dict like
+    ml_engine.prepare_data's, built from the reservoir samples, plus
+    "out_of_core" (row and chunk counts for train_incremental).
+    """
+    start = time.time()
+    print(f"[OOC] Scanning {dataset.size / (1024 * 1024):.1f}MB in chunks of {dataset.chunk_rows} rows")
+    schema, counts, categories, n_chunks = _scan(dataset, target_column)
+    train_rows, test_rows = int(counts[:, 0].sum()), int(counts[:, 1].sum())
+    if train_rows + test_rows < 10:
+        raise ValueError("Dataset too small. Need at least 10 samples.")
+    if len(schema.label_classes) < 2:
+        raise ValueError(f"Target must have at least 2 classes. Found: {len(schema.label_classes)}")
+    print(f"[OOC] {train_rows + test_rows} rows in {n_chunks} chunks, "
+          f"Features: {len(schema.columns)}, Classes: {len(schema.label_classes)}")
+
+    transform, train, test = _fit_transform_stats(
+        dataset, schema, categories,
+        _capacities(counts[:, 0], OOC_SAMPLE_ROWS), _capacities(counts[:, 1], OOC_TEST_ROWS),
+    )
+    if train.rows is None or len(train.codes) < 2 or len(test.codes) == 0:
+        raise ValueError("Dataset too small. Need at least 10 samples.")
+
+    encoded_train = transform.transform(train.rows)
+    encoded_test = transform.transform(test.rows)
+    n_features = encoded_train["matrix"].shape[1]
+    print(f"[OOC] Samples: {len(train.codes)} train / {len(test.codes)} test rows, "
+          f"{n_features} features after encoding ({time.time() - start:.1f}s)")
+
+    out_of_core = {
+        "chunks": n_chunks,
+        "chunkRows": dataset.chunk_rows,
+        "trainRows": train_rows,
+        "sampleRows": len(train.codes),
+        "testSampleRows": len(test.codes),
+        "epochs": OOC_EPOCHS,
+        "spooledMb": round(dataset.size / (1024 * 1024), 1),
+    }
+    y_train = train.codes
+    return {
+        "X_train": encoded_train["matrix"],
+        "X_test": encoded_test["matrix"],
+        "X_train_native": encoded_train["native"],
+        "X_test_native": encoded_test["native"],
+        "y_train": y_train,
+        "y_test": test.codes,
+        "cv_folds": make_fold_ids(y_train),
+        "encoding": "sparse",
+        "feature_transform": transform,
+        "label_classes": schema.label_classes,
+        "out_of_core": dict(out_of_core, schema=schema),
+        "datasetInfo": {
+            "samples": train_rows + test_rows,
+            "features": len(schema.columns),
+            "featuresAfterEncoding": n_features,
+            "encoding": "sparse",
+            "classes": len(schema.label_classes),
+            "trainSize": train_rows,
+            "testSize": len(test.codes),
+            "outOfCore": out_of_core,
+        },
+    }
+
+
+class _IncrementalModel:
+    """One model trained chunk by chunk, with its progressive validation scores."""
+
+    def __init__(self, name, model, n_classes, rounds):
+        self.name = name
+        self.model = model
+        self.strategy = "partial_fit" if name in PARTIAL_FIT_MODELS else "chunked_boosting"
+        self.classes = np.arange(n_classes, dtype=np.int32)
+        self.fitted = False
+        self.pending = []  # boosting: chunks held back until every class is present
+        self.rows = 0
+        self.seconds = 0.0
+        self.scores = []
+        self.error = None
+        # boosting: the configured trees, spread over the rounds (chunk x epoch)
+        self.trees = model.get_params()["n_estimators"] if self.strategy == "chunked_boosting" else None
+        self.rounds = rounds
+        self.round = 0
+        self.trees_fitted = 0
+
+    def _quota(self):
+        """Trees the current round may add: its cumulative share of the budget minus the trees so far."""
+        return self.trees * self.round // self.rounds - self.trees_fitted
+
+    def update(self, X, y):
+        self.round += 1
+        if self.error is not None or len(y) == 0:
+            return
+        try:
+            if self.fitted:
+                self.scores.append(f1_score(y, np.ravel(self.model.predict(X)), average="weighted", zero_division=0))
+            start = time.perf_counter()
+            if self.strategy == "partial_fit":
+                self.model.partial_fit(X, y, classes=self.classes)
+                self.fitted = True
+            elif self._quota() < 1:
+                self.pending.append((X, y))  # no tree left for this round: train with the next one
+            else:
+                self._boost(X, y)
+            self.seconds += time.perf_counter() - start
+            self.rows += len(y)
+        except Exception as e:
+            self.error = e
+
+    def _boost(self, X, y, final=False):
+        # XGBoost and LightGBM infer the classes from y: train on every class at once
+        self.pending.append((X, y))
+        y_all = np.concatenate([p[1] for p in self.pending])
+        if len(np.unique(y_all)) < len(self.classes):
+            if not final:
+                return
+            if self.fitted:
+                return  # the last rows lack a class: the trees so far stand
+            raise ValueError("Some classes have no training rows")
+        frames = [p[0] for p in self.pending]
+        if len(frames) == 1:
+            X_all = frames[0]
+        elif sp.issparse(frames[0]):
+            X_all = sp.vstack(frames, format="csr")
+        else:
+            X_all = pd.concat(frames, ignore_index=True)
+        self.pending = []
+        self.model.set_params(n_estimators=max(1, self._quota()))
+        if not self.fitted:
+            self.model.fit(X_all, y_all)
+        elif self.name == "XGBoost":
+            self.model.fit(X_all, y_all, xgb_model=self.model.get_booster())
+        else:
+            self.model.fit(X_all, y_all, init_model=self.model.booster_)
+        self.fitted = True
+        self.trees_fitted = self.tree_count()
+
+    def tree_count(self):
+        """Boosting rounds the fitted model has."""
+        if self.name == "XGBoost":
+            return self.model.get_booster().num_boosted_rounds()
+        return self.model.booster_.current_iteration()
+
+    def finish(self):
+        self.round = self.rounds  # whatever is left of the budget
+        if self.error is None and self.pending and (not self.fitted or self._quota() >= 1):
+            try:
+                start = time.perf_counter()
+                self._boost(*self.pending.pop(), final=True)
+                self.seconds += time.perf_counter() - start
+            except Exception as e:
+                self.error = e
+        if self.error is None and self.fitted and self.trees is not None:
+            # the saved params describe the final model, not the last round
+            self.model.set_params(n_estimators=self.trees_fitted)
+
+
+def train_incremental(models, prepared, dataset, cancel=None):
+    """
+    Pass 3+: trains the models in `models` (names from INCREMENTAL_MODELS) on
+    every training row of the spooled dataset, all of them from the same read
+    of each chunk, for ML_OOC_EPOCHS passes. Yields (name, result) once the
+    passes are done; nothing if `cancel` is set midway.
+    """
+    from ml_engine import build_result, failed_result
+
+    if not models:
+        return
+    info = prepared["out_of_core"]
+    schema, transform = info["schema"], prepared["feature_transform"]
+    rounds = info["chunks"] * OOC_EPOCHS
+    learners = [_IncrementalModel(name, model, len(schema.label_classes), rounds) for name, model in models.items()]
+    print(f"[OOC] Training {', '.join(models)} on {info['trainRows']} rows "
+          f"({info['chunks']} chunks x {OOC_EPOCHS} epoch(s))")
+
+    for epoch in range(OOC_EPOCHS):
+        for chunk, is_test, _ in dataset.split_chunks():
+            if cancel is not None and cancel.is_set():
+                return
+            codes = schema.codes(chunk)
+            rows = ~is_test & (codes >= 0)
+            encoded = transform.transform(schema.features(chunk)[rows])
+            for learner in learners:
+                learner.update(model_inputs(learner.name, encoded), codes[rows])
+        print(f"[OOC] Epoch {epoch + 1}/{OOC_EPOCHS} done")
+
+    for learner in learners:
+        learner.finish()
+        name, model = learner.name, learner.model
+        if learner.error is not None:
+            print(f"  ❌ {name} failed: {str(learner.error)}")
+            result = failed_result(name, learner.error)
+        else:
+            try:
+                X_train, X_test = inputs_for_model(name, model, prepared)
+                metrics, _ = evaluate_fitted(model, X_train, prepared["y_train"], X_test, prepared["y_test"])
+                scores = np.array(learner.scores) if learner.scores else np.array([metrics["f1"]])
+                result = build_result(name, model.get_params(), metrics, scores.mean(), scores.std(),
+                                      learner.seconds * 1000)
+                if prepared.get("model_dir"):
+                    save_model(prepared["model_dir"], name, model)
+            except Exception as e:
+                print(f"  ❌ {name} failed: {str(e)}")
+                result = failed_result(name, e)
+        result.update(trainingStrategy=learner.strategy, rowsTrained=learner.rows // OOC_EPOCHS)
+        if learner.trees is not None and learner.error is None:
+            result["treesTrained"] = learner.trees_fitted
+        yield name, result
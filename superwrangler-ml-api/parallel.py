@@ -0,0 +1,405 @@
+"""
+Parallel model training - runs the models from get_models() in a process pool.
+
+The prepared matrices (dense or CSR) are copied into shared memory ONCE and
+every worker maps the same pages read-only, so adding workers does not add
+copies of the dataset. A small scheduler decides which model starts next:
+the most expensive models go first (so the long fits overlap), and a model is
+only started when its estimated working memory fits in the memory budget.
+"""
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+from multiprocessing import get_context, shared_memory
+
+import numpy as np
+import scipy.sparse as sp
+
+from encoding import matrix_nbytes
+from memory import memory_history
+from model_factory import BACKEND_MODULES
+from timeouts import POLL_SECONDS, needs_isolation, time_history
+
+# Parallel mode default (requests can override with "parallel": true/false),
+# worker count and memory budget (MB) for parallel runs
+PARALLEL_DEFAULT = os.environ.get("ML_PARALLEL", "0") == "1"
+PARALLEL_WORKERS = int(os.environ.get("ML_PARALLEL_WORKERS", os.cpu_count() or 1))
+MEMORY_BUDGET_MB = int(os.environ.get("ML_MEMORY_BUDGET_MB", "1536"))
+
+# Seconds an IsolatedRun may take to start (forkserver + attaching the data)
+# before its time limit begins
+ISOLATED_STARTUP_GRACE = 30
+
+# Resident memory of one idle worker (interpreter + sklearn/xgboost/lightgbm/catboost)
+WORKER_BASE_MB = 180
+
+# Relative fit cost of each model per (sample x feature), Ridge Classifier = 1.
+# Includes the 3-fold CV that train_and_evaluate runs after the main fit.
+MODEL_COST = {
+    "Ridge Classifier": 1.0,
+    "SGD Classifier": 2.0,
+    "Perceptron": 1.5,
+    "Extra Tree": 1.5,
+    "Extra Trees Ensemble": 25.0,
+    "AdaBoost": 30.0,
+    "Gradient Boosting": 60.0,
+    "Histogram Gradient Boosting": 15.0,
+    "XGBoost": 20.0,
+    "LightGBM": 12.0,
+    "CatBoost": 35.0,
+    "Bagging Classifier": 40.0,
+    "Voting Classifier": 25.0,
+    "Stacking Classifier": 90.0,
+    "Linear SVC": 4.0,
+}
+
+# Models whose cost grows with the number of classes (one-vs-rest / one tree per class)
+PER_CLASS_MODELS = {
+    "Ridge Classifier", "SGD Classifier", "Perceptron", "Linear SVC",
+    "Gradient Boosting", "Histogram Gradient Boosting", "XGBoost", "LightGBM", "CatBoost",
+}
+
+# Worker-side state, filled in by _init_worker
+_worker_data = {}
+
+
+def estimate_model_cost(name, n_samples, n_features, n_classes):
+    """Estimated relative CPU cost of training and evaluating one model."""
+    cost = MODEL_COST.get(name, 10.0) * n_samples * max(n_features, 1)
+    if name in PER_CLASS_MODELS and n_classes > 2:
+        cost *= n_classes
+    return cost
+
+
+def prepared_shape(prepared):
+    """(samples, features, classes) of a prepared training set, for the cost estimates."""
+    X_train = prepared["X_train"]
+    n_features = X_train.shape[1] if X_train.ndim > 1 else 1
+    return X_train.shape[0], n_features, len(np.unique(prepared["y_train"]))
+
+
+def predicted_seconds(name, prepared):
+    """Predicted wall time of one model on a prepared dataset (see timeouts.py)."""
+    return time_history.predict_seconds(name, estimate_model_cost(name, *prepared_shape(prepared)))
+
+
+def estimate_model_memory_mb(name, X_train):
+    """
+    Estimated peak memory (MB) of one worker while it trains this model, from
+    the memory factor observed in earlier runs (see memory.py).
+    """
+    data_mb = matrix_nbytes(X_train) / (1024 * 1024)
+    return WORKER_BASE_MB + memory_history.factor(name) * data_mb
+
+
+def _to_shared(array, blocks):
+    """Copies an array into a new shared memory block (appended to blocks). Returns its spec."""
+    array = np.ascontiguousarray(array)
+    block = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+    blocks.append(block)
+    np.ndarray(array.shape, dtype=array.dtype, buffer=block.buf)[...] = array
+    return (block.name, array.shape, array.dtype.str)
+
+
+def _attach(spec, blocks):
+    """Maps a shared memory block (created by _to_shared) as a read-only array."""
+    name, shape, dtype = spec
+    block = shared_memory.SharedMemory(name=name)
+    blocks.append(block)  # the mapping must outlive the array
+    array = np.ndarray(shape, dtype=np.dtype(dtype), buffer=block.buf)
+    array.flags.writeable = False
+    return array
+
+
+def _share(value, blocks):
+    """
+    Spec for sending one prepared value to the workers: dense arrays and the
+    three buffers of a CSR matrix go through shared memory; anything else
+    (labels, DataFrames of native categoricals) is pickled.
+    """
+    if sp.issparse(value):
+        return ("csr", value.shape, [_to_shared(a, blocks) for a in (value.data, value.indices, value.indptr)])
+    if isinstance(value, np.ndarray) and value.dtype != object:
+        return ("ndarray", _to_shared(value, blocks))
+    return ("pickle", value)
+
+
+def _unshare(spec, blocks):
+    kind = spec[0]
+    if kind == "csr":
+        data, indices, indptr = (_attach(s, blocks) for s in spec[2])
+        return sp.csr_matrix((data, indices, indptr), shape=spec[1], copy=False)
+    if kind == "ndarray":
+        return _attach(spec[1], blocks)
+    return spec[1]
+
+
+def share_prepared(prepared, blocks):
+    """Specs of every prepared value for the worker processes (new shared blocks go into `blocks`)."""
+    return {
+        key: _share(value, blocks) for key, value in prepared.items()
+        if key not in ("datasetInfo", "feature_transform", "out_of_core")
+    }
+
+
+def release_shared(blocks):
+    for block in blocks:
+        block.close()
+        block.unlink()
+
+
+def _init_worker(specs):
+    """Pool initializer: attaches the shared matrices once per worker process."""
+    blocks = []
+    _worker_data["prepared"] = {key: _unshare(spec, blocks) for key, spec in specs.items()}
+    _worker_data["blocks"] = blocks  # keep the mappings alive
+
+
+def _train_in_worker(name, model, keep_artifacts, memory_factors):
+    """
+    Pool task: trains and evaluates one model on the shared data.
+    memory_factors is the parent's memory history of this model, for the memory guard.
+    Returns (result, artifacts); artifacts (fitted model + CV fold models) only
+    when requested, for reuse by the ensemble stage in the parent.
+    """
+    from ml_engine import train_prepared
+
+    memory_history.load(name, memory_factors)
+    artifacts = {} if keep_artifacts else None
+    result = train_prepared(name, model, _worker_data["prepared"], artifacts=artifacts)
+    if artifacts:
+        artifacts = {"model": artifacts["model"], "fold_models": artifacts["fold_models"]}
+    return result, artifacts or None
+
+
+def _mp_context():
+    """
+    forkserver where available: workers fork from a clean server process that
+    has already imported ml_engine and the model libraries, instead of forking
+    the (threaded) web server.
+    """
+    try:
+        ctx = get_context("forkserver")
+        ctx.set_forkserver_preload(["ml_engine", *BACKEND_MODULES])
+        return ctx
+    except ValueError:
+        return get_context("spawn")
+
+
+def _isolated_main(conn, specs, name, model, keep_artifacts, memory_factors):
+    """Process body of an IsolatedRun: reports ready, then sends (result, artifacts)."""
+    _init_worker(specs)
+    try:
+        conn.send(None)  # attached and about to train: the time limit starts now
+        conn.send(_train_in_worker(name, model, keep_artifacts, memory_factors))
+    finally:
+        conn.close()
+
+
+class IsolatedRun:
+    """
+    One model trained in its own process, attached to the shared dataset.
+    Unlike a pool task it can be killed, which is how time limits and
+    cancellation stop a model in the middle of its fit.
+
+    The time limit counts from the moment the process is ready to train, so
+    a cold forkserver start is not charged to the model.
+    """
+
+    def __init__(self, name, model, specs, keep_artifacts=False, time_limit=None):
+        ctx = _mp_context()
+        self.name = name
+        self.time_limit = time_limit
+        self._conn, child_conn = ctx.Pipe(duplex=False)
+        self.process = ctx.Process(
+            target=_isolated_main,
+            args=(child_conn, specs, name, model, keep_artifacts, memory_history.observed(name)),
+            daemon=True,
+        )
+        self.process.start()
+        child_conn.close()
+        self.started = time.time()
+        self.ready = False
+
+    def poll(self):
+        """(result, artifacts) once the model is finished, failed or over its limit; None while it runs."""
+        from ml_engine import failed_result
+
+        while self._conn.poll():
+            try:
+                outcome = self._conn.recv()
+            except EOFError:
+                self.process.join()
+                return failed_result(self.name, f"Worker process exited with code {self.process.exitcode}"), None
+            if outcome is None:
+                self.ready = True
+                self.started = time.time()
+                continue
+            self.process.join()
+            return outcome
+        if not self.process.is_alive():
+            return failed_result(self.name, f"Worker process exited with code {self.process.exitcode}"), None
+        limit = self.time_limit if self.ready else (self.time_limit or 0) + ISOLATED_STARTUP_GRACE
+        if self.time_limit and time.time() - self.started > limit:
+            self.kill()
+            print(f"  ⏱ {self.name} killed after its {self.time_limit:.0f}s time limit")
+            result = failed_result(self.name, f"Exceeded the {self.time_limit:.0f}s time limit", status="timeout")
+            result["timeLimit"] = self.time_limit
+            return result, None
+        return None
+
+    def wait(self, timeout):
+        """Blocks until the process has something to report or the timeout passes."""
+        self._conn.poll(timeout)
+
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+        self.process.join()
+        self._conn.close()
+
+
+def run_isolated(name, model, specs, keep_artifacts=False, time_limit=None, cancel=None):
+    """
+    Trains one model in an IsolatedRun and waits for it.
+    Returns (result, artifacts), or None if `cancel` was set (the process is killed).
+    """
+    run = IsolatedRun(name, model, specs, keep_artifacts, time_limit)
+    try:
+        while True:
+            outcome = run.poll()
+            if outcome is not None:
+                return outcome
+            if cancel is not None and cancel.is_set():
+                print(f"  ⏹ {name} stopped (run cancelled)")
+                return None
+            run.wait(POLL_SECONDS)
+    finally:
+        run.kill()
+
+
+def _terminate_workers(executor):
+    """Kills the pool's worker processes (ProcessPoolExecutor has no public API for this before 3.14)."""
+    for process in list((getattr(executor, "_processes", None) or {}).values()):
+        process.kill()
+
+
+def train_models_parallel(models, prepared, max_workers=None, memory_budget_mb=None,
+                          keep_artifacts=(), artifacts=None, cancel=None, time_limit=None):
+    """
+    Generator that trains models in a process pool and yields (name, result)
+    AS EACH MODEL FINISHES - completion order, not get_models() order.
+
+    Scheduling: models are started most-expensive-first. A model is only
+    started if its estimated memory fits next to the models already running;
+    otherwise a smaller pending model is started instead (backfilling). When
+    nothing is running, the next model always starts, even if it is over budget.
+
+    Models named in keep_artifacts send their fitted artifacts back into the
+    `artifacts` dict (see ensembles.py).
+
+    With a time_limit, models predicted to come close to it get their own
+    killable process (IsolatedRun) instead of a pool slot (see timeouts.py).
+    When `cancel` (a threading.Event) is set, every worker is killed and the
+    generator returns.
+    """
+    from ml_engine import failed_result
+
+    max_workers = max(1, min(max_workers or PARALLEL_WORKERS, len(models)))
+    budget_mb = memory_budget_mb or MEMORY_BUDGET_MB
+
+    X_train = prepared["X_train"]
+    shape = prepared_shape(prepared)
+    pending = sorted(models, key=lambda n: estimate_model_cost(n, *shape), reverse=True)
+    memory_mb = {name: estimate_model_memory_mb(name, X_train) for name in models}
+    isolate = {name for name in models if needs_isolation(predicted_seconds(name, prepared), time_limit)}
+
+    print(f"Parallel training: {max_workers} workers, memory budget {budget_mb}MB")
+
+    blocks = []
+    executor = None
+    in_flight = {}  # future -> (name, estimated MB, start time)
+    isolated = {}   # IsolatedRun -> estimated MB
+    try:
+        specs = share_prepared(prepared, blocks)
+
+        executor = ProcessPoolExecutor(
+            max_workers=max_workers,
+            mp_context=_mp_context(),
+            initializer=_init_worker,
+            initargs=(specs,),
+        )
+
+        used_mb = 0.0
+
+        while pending or in_flight or isolated:
+            # Start every pending model that fits into the free slots and budget
+            for name in list(pending):
+                if len(in_flight) + len(isolated) >= max_workers:
+                    break
+                if (in_flight or isolated) and used_mb + memory_mb[name] > budget_mb:
+                    continue
+                pending.remove(name)
+                if name in isolate:
+                    run = IsolatedRun(name, models[name], specs, name in keep_artifacts, time_limit)
+                    isolated[run] = memory_mb[name]
+                else:
+                    try:
+                        future = executor.submit(
+                            _train_in_worker, name, models[name], name in keep_artifacts,
+                            memory_history.observed(name),
+                        )
+                    except Exception as e:
+                        # Pool is broken (a worker died) - report instead of hanging
+                        yield name, failed_result(name, e)
+                        continue
+                    in_flight[future] = (name, memory_mb[name], time.time())
+                used_mb += memory_mb[name]
+                print(f"  → Started {name}{' (isolated)' if name in isolate else ''} "
+                      f"(~{memory_mb[name]:.0f}MB, {used_mb:.0f}/{budget_mb}MB in use)")
+
+            # Poll while isolated runs have deadlines or the run can be cancelled
+            polling = bool(isolated) or cancel is not None
+            if in_flight:
+                done, _ = wait(in_flight, timeout=POLL_SECONDS if polling else None, return_when=FIRST_COMPLETED)
+            else:
+                done = set()
+                next(iter(isolated)).wait(POLL_SECONDS)
+
+            if cancel is not None and cancel.is_set():
+                print("  ⏹ Run cancelled - stopping workers")
+                return
+
+            for future in done:
+                name, mb, started = in_flight.pop(future)
+                used_mb -= mb
+                print(f"  ← {name} finished after {time.time() - started:.1f}s")
+                try:
+                    result, kept = future.result()
+                    if kept is not None and result["status"] == "success":
+                        artifacts[name] = kept
+                except Exception as e:
+                    # Worker crashed (e.g. killed by the OOM killer)
+                    print(f"  ❌ {name} worker failed: {str(e)}")
+                    result = failed_result(name, e)
+                yield name, result
+
+            for run in list(isolated):
+                outcome = run.poll()
+                if outcome is None:
+                    continue
+                used_mb -= isolated.pop(run)
+                print(f"  ← {run.name} finished after {time.time() - run.started:.1f}s")
+                result, kept = outcome
+                if kept is not None and result["status"] == "success":
+                    artifacts[run.name] = kept
+                yield run.name, result
+    finally:
+        for run in isolated:
+            run.kill()
+        if executor is not None:
+            if in_flight:
+                # Cancelled or closed early: do not wait for the running models
+                _terminate_workers(executor)
+            executor.shutdown(wait=True, cancel_futures=True)
+        release_shared(blocks)
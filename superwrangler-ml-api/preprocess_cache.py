@@ -0,0 +1,239 @@
+"""
+Content-addressed cache for preprocessed feature matrices.
+
+prepare_data() (encoding + scaling + train_test_split) is keyed by a
+fingerprint of the raw dataset plus the target column and encoding mode, so
+resubmitting the same dataset skips all the pandas work.
+
+Two tiers:
+  - Memory: LRU bounded by entry count AND bytes.
+  - Disk (optional, ML_PREPROCESS_CACHE_DIR): one directory of .npy files per
+    entry, loaded back with mmap_mode='r' so a hit only maps the pages in.
+    Dense entries only; sparse-encoded entries stay in the memory tier.
+"""
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+import scipy.sparse as sp
+
+from encoding import matrix_nbytes
+
+# Bump when prepare_data() changes so old entries are never reused
+PREPROCESS_VERSION = 7
+
+CACHE_MAX_ENTRIES = int(os.environ.get("ML_PREPROCESS_CACHE_ENTRIES", "8"))
+CACHE_MAX_MB = int(os.environ.get("ML_PREPROCESS_CACHE_MB", "512"))
+CACHE_DIR = os.environ.get("ML_PREPROCESS_CACHE_DIR", "")
+CACHE_DISK_MAX_MB = int(os.environ.get("ML_PREPROCESS_CACHE_DISK_MB", "4096"))
+
+# Keys of prepared dicts that hold arrays, and fitted objects stored with
+# joblib (everything else goes into meta.json)
+ARRAY_KEYS = ("X_train", "X_test", "y_train", "y_test", "cv_folds")
+OPTIONAL_ARRAY_KEYS = ("X_train_binned", "X_test_binned")
+OBJECT_KEYS = ("feature_transform", "label_classes")
+
+
+def dataset_fingerprint(data, target_column, extra=None):
+    """
+    Stable hash of the dataset contents, target column and preprocessing version.
+    data is the raw list of row dicts or a DataFrame. extra is any JSON-able
+    value that also changes the preprocessing output (e.g. options).
+    """
+    h = hashlib.blake2b(digest_size=20)
+    h.update(json.dumps([PREPROCESS_VERSION, target_column, extra], default=str).encode())
+    if isinstance(data, pd.DataFrame):
+        h.update(json.dumps([str(c) for c in data.columns]).encode())
+        h.update(json.dumps([str(t) for t in data.dtypes]).encode())
+        h.update(pd.util.hash_pandas_object(data, index=False).to_numpy().tobytes())
+    else:
+        # Hash the rows as they were received - no DataFrame construction
+        h.update(json.dumps(data, default=str, separators=(",", ":")).encode())
+    return h.hexdigest()
+
+
+def _entry_bytes(prepared):
+    return sum(
+        matrix_nbytes(v) for v in prepared.values()
+        if isinstance(v, (np.ndarray, pd.DataFrame)) or sp.issparse(v)
+    )
+
+
+def _disk_compatible(prepared):
+    """Only all-dense entries go to the disk tier (CSR / DataFrames stay in memory)."""
+    return all(
+        isinstance(v, np.ndarray) if k in ARRAY_KEYS else not (isinstance(v, pd.DataFrame) or sp.issparse(v))
+        for k, v in prepared.items()
+    )
+
+
+class PreprocessCache:
+    """Thread-safe two-tier LRU cache of prepare_data() outputs."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, max_mb=CACHE_MAX_MB,
+                 cache_dir=CACHE_DIR, disk_max_mb=CACHE_DISK_MAX_MB):
+        self.max_entries = max_entries
+        self.max_bytes = max_mb * 1024 * 1024
+        self.cache_dir = cache_dir or None
+        self.disk_max_bytes = disk_max_mb * 1024 * 1024
+        self._entries = OrderedDict()  # key -> prepared dict
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Returns the cached prepared dict for key, or None."""
+        with self._lock:
+            prepared = self._entries.get(key)
+            if prepared is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return prepared
+
+        prepared = self._load_from_disk(key)
+        with self._lock:
+            if prepared is None:
+                self.misses += 1
+                return None
+            self.disk_hits += 1
+            # Promote to the memory tier so the next hit skips the filesystem
+            self._insert(key, prepared)
+        return prepared
+
+    def put(self, key, prepared):
+        """Stores a prepared dict in memory and (if enabled) on disk."""
+        with self._lock:
+            self._insert(key, prepared)
+        if self.cache_dir:
+            try:
+                self._save_to_disk(key, prepared)
+            except OSError as e:
+                print(f"[CACHE] Could not write preprocessing cache entry: {str(e)}")
+
+    def invalidate(self, key=None):
+        """Drops one entry (or everything when key is None) from both tiers."""
+        with self._lock:
+            keys = [key] if key is not None else list(self._entries)
+            for k in keys:
+                prepared = self._entries.pop(k, None)
+                if prepared is not None:
+                    self._bytes -= _entry_bytes(prepared)
+        if self.cache_dir:
+            paths = [os.path.join(self.cache_dir, key)] if key is not None else [
+                os.path.join(self.cache_dir, d) for d in os.listdir(self.cache_dir)
+            ]
+            for path in paths:
+                shutil.rmtree(path, ignore_errors=True)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "diskHits": self.disk_hits,
+                "misses": self.misses,
+            }
+
+    # ---- memory tier ----
+
+    def _insert(self, key, prepared):
+        """Adds an entry and evicts least-recently-used ones. Caller holds the lock."""
+        size = _entry_bytes(prepared)
+        if size > self.max_bytes or self.max_entries <= 0:
+            return
+        old = self._entries.pop(key, None)
+        if old is not None:
+            self._bytes -= _entry_bytes(old)
+        self._entries[key] = prepared
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self._bytes -= _entry_bytes(evicted)
+
+    # ---- disk tier ----
+
+    def _save_to_disk(self, key, prepared):
+        final_dir = os.path.join(self.cache_dir, key)
+        if os.path.isdir(final_dir) or not _disk_compatible(prepared):
+            return
+        # Write into a temp dir and rename, so readers never see half an entry
+        tmp_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".tmp-")
+        try:
+            for name in ARRAY_KEYS:
+                array = np.asarray(prepared[name])
+                np.save(os.path.join(tmp_dir, f"{name}.npy"), array,
+                        allow_pickle=array.dtype == object)
+            for name in OPTIONAL_ARRAY_KEYS:
+                if name in prepared:
+                    np.save(os.path.join(tmp_dir, f"{name}.npy"), np.asarray(prepared[name]))
+            for name in OBJECT_KEYS:
+                if name in prepared:
+                    joblib.dump(prepared[name], os.path.join(tmp_dir, f"{name}.joblib"))
+            meta = {k: v for k, v in prepared.items() if k not in ARRAY_KEYS + OPTIONAL_ARRAY_KEYS + OBJECT_KEYS}
+            with open(os.path.join(tmp_dir, "meta.json"), "w") as f:
+                json.dump(meta, f, default=str)
+            os.replace(tmp_dir, final_dir)
+        except OSError:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            if not os.path.isdir(final_dir):
+                raise
+        self._trim_disk()
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        entry_dir = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(entry_dir, "meta.json")) as f:
+                prepared = json.load(f)
+            for name in ARRAY_KEYS:
+                path = os.path.join(entry_dir, f"{name}.npy")
+                try:
+                    prepared[name] = np.load(path, mmap_mode="r")
+                except ValueError:
+                    # Object arrays (string labels) cannot be memory-mapped
+                    prepared[name] = np.load(path, allow_pickle=True)
+            for name in OPTIONAL_ARRAY_KEYS:
+                path = os.path.join(entry_dir, f"{name}.npy")
+                if os.path.exists(path):
+                    prepared[name] = np.load(path, mmap_mode="r")
+            for name in OBJECT_KEYS:
+                path = os.path.join(entry_dir, f"{name}.joblib")
+                if os.path.exists(path):
+                    prepared[name] = joblib.load(path)
+            os.utime(entry_dir)  # LRU order for the disk tier
+            return prepared
+        except (OSError, ValueError):
+            return None
+
+    def _trim_disk(self):
+        """Removes least-recently-used disk entries above the disk byte limit."""
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            if name.startswith(".") or not os.path.isdir(path):
+                continue
+            size = sum(e.stat().st_size for e in os.scandir(path))
+            entries.append((os.path.getmtime(path), size, path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.disk_max_bytes:
+                break
+            shutil.rmtree(path, ignore_errors=True)
+            total -= size
+
+
+# Process-wide cache used by ml_engine.prepare_data
+preprocess_cache = PreprocessCache()
@@ -0,0 +1,105 @@
+"""
+Successive-halving model racing - drops weak models before their full fit.
+
+Every model from get_models() is fitted on a small stratified subsample of the
+training set and scored (weighted F1) on a fixed validation slice of it. The
+bottom fraction is eliminated, the subsample grows, and the survivors race
+again. Only the models left after the last round get the full fit, the test
+evaluation and CV. The test set is never touched by the race.
+"""
+import math
+import os
+
+import numpy as np
+from sklearn.base import clone
+from sklearn.metrics import f1_score
+from sklearn.model_selection import train_test_split
+
+from encoding import inputs_for_model, take_rows
+
+# Fraction of the race training set used in each round (grows x2 per round)
+RACE_FRACTIONS = (0.125, 0.25, 0.5)
+RACE_DROP_FRACTION = float(os.environ.get("ML_RACE_DROP_FRACTION", "0.5"))
+RACE_MIN_SURVIVORS = int(os.environ.get("ML_RACE_MIN_SURVIVORS", "3"))
+RACE_MIN_SAMPLES = 50
+
+
+def stratified_sample(rows, y, size, random_state=42):
+    """Stratified sample of `size` row indices (non-stratified if a class is too small)."""
+    try:
+        return train_test_split(rows, train_size=size, random_state=random_state, stratify=y[rows])[0]
+    except ValueError:
+        return train_test_split(rows, train_size=size, random_state=random_state)[0]
+
+
+def race_models(models, prepared, drop_fraction=RACE_DROP_FRACTION,
+                min_survivors=RACE_MIN_SURVIVORS, cancel=None):
+    """
+    Generator that races `models` and yields (name, result) for every model that
+    is eliminated (status 'eliminated', with its partial score) or fails.
+
+    Eliminated and failed models are REMOVED from the `models` dict, so when
+    the generator is exhausted `models` holds only the survivors.
+    Stops early once the optional `cancel` event is set.
+    """
+    from ml_engine import failed_result
+
+    # Hold out a validation slice of the TRAINING set for race scoring
+    y_train = prepared["y_train"]
+    all_rows = np.arange(len(y_train))
+    race_rows = stratified_sample(all_rows, y_train, 0.8)
+    val_rows = np.setdiff1d(all_rows, race_rows)
+    y_val = y_train[val_rows]
+    n_race = len(race_rows)
+    n_classes = len(np.unique(y_train[race_rows]))
+
+    sizes = []
+    for fraction in RACE_FRACTIONS:
+        size = min(n_race, max(RACE_MIN_SAMPLES, n_classes * 5, int(n_race * fraction)))
+        if not sizes or size > sizes[-1]:
+            sizes.append(size)
+
+    print(f"Racing {len(models)} models over {len(sizes)} rounds {sizes} "
+          f"(drop {drop_fraction:.0%}, keep >= {min_survivors})")
+
+    for round_idx, size in enumerate(sizes, 1):
+        if len(models) <= min_survivors:
+            break
+
+        sub_rows = stratified_sample(race_rows, y_train, size, random_state=42 + round_idx) if size < n_race else race_rows
+
+        scores = {}
+        for name, model in list(models.items()):
+            if cancel is not None and cancel.is_set():
+                return
+            try:
+                candidate = clone(model)
+                X_train, _ = inputs_for_model(name, candidate, prepared)
+                candidate.fit(take_rows(X_train, sub_rows), y_train[sub_rows])
+                y_pred = np.ravel(candidate.predict(take_rows(X_train, val_rows)))
+                scores[name] = f1_score(y_val, y_pred, average='weighted', zero_division=0)
+            except Exception as e:
+                print(f"  ❌ {name} failed in race round {round_idx}: {str(e)}")
+                del models[name]
+                yield name, failed_result(name, e)
+
+        keep = max(min_survivors, math.ceil(len(scores) * (1 - drop_fraction)))
+        ranked = sorted(scores, key=scores.get, reverse=True)
+        print(f"  Round {round_idx} ({size} samples): "
+              + ", ".join(f"{n} {scores[n]:.3f}" for n in ranked))
+
+        for name in ranked[keep:]:
+            del models[name]
+            result = failed_result(
+                name,
+                f"Eliminated in race round {round_idx} (F1 {scores[name]:.4f} on {size} samples)",
+                status="eliminated",
+            )
+            result.update({
+                "raceScore": float(scores[name]),
+                "raceRound": round_idx,
+                "raceSamples": size,
+            })
+            yield name, result
+
+    print(f"Race survivors: {', '.join(models)}")
@@ -0,0 +1,276 @@
+"""
+Persisted model registry.
+
+A training run saves its fitted estimators (the best one, or all of them)
+together with the fitted FeatureTransform (dummy column layout, scalers,
+one-hot encoder, native categories) under a model id:
+
+    ML_MODEL_DIR/<model id>/
+        meta.json               target, feature columns, classes, metrics, files
+        transform.joblib        encoding.FeatureTransform
+        <algorithm>.joblib      one fitted estimator per saved model
+
+Models are written into a staging directory while the run trains (workers
+save their own model, so nothing large travels back to the parent) and the
+directory is renamed into place once the run completes.
+
+Loading goes through an in-memory LRU of (model id, algorithm) entries; the
+estimators are loaded with joblib mmap_mode='r', so their large arrays are
+mapped from the page cache instead of copied into the process.
+"""
+import json
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from encoding import model_inputs
+
+MODEL_DIR = os.environ.get("ML_MODEL_DIR", "models")
+REGISTRY_MAX_MODELS = int(os.environ.get("ML_REGISTRY_MAX_MODELS", "20"))
+MODEL_CACHE_ENTRIES = int(os.environ.get("ML_MODEL_CACHE_ENTRIES", "8"))
+
+# Which models a run saves: 'best', 'all' or 'none' (per request: "saveModels")
+SAVE_MODES = ("best", "all", "none")
+SAVE_MODELS_DEFAULT = os.environ.get("ML_SAVE_MODELS", "best")
+
+# Staging directories older than this are left over from crashed runs
+STALE_STAGING_SECONDS = 24 * 3600
+
+
+class ModelNotFoundError(KeyError):
+    """Raised for an unknown model id or an algorithm that was not saved."""
+
+
+def _filename(algorithm):
+    return re.sub(r"[^A-Za-z0-9]+", "_", algorithm).strip("_").lower() + ".joblib"
+
+
+def save_model(model_dir, algorithm, model):
+    """Writes one fitted estimator into a run's staging directory."""
+    joblib.dump(model, os.path.join(model_dir, _filename(algorithm)))
+
+
+class LoadedModel:
+    """A saved estimator plus the preprocessing it was trained with."""
+
+    def __init__(self, model_id, algorithm, meta, transform, estimator):
+        self.model_id = model_id
+        self.algorithm = algorithm
+        self.meta = meta
+        self.transform = transform
+        self.estimator = estimator
+
+    def predict(self, X, probabilities=False):
+        """
+        Predictions for a DataFrame of raw feature rows (the target column, if
+        present, is ignored). Returns (labels, probabilities or None).
+        """
+        inputs = model_inputs(self.algorithm, self.transform.transform(X))
+        labels = self._labels(np.ravel(self.estimator.predict(inputs)))
+        proba = None
+        if probabilities and hasattr(self.estimator, "predict_proba"):
+            try:
+                proba = self.estimator.predict_proba(inputs)
+            except Exception:
+                proba = None
+        return labels, proba
+
+    def _labels(self, codes):
+        """Original labels of a compact run's label codes (other runs predict labels directly)."""
+        label_classes = self.meta.get("labelClasses")
+        if label_classes is None:
+            return codes
+        return np.asarray(label_classes, dtype=object)[codes.astype(np.intp)]
+
+    @property
+    def classes(self):
+        classes = getattr(self.estimator, "classes_", None)
+        return None if classes is None else self._labels(np.asarray(classes)).tolist()
+
+
+class ModelRegistry:
+    """Saved models on disk plus a thread-safe LRU of loaded ones."""
+
+    def __init__(self, root=MODEL_DIR, max_models=REGISTRY_MAX_MODELS, cache_entries=MODEL_CACHE_ENTRIES):
+        self.root = root
+        self.max_models = max_models
+        self.cache_entries = cache_entries
+        self._loaded = OrderedDict()  # (model id, algorithm) -> LoadedModel
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    # ---- saving ----
+
+    def begin(self, model_id):
+        """Creates a staging directory for a run that will be saved as model_id."""
+        os.makedirs(self.root, exist_ok=True)
+        self._remove_stale_staging()
+        path = os.path.join(self.root, f".staging-{model_id}-{uuid.uuid4().hex[:8]}")
+        os.makedirs(path)
+        return path
+
+    def commit(self, model_id, staging, keep, metadata, transform):
+        """
+        Moves a staging directory into place as model_id. Only the algorithms
+        in `keep` are kept; metadata must include "models" (algorithm -> metrics).
+        Returns the list of saved algorithms.
+        """
+        saved = []
+        for algorithm in list(metadata["models"]):
+            path = os.path.join(staging, _filename(algorithm))
+            if algorithm in keep and os.path.exists(path):
+                metadata["models"][algorithm]["file"] = _filename(algorithm)
+                saved.append(algorithm)
+            else:
+                del metadata["models"][algorithm]
+        for name in os.listdir(staging):
+            if name.endswith(".joblib") and name not in {_filename(a) for a in saved}:
+                os.remove(os.path.join(staging, name))
+
+        joblib.dump(transform, os.path.join(staging, "transform.joblib"))
+        metadata = dict(metadata, modelId=model_id, createdAt=time.time())
+        with open(os.path.join(staging, "meta.json"), "w") as f:
+            json.dump(metadata, f, default=str)
+
+        final = os.path.join(self.root, model_id)
+        trash = None
+        if os.path.isdir(final):
+            trash = os.path.join(self.root, f".trash-{model_id}-{uuid.uuid4().hex[:8]}")
+            os.replace(final, trash)
+        os.replace(staging, final)
+        if trash:
+            shutil.rmtree(trash, ignore_errors=True)
+        self._forget(model_id)
+        self._prune()
+        print(f"[REGISTRY] Saved {len(saved)} model(s) as {model_id}")
+        return saved
+
+    def discard(self, staging):
+        shutil.rmtree(staging, ignore_errors=True)
+
+    # ---- reading ----
+
+    def exists(self, model_id):
+        return os.path.isfile(os.path.join(self.root, model_id, "meta.json"))
+
+    def metadata(self, model_id):
+        """meta.json of a saved model. Raises ModelNotFoundError."""
+        if not re.fullmatch(r"[A-Za-z0-9_-]+", model_id or ""):
+            raise ModelNotFoundError(f"Model '{model_id}' not found")
+        try:
+            with open(os.path.join(self.root, model_id, "meta.json")) as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            raise ModelNotFoundError(f"Model '{model_id}' not found")
+
+    def list(self):
+        """Metadata of every saved model, newest first."""
+        if not os.path.isdir(self.root):
+            return []
+        models = []
+        for name in os.listdir(self.root):
+            if not name.startswith("."):
+                try:
+                    models.append(self.metadata(name))
+                except ModelNotFoundError:
+                    continue
+        return sorted(models, key=lambda m: m.get("createdAt", 0), reverse=True)
+
+    def load(self, model_id, algorithm=None):
+        """
+        LoadedModel for one saved algorithm (default: the run's best model).
+        Raises ModelNotFoundError.
+        """
+        meta = None
+        if algorithm is None:
+            meta = self.metadata(model_id)
+            algorithm = meta["bestModel"]
+        key = (model_id, algorithm)
+        with self._lock:
+            loaded = self._loaded.get(key)
+            if loaded is not None:
+                self._loaded.move_to_end(key)
+                self.hits += 1
+                return loaded
+
+        meta = meta or self.metadata(model_id)
+        entry = meta["models"].get(algorithm)
+        if entry is None:
+            raise ModelNotFoundError(
+                f"'{algorithm}' was not saved for model '{model_id}'. Saved: {', '.join(meta['models'])}"
+            )
+        model_path = os.path.join(self.root, model_id)
+        estimator = joblib.load(os.path.join(model_path, entry["file"]), mmap_mode="r")
+        transform = joblib.load(os.path.join(model_path, "transform.joblib"))
+        loaded = LoadedModel(model_id, algorithm, meta, transform, estimator)
+
+        with self._lock:
+            self.misses += 1
+            self._loaded[key] = loaded
+            while len(self._loaded) > self.cache_entries:
+                self._loaded.popitem(last=False)
+        return loaded
+
+    def checkout(self, model_id):
+        """
+        Writable copies of every saved estimator of a model (not memory-mapped,
+        not cached), for updating: returns (meta, transform, {algorithm: estimator}).
+        Raises ModelNotFoundError.
+        """
+        meta = self.metadata(model_id)
+        model_path = os.path.join(self.root, model_id)
+        transform = joblib.load(os.path.join(model_path, "transform.joblib"))
+        estimators = {
+            algorithm: joblib.load(os.path.join(model_path, entry["file"]))
+            for algorithm, entry in meta["models"].items()
+        }
+        return meta, transform, estimators
+
+    def delete(self, model_id):
+        """Removes a saved model. Returns False if it did not exist."""
+        if not self.exists(model_id):
+            return False
+        self._forget(model_id)
+        shutil.rmtree(os.path.join(self.root, model_id), ignore_errors=True)
+        return True
+
+    def stats(self):
+        with self._lock:
+            return {"loaded": len(self._loaded), "hits": self.hits, "misses": self.misses}
+
+    # ---- housekeeping ----
+
+    def _forget(self, model_id):
+        with self._lock:
+            for key in [k for k in self._loaded if k[0] == model_id]:
+                del self._loaded[key]
+
+    def _prune(self):
+        """Deletes the oldest saved models above max_models."""
+        for meta in self.list()[self.max_models:]:
+            self.delete(meta["modelId"])
+
+    def _remove_stale_staging(self):
+        now = time.time()
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name.startswith((".staging-", ".trash-")) and now - os.path.getmtime(path) > STALE_STAGING_SECONDS:
+                shutil.rmtree(path, ignore_errors=True)
+
+
+def rows_frame(rows):
+    """DataFrame from prediction input: list of row dicts or an already parsed DataFrame."""
+    return rows if isinstance(rows, pd.DataFrame) else pd.DataFrame(rows)
+
+
+# Process-wide registry used by ml_engine and app.py
+model_registry = ModelRegistry()
@@ -0,0 +1,224 @@
+"""
+Replay cache for complete training runs.
+
+Every estimator in get_models() uses random_state=42, so the same dataset,
+target, model configuration and library versions always produce the same
+results. A finished run's events (start, model_complete..., complete) are
+stored under a key built from all four; a later identical request is answered
+by replaying them instead of refitting anything. Runs in which a model timed
+out or was downsized by the memory guard depend on the load at the time and
+are not stored.
+
+Entries are evicted by total size (serialized bytes) and by age. With
+ML_RESULT_CACHE_DIR set, entries are also written to disk as JSON so they
+survive worker restarts and redeploys. The disk
+tier is bounded too: each write removes expired files, then the oldest ones
+above ML_RESULT_CACHE_DISK_MB / ML_RESULT_CACHE_DISK_ENTRIES.
+"""
+import hashlib
+import json
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+RESULT_CACHE_MAX_MB = int(os.environ.get("ML_RESULT_CACHE_MB", "64"))
+RESULT_CACHE_TTL = int(os.environ.get("ML_RESULT_CACHE_TTL", "86400"))  # seconds
+RESULT_CACHE_DIR = os.environ.get("ML_RESULT_CACHE_DIR", "")
+RESULT_CACHE_DISK_MAX_MB = int(os.environ.get("ML_RESULT_CACHE_DISK_MB", "256"))
+RESULT_CACHE_DISK_MAX_ENTRIES = int(os.environ.get("ML_RESULT_CACHE_DISK_ENTRIES", "1000"))
+
+# A result key is a hex blake2b digest (see result_key)
+RESULT_KEY_PATTERN = re.compile(r"[0-9a-f]{40}")
+
+# Libraries whose version can change the fitted models
+VERSIONED_LIBRARIES = ("sklearn", "xgboost", "lightgbm", "catboost", "numpy", "pandas")
+
+_model_config_hash = None
+
+
+def library_versions():
+    """Installed versions of the libraries that affect training results."""
+    import importlib
+
+    versions = {}
+    for name in VERSIONED_LIBRARIES:
+        try:
+            versions[name] = importlib.import_module(name).__version__
+        except ImportError:
+            versions[name] = None
+    return versions
+
+
+def model_config_hash():
+    """Hash of every model's name and parameters in get_models() (computed once)."""
+    global _model_config_hash
+    if _model_config_hash is None:
+        from ml_engine import get_models
+
+        config = {
+            name: sorted((k, str(v)) for k, v in model.get_params().items())
+            for name, model in get_models().items()
+        }
+        payload = json.dumps([config, library_versions()], sort_keys=True)
+        _model_config_hash = hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+    return _model_config_hash
+
+
+def result_key(dataset_key, options=None):
+    """Cache key for a run: dataset fingerprint (includes target) + models + versions."""
+    payload = json.dumps([dataset_key, model_config_hash(), options], sort_keys=True, default=str)
+    return hashlib.blake2b(payload.encode(), digest_size=20).hexdigest()
+
+
+class ResultCache:
+    """Thread-safe store of finished runs' event lists, bounded by bytes and age."""
+
+    def __init__(self, max_mb=RESULT_CACHE_MAX_MB, ttl=RESULT_CACHE_TTL,
+                 cache_dir=RESULT_CACHE_DIR, disk_max_mb=RESULT_CACHE_DISK_MAX_MB,
+                 disk_max_entries=RESULT_CACHE_DISK_MAX_ENTRIES):
+        self.max_bytes = max_mb * 1024 * 1024
+        self.ttl = ttl
+        self.cache_dir = cache_dir or None
+        self.disk_max_bytes = disk_max_mb * 1024 * 1024
+        self.disk_max_entries = disk_max_entries
+        self._entries = OrderedDict()  # key -> (created_at, size, events)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        if self.cache_dir:
+            os.makedirs(self.cache_dir, exist_ok=True)
+
+    def get(self, key):
+        """Returns the stored event list for key, or None if missing/expired."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.time() - entry[0] > self.ttl:
+                self._drop(key)
+                entry = None
+            if entry is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[2]
+
+        entry = self._load_from_disk(key)
+        with self._lock:
+            if entry is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._insert(key, *entry)
+        return entry[2]
+
+    def put(self, key, events):
+        """Stores a finished run's events."""
+        serialized = json.dumps(events)
+        created_at = time.time()
+        with self._lock:
+            self._insert(key, created_at, len(serialized), events)
+        if self.cache_dir:
+            try:
+                tmp_path = os.path.join(self.cache_dir, f".{key}.tmp")
+                with open(tmp_path, "w") as f:
+                    f.write(serialized)
+                os.replace(tmp_path, os.path.join(self.cache_dir, f"{key}.json"))
+            except OSError as e:
+                print(f"[CACHE] Could not write result cache entry: {str(e)}")
+            self._trim_disk()
+
+    def invalidate(self, key=None):
+        """
+        Drops one entry, or every entry when key is None. Returns the count removed.
+        Raises ValueError if key is not a result key.
+        """
+        if key is not None and not RESULT_KEY_PATTERN.fullmatch(key):
+            raise ValueError(f"Invalid result key '{key}'")
+        with self._lock:
+            keys = [key] if key is not None else list(self._entries)
+            removed = sum(1 for k in keys if self._drop(k))
+        if self.cache_dir:
+            names = [f"{key}.json"] if key is not None else os.listdir(self.cache_dir)
+            for name in names:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    if key is not None and not removed:
+                        removed = 1
+                except OSError:
+                    pass
+        return removed
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "bytes": self._bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+            }
+
+    def _insert(self, key, created_at, size, events):
+        """Adds an entry, then evicts expired and least-recently-used ones. Caller holds the lock."""
+        if size > self.max_bytes:
+            return
+        self._drop(key)
+        self._entries[key] = (created_at, size, events)
+        self._bytes += size
+        now = time.time()
+        for k in [k for k, (t, _, _) in self._entries.items() if now - t > self.ttl]:
+            self._drop(k)
+        while self._bytes > self.max_bytes:
+            self._drop(next(iter(self._entries)))
+
+    def _drop(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._bytes -= entry[1]
+        return True
+
+    def _load_from_disk(self, key):
+        if not self.cache_dir:
+            return None
+        path = os.path.join(self.cache_dir, f"{key}.json")
+        try:
+            created_at = os.path.getmtime(path)
+            if time.time() - created_at > self.ttl:
+                os.remove(path)
+                return None
+            with open(path) as f:
+                serialized = f.read()
+            return created_at, len(serialized), json.loads(serialized)
+        except (OSError, ValueError):
+            return None
+
+    def _trim_disk(self):
+        """Removes expired disk entries, then the oldest ones above the disk byte and entry limits."""
+        entries = []
+        now = time.time()
+        try:
+            with os.scandir(self.cache_dir) as it:
+                for e in it:
+                    if not e.name.endswith(".json") or e.name.startswith("."):
+                        continue
+                    stat = e.stat()
+                    entries.append((stat.st_mtime, stat.st_size, e.path))
+        except OSError:
+            return
+        entries.sort()
+        total = sum(size for _, size, _ in entries)
+        count = len(entries)
+        for created_at, size, path in entries:
+            if now - created_at <= self.ttl and total <= self.disk_max_bytes and count <= self.disk_max_entries:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                continue
+            total -= size
+            count -= 1
+
+
+# Process-wide cache used by ml_engine.train_all_models_streaming
+result_cache = ResultCache()
@@ -0,0 +1,72 @@
+"""
+Chunked batch scoring with a saved model.
+
+The input is read in chunks of ML_BATCH_CHUNK_ROWS rows (ingest.iter_body_chunks).
+Each chunk goes through the training encoding (FeatureTransform: dummies
+reindexed to the training layout, scalers), one vectorised predict /
+predict_proba call, and is serialized and sent before the next chunk is read,
+so memory stays flat however large the input is.
+
+Output rows (NDJSON objects or CSV lines):
+    row           position of the row in the input (0-based)
+    <idColumn>    copied from the input, if requested
+    prediction    predicted label
+    p_<class>     class probabilities, if requested and the model has predict_proba
+"""
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from instrumentation import metrics
+
+BATCH_CHUNK_ROWS = int(os.environ.get("ML_BATCH_CHUNK_ROWS", "10000"))
+MAX_CHUNK_ROWS = 1_000_000
+
+OUTPUT_FORMATS = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+def score_chunks(loaded, chunks, probabilities=False, id_column=None):
+    """Yields one output DataFrame per input chunk (see module docstring)."""
+    offset = 0
+    for chunk in chunks:
+        if len(chunk) == 0:
+            continue
+        labels, proba = loaded.predict(chunk, probabilities=probabilities)
+        out = {"row": np.arange(offset, offset + len(chunk))}
+        if id_column:
+            out[id_column] = chunk[id_column].to_numpy()
+        out["prediction"] = labels
+        if proba is not None:
+            for idx, label in enumerate(loaded.classes):
+                out[f"p_{label}"] = proba[:, idx]
+        offset += len(chunk)
+        yield pd.DataFrame(out)
+
+
+def serialize_chunks(frames, output_format):
+    """
+    Yields the text of each scored chunk: NDJSON lines, or CSV with the header
+    on the first chunk. An error midway ends the output with an error record
+    (NDJSON) or a '# error:' line (CSV), since the status code has already been sent.
+    The error names the input row the failing chunk starts at: every row before
+    it was sent, so a client can resume from there.
+    """
+    first = True
+    row = 0
+    try:
+        for frame in frames:
+            if output_format == "csv":
+                yield frame.to_csv(index=False, header=first)
+            else:
+                yield frame.to_json(orient="records", lines=True, force_ascii=False) + "\n"
+            first = False
+            row += len(frame)
+    except Exception as e:
+        print(f"  ❌ Batch scoring failed in the chunk starting at row {row}: {str(e)}")
+        metrics.inc("ml_batch_scoring_errors_total")
+        if output_format == "csv":
+            yield f"# error at row {row}: {str(e)}\n"
+        else:
+            yield json.dumps({"error": str(e), "row": row}) + "\n"
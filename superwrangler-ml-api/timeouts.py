@@ -0,0 +1,83 @@
+"""
+Per-model wall-clock limits.
+
+A model predicted to take more than ISOLATE_FRACTION of the time limit is
+trained in its own subprocess (parallel.IsolatedRun), which is killed when the
+limit passes. It is then reported with status 'timeout' and the run carries
+on with the next model. Cheaper models still train in-process, because
+starting a process and attaching the shared data costs more than they do.
+
+The prediction is estimate_model_cost() (relative cost from the dataset shape)
+times the milliseconds per cost unit that model took in recent runs. Before a
+model's first run, the average over the models seen so far is used, or
+DEFAULT_MS_PER_COST before any run. A model that timed out is recorded at the
+limit, so it is isolated again the next time.
+"""
+import os
+import threading
+from collections import deque
+
+# Seconds one model may train (per request: "modelTimeLimit"); 0 = no limit
+MODEL_TIME_LIMIT = float(os.environ.get("ML_MODEL_TIME_LIMIT", "300"))
+
+# Models predicted to take more than this share of the limit run in a subprocess
+ISOLATE_FRACTION = 0.5
+
+# Fallback calibration (ms per estimate_model_cost unit), on the slow side
+DEFAULT_MS_PER_COST = 2e-3
+
+# How often a waiting parent checks deadlines and cancellation (seconds)
+POLL_SECONDS = 0.2
+
+HISTORY_SIZE = 5
+
+
+def resolve_time_limit(model_time_limit=None):
+    """Per-request limit, else ML_MODEL_TIME_LIMIT. None = no limit."""
+    limit = MODEL_TIME_LIMIT if model_time_limit is None else model_time_limit
+    return limit if limit and limit > 0 else None
+
+
+def elapsed_ms(result):
+    """Wall time of a result's fit, predict and cv phases (see memory.py)."""
+    memory = result.get("memory") or {}
+    return sum(phase["wallMs"] for phase in memory.values() if isinstance(phase, dict))
+
+
+class TimeHistory:
+    """Recent milliseconds per cost unit, per model."""
+
+    def __init__(self, size=HISTORY_SIZE):
+        self.size = size
+        self._rates = {}
+        self._lock = threading.Lock()
+
+    def record(self, name, result, cost):
+        """Adds the observation from a finished (or timed out) model."""
+        if result["status"] == "timeout":
+            ms = result["timeLimit"] * 1000
+        else:
+            ms = elapsed_ms(result)
+        if not ms or not cost:
+            return
+        with self._lock:
+            self._rates.setdefault(name, deque(maxlen=self.size)).append(ms / cost)
+
+    def ms_per_cost(self, name):
+        with self._lock:
+            observed = self._rates.get(name)
+            if observed:
+                return max(observed)
+            everything = [max(rates) for rates in self._rates.values() if rates]
+        return sum(everything) / len(everything) if everything else DEFAULT_MS_PER_COST
+
+    def predict_seconds(self, name, cost):
+        return self.ms_per_cost(name) * cost / 1000
+
+
+def needs_isolation(predicted_seconds, time_limit):
+    return time_limit is not None and predicted_seconds > time_limit * ISOLATE_FRACTION
+
+
+# Process-wide time history, fed by train_all_models_streaming
+time_history = TimeHistory()
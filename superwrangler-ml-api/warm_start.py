@@ -0,0 +1,230 @@
+"""
+Warm-start updates of a saved training run.
+
+POST /api/models/<id>/update takes rows appended to the dataset of a saved run.
+Instead of retraining from scratch, every saved model of the run continues
+from its fitted state on the new rows only ("updateStrategy" of each result):
+
+  continued    XGBoost, LightGBM, CatBoost: boosting continues from the saved
+               trees (xgb_model / init_model)
+  warm_start   Extra Trees Ensemble, Bagging Classifier, Gradient Boosting,
+               Histogram Gradient Boosting: warm_start=True, the added trees
+               are fitted on the new rows
+  partial_fit  SGD Classifier, Perceptron: one partial_fit on the new rows
+  unchanged    models without an incremental API, and tree models when the new
+               rows do not contain every class; kept as saved and re-scored
+
+Tree models add trees in proportion to the new rows:
+max(1, round(trees * new training rows / previous training rows)).
+
+The new rows are split 80/20 like a training run. The models update on the
+80% and are scored (before and after the update) on the 20%. The saved
+FeatureTransform encodes the rows, so categories first seen in the new rows
+are encoded as unseen. The updated models are saved under a new model id
+(with parentModelId); the previous model stays as it was.
+
+timeSaved compares each update with a full retrain, estimated from the saved
+training time scaled to the combined number of training rows.
+"""
+import time
+
+import numpy as np
+import pandas as pd
+from sklearn.metrics import f1_score
+
+from encoding import model_inputs, take_rows
+from evaluation import evaluate_fitted
+from out_of_core import PARTIAL_FIT_MODELS
+from preprocess_cache import dataset_fingerprint
+from registry import model_registry, rows_frame, save_model
+
+# Boosters continued from their saved trees, with the parameter that counts the trees
+CONTINUED_MODELS = {"XGBoost": "n_estimators", "LightGBM": "n_estimators", "CatBoost": "iterations"}
+
+# Tree ensembles grown with warm_start, with the parameter that counts the trees
+WARM_START_MODELS = {
+    "Extra Trees Ensemble": "n_estimators",
+    "Bagging Classifier": "n_estimators",
+    "Gradient Boosting": "n_estimators",
+    "Histogram Gradient Boosting": "max_iter",
+}
+
+
+def update_strategy(name):
+    if name in CONTINUED_MODELS:
+        return "continued"
+    if name in WARM_START_MODELS:
+        return "warm_start"
+    if name in PARTIAL_FIT_MODELS:
+        return "partial_fit"
+    return "unchanged"
+
+
+def _tree_count(name, model):
+    """Trees (boosting rounds) a fitted tree model has."""
+    if name == "XGBoost":
+        return model.get_booster().num_boosted_rounds()
+    if name == "LightGBM":
+        return model.booster_.current_iteration()
+    if name == "CatBoost":
+        return model.tree_count_
+    if name == "Histogram Gradient Boosting":
+        return model.n_iter_
+    if name == "Gradient Boosting":
+        return model.n_estimators_
+    return len(model.estimators_)
+
+
+def _update(name, model, X, y, old_rows):
+    """
+    Continues one fitted model on the new rows (in place, except CatBoost).
+    Returns (updated model, strategy, trees added).
+    """
+    strategy = update_strategy(name)
+    if strategy == "partial_fit":
+        model.partial_fit(X, y)
+        return model, strategy, None
+    if strategy == "unchanged" or len(np.unique(y)) < len(model.classes_):
+        # The tree learners re-derive the classes from y: a missing class would remap them
+        return model, "unchanged", None
+
+    trees = _tree_count(name, model)
+    added = max(1, round(trees * len(y) / max(old_rows, 1)))
+    if strategy == "warm_start":
+        param = WARM_START_MODELS[name]
+        model.set_params(warm_start=True, **{param: trees + added})
+        model.fit(X, y)
+        model.set_params(warm_start=False)
+        return model, strategy, added
+
+    if name == "CatBoost":
+        # A fitted CatBoost model cannot change its params: continue into a new one
+        continued = type(model)(**dict(model.get_params(), iterations=added))
+        continued.fit(X, y, init_model=model)
+        return continued, strategy, added
+
+    param = CONTINUED_MODELS[name]
+    model.set_params(**{param: added})
+    if name == "XGBoost":
+        model.fit(X, y, xgb_model=model.get_booster())
+    else:
+        model.fit(X, y, init_model=model.booster_)
+    model.set_params(**{param: trees + added})
+    return model, strategy, added
+
+
+def _model_labels(y, meta):
+    """
+    The labels the saved models were trained on: label codes for compact runs,
+    the labels themselves otherwise. Raises ValueError for a label the run never saw.
+    """
+    label_classes = meta.get("labelClasses")
+    known = pd.Index(label_classes if label_classes is not None else meta["classes"])
+    codes = known.get_indexer(y)
+    if (codes < 0).any():
+        unknown = pd.unique(y[codes < 0])[:5]
+        raise ValueError(f"New rows have labels the model was not trained on: {', '.join(map(str, unknown))}")
+    if label_classes is not None:
+        return codes.astype(np.int32)
+    return y
+
+
+def update_run(model_id, rows, registry=model_registry):
+    """
+    Updates every saved model of a run with appended rows (list of row dicts or
+    a DataFrame, including the target column) and saves them as a new model.
+    Raises ModelNotFoundError, or ValueError for unusable rows.
+    """
+    from ml_engine import _split_indices, build_result, failed_result
+
+    start = time.time()
+    meta, transform, estimators = registry.checkout(model_id)
+    target_column = meta["targetColumn"]
+    df = rows_frame(rows)
+    if target_column not in df.columns:
+        raise ValueError(f"Target column '{target_column}' not found in the new rows")
+    if len(df) < 10:
+        raise ValueError("Need at least 10 new rows to update a model.")
+
+    y = _model_labels(df[target_column].to_numpy(), meta)
+    encoded = transform.transform(df.drop(columns=[target_column]))
+    train_idx, test_idx = _split_indices(y)
+    y_train, y_test = y[train_idx], y[test_idx]
+    old_rows = meta["datasetInfo"]["trainSize"]
+    scale = (old_rows + len(train_idx)) / max(old_rows, 1)
+    print(f"[UPDATE] {model_id}: {len(df)} new rows for {len(estimators)} saved model(s)")
+
+    new_id = dataset_fingerprint(df, target_column, extra=["update", model_id])[:20]
+    staging = registry.begin(new_id)
+    results = []
+    models_meta = {}
+    try:
+        for name, model in estimators.items():
+            inputs = model_inputs(name, encoded)
+            X_train, X_test = take_rows(inputs, train_idx), take_rows(inputs, test_idx)
+            saved = meta["models"][name]
+            try:
+                f1_before = f1_score(y_test, np.ravel(model.predict(X_test)), average="weighted", zero_division=0)
+                fit_start = time.perf_counter()
+                model, strategy, added = _update(name, model, X_train, y_train, old_rows)
+                update_ms = (time.perf_counter() - fit_start) * 1000
+                metrics, _ = evaluate_fitted(model, X_train, y_train, X_test, y_test)
+            except Exception as e:
+                print(f"  ❌ {name} update failed: {str(e)}")
+                results.append(dict(failed_result(name, e), updateStrategy=update_strategy(name)))
+                continue
+
+            # No CV on an update: the holdout F1 stands in for it
+            result = build_result(name, model.get_params(), metrics, metrics["f1"], 0.0, update_ms)
+            full_ms = saved.get("fullTrainingTime", saved.get("trainingTime"))
+            full_ms = full_ms * scale if full_ms is not None else None
+            result.update(
+                updateStrategy=strategy,
+                treesAdded=added,
+                f1Before=float(f1_before),
+                fullRetrainEstimate=full_ms,
+                timeSaved=full_ms - update_ms if full_ms is not None else None,
+            )
+            results.append(result)
+            save_model(staging, name, model)
+            models_meta[name] = {"f1Score": result["f1Score"], "accuracy": result["accuracy"],
+                                 "trainingTime": update_ms, "fullTrainingTime": full_ms}
+            print(f"  ✓ {name} ({strategy}) F1: {f1_before:.4f} -> {result['f1Score']:.4f}")
+
+        successful = [r for r in results if r["status"] == "success"]
+        if not successful:
+            raise RuntimeError("All model updates failed")
+        best = max(successful, key=lambda r: r["f1Score"])
+        metadata = {
+            key: value for key, value in meta.items() if key not in ("modelId", "createdAt", "models")
+        }
+        metadata.update(
+            models=models_meta,
+            bestModel=best["algorithm"],
+            parentModelId=model_id,
+            datasetInfo=dict(meta["datasetInfo"], samples=meta["datasetInfo"]["samples"] + len(df),
+                             trainSize=old_rows + len(train_idx), testSize=len(test_idx)),
+        )
+        saved_models = registry.commit(new_id, staging, list(models_meta), metadata, transform)
+    except BaseException:
+        registry.discard(staging)
+        raise
+
+    estimates = [r.get("fullRetrainEstimate") for r in successful]
+    full_total = sum(estimates) if None not in estimates else None
+    update_total = sum(r["trainingTime"] for r in successful)
+    total_time = (time.time() - start) * 1000
+    print(f"[UPDATE] Saved {new_id} ({total_time:.0f}ms)")
+    return {
+        "modelId": new_id,
+        "parentModelId": model_id,
+        "results": results,
+        "bestModel": best,
+        "newRows": len(df),
+        "trainRows": len(train_idx),
+        "testRows": len(test_idx),
+        "savedModels": saved_models,
+        "totalTime": total_time,
+        "fullRetrainEstimate": full_total,
+        "timeSaved": full_total - update_total if full_total is not None else None,
+    }